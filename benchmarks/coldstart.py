@@ -0,0 +1,90 @@
+"""Measure how long posting one line from a script takes, start to finish.
+
+Starts a server in a child process, then runs `netcomm-send` repeatedly, each
+time in a fresh interpreter, first connecting directly and then through a
+`netcomm-proxy`. For comparison, it also times starting an interpreter that
+only imports the interactive CLI (`cli.main`), which is what `netcomm-cli`
+does before it even connects:
+
+    python benchmarks/coldstart.py --runs 50
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+from networking.bench import start_server  # noqa: E402
+
+ENV = dict(os.environ, PYTHONPATH=SRC)
+
+
+def time_runs(command, runs: int, stdin: bytes = b"") -> list:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, input=stdin, env=ENV, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(label: str, times: list):
+    print(
+        f"{label:>14}: median {1000 * statistics.median(times):.1f} ms, "
+        f"min {1000 * min(times):.1f} ms"
+    )
+
+
+def wait_for_socket(path: str, process: subprocess.Popen):
+    while not os.path.exists(path):
+        if process.poll() is not None:
+            raise RuntimeError("The proxy did not start")
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Script cold-start benchmark")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--port", type=int, default=50300)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    python = sys.executable
+    send = [python, "-c", "from cli.pipe import send_main; send_main()"]
+    port = ["--port", str(args.port)]
+    report(
+        "import cli.main",
+        time_runs([python, "-c", "import cli.main"], args.runs),
+    )
+    server = start_server({"host": "127.0.0.1", "port": args.port})
+    socket_path = os.path.join(tempfile.mkdtemp(), "proxy.sock")
+    proxy = subprocess.Popen(
+        [python, "-c", "from cli.pipe import proxy_main; proxy_main()"]
+        + port
+        + ["--socket", socket_path],
+        env=ENV,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_socket(socket_path, proxy)
+        report("send (direct)", time_runs(send + port, args.runs, b"ping\n"))
+        report(
+            "send (proxy)",
+            time_runs(send + port + ["--proxy", socket_path], args.runs, b"ping\n"),
+        )
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compare the streams and protocol transport engines.
+
+Starts an in-process server for each engine, connects a number of receivers and
+one sender, then measures how long it takes for every receiver to get a burst of
+messages.
+
+    python benchmarks/engines.py --clients 50 --messages 2000 [--uvloop]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from networking.client import Client  # noqa: E402
+from networking.loop import use_uvloop  # noqa: E402
+from networking.protocol.framing import ENGINES  # noqa: E402
+from networking.server import Server  # noqa: E402
+
+
+async def drain(client: Client, count: int):
+    received = 0
+    while received < count:
+        received += len(await client.receive_batch())
+
+
+async def run(engine: str, port: int, clients: int, messages: int, size: int):
+    server = Server(host="127.0.0.1", port=port, engine=engine, queue_size=messages)
+    server_task = asyncio.create_task(server.start())
+    await asyncio.sleep(0.1)
+
+    receivers = [
+        Client(port=port, alias=f"r{i}", engine=engine) for i in range(clients)
+    ]
+    for receiver in receivers:
+        await receiver.connect()
+    sender = Client(port=port, alias="sender", engine=engine)
+    await sender.connect()
+    # Each receiver first sees who is online, then the join announcements of
+    # everyone after it.
+    for i, receiver in enumerate(receivers):
+        await drain(receiver, clients - i + 1)
+
+    payload = "x" * size
+    start = time.perf_counter()
+    waiters = [asyncio.create_task(drain(r, messages)) for r in receivers]
+    for _ in range(messages):
+        await sender.send_message(payload)
+    await asyncio.gather(*waiters)
+    elapsed = time.perf_counter() - start
+
+    for client in receivers + [sender]:
+        client.writer.close()
+    server_task.cancel()
+    delivered = clients * messages
+    print(
+        f"{engine:>8}: {elapsed:.3f}s, {messages / elapsed:,.0f} msg/s in, "
+        f"{delivered / elapsed:,.0f} msg/s delivered"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transport engine benchmark")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=64, help="Message size in bytes")
+    parser.add_argument("--port", type=int, default=50100)
+    parser.add_argument("--uvloop", action="store_true", help="Use uvloop")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    if args.uvloop and not use_uvloop():
+        print("uvloop is not installed, using the default event loop.")
+    for offset, engine in enumerate(ENGINES):
+        asyncio.run(
+            run(engine, args.port + offset, args.clients, args.messages, args.size)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Measure TLS handshake throughput, with and without session resumption.
+
+Starts a TLS server in a child process, then opens and closes connections to it
+from a pool of clients. The run is repeated with session tickets disabled, so
+every handshake is a full one, and enabled, so clients resume the session of
+their previous connection. Needs a certificate, such as a self-signed one:
+
+    openssl req -x509 -newkey rsa:2048 -nodes -days 365 -subj /CN=localhost \\
+        -keyout ssl/server.key -out ssl/server.crt
+    python benchmarks/handshakes.py --connections 2000 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from networking.bench import ProcessStats, start_server  # noqa: E402
+from networking.client import Client  # noqa: E402
+from networking.tls import CERT_FILE, KEY_FILE, TLS_TICKETS  # noqa: E402
+
+
+async def warm_up(port: int):
+    client = Client(port=port, alias="warmup", tls=True)
+    await client.connect()
+    client.writer.close()
+
+
+async def connect_many(port: int, connections: int, concurrency: int) -> dict:
+    resumed = 0
+    remaining = iter(range(connections))
+
+    async def worker(index: int):
+        nonlocal resumed
+        for _ in remaining:
+            client = Client(port=port, alias=f"h{index}", tls=True)
+            await client.connect()
+            resumed += client.session_reused
+            client.writer.close()
+
+    # One connection first, so there is a session to resume.
+    await warm_up(port)
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"elapsed": elapsed, "resumed": resumed}
+
+
+def run(port: int, tickets: int, args: argparse.Namespace):
+    server_kwargs = dict(
+        host="127.0.0.1",
+        port=port,
+        tls=True,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+        tls_tickets=tickets,
+    )
+    process = start_server(server_kwargs)
+    stats = ProcessStats(process.pid)
+    try:
+        cpu_start = stats.cpu_seconds()
+        result = asyncio.run(connect_many(port, args.connections, args.concurrency))
+        cpu = stats.cpu_seconds() - cpu_start
+    finally:
+        process.terminate()
+        process.join()
+    label = "resumed" if tickets else "full"
+    print(
+        f"{label:>8}: {args.connections / result['elapsed']:,.0f} handshakes/s, "
+        f"{result['resumed']}/{args.connections} resumed, "
+        f"server CPU {1000 * cpu / args.connections:.3f} ms/handshake"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TLS handshake benchmark")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--port", type=int, default=50200)
+    parser.add_argument("--certfile", default=CERT_FILE)
+    parser.add_argument("--keyfile", default=KEY_FILE)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    for offset, tickets in enumerate((0, TLS_TICKETS)):
+        run(args.port + offset, tickets, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare loopback TCP, TLS and Unix socket connections to the same server.
+
+Runs the load generator of `netcomm-bench` once per transport, each time
+against a fresh server in a child process, and prints the latency percentiles
+and delivery rate. TLS needs a certificate, such as a self-signed one in `ssl/`
+(see `benchmarks/handshakes.py`); without one it is skipped.
+
+    python benchmarks/transports.py --clients 100 --senders 10 --rate 100
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from networking.bench import Benchmark, start_server  # noqa: E402
+from networking.tls import CERT_FILE, KEY_FILE  # noqa: E402
+
+
+def run(label: str, host: str, port: int, server_kwargs: dict, args):
+    process = start_server(dict(server_kwargs, host="127.0.0.1", port=port))
+    benchmark = Benchmark(
+        host,
+        port,
+        args.clients,
+        args.senders,
+        args.rate,
+        args.duration,
+        args.size,
+        tls=server_kwargs.get("tls", False),
+    )
+    try:
+        results = asyncio.run(benchmark.run())
+    finally:
+        process.terminate()
+        process.join()
+    latency = results["latency_ms"]
+    print(
+        f"{label:>5}: p50 {latency['p50']} ms, p99 {latency['p99']} ms, "
+        f"{results['delivered_per_second']:,.0f} msg/s delivered "
+        f"({results['received']}/{results['expected']})"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transport benchmark")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=100)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--size", type=int, default=64, help="Message size in bytes")
+    parser.add_argument("--port", type=int, default=50400)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    run("tcp", "127.0.0.1", args.port, {}, args)
+    if os.path.exists(CERT_FILE) and os.path.exists(KEY_FILE):
+        run("tls", "127.0.0.1", args.port + 1, {"tls": True}, args)
+    else:
+        print(f"  tls: skipped, no certificate at {CERT_FILE}")
+    path = os.path.join(tempfile.mkdtemp(), "netcomm.sock")
+    run("unix", f"unix://{path}", args.port + 2, {"unix_socket": path}, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,86 @@
 import asyncio
 import argparse
+import sys
+from collections import deque
+from typing import Deque, Iterable
 
 from prompt_toolkit.patch_stdout import patch_stdout
 from prompt_toolkit.shortcuts import PromptSession
 
 from networking.client import Client
 
+REFRESH_INTERVAL = 0.05
+SCROLLBACK = 1000
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
 
 class ClientCLI:
-    def __init__(self, client: Client):
+    """An interactive chat prompt, or with `prompt=False` a plain stream of messages.
+
+    Incoming messages are collected and printed together every `refresh_interval`
+    seconds, so the prompt is redrawn once per batch rather than once per
+    message. If more than `scrollback` messages arrive between two refreshes,
+    the oldest are skipped and a line says how many. Without a prompt, messages
+    are written to stdout through a large buffer and none are skipped.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        refresh_interval: float = REFRESH_INTERVAL,
+        scrollback: int = SCROLLBACK,
+        prompt: bool = True,
+    ):
         self.client = client
+        self.refresh_interval = refresh_interval
+        self.scrollback = scrollback
+        self.prompt = prompt
         self.pending_tasks = []
         self.stop_event = asyncio.Event()
-        self.client.set_message_callback(self._message_callback)
+        self.pending: Deque[str] = deque()
+        self.skipped = 0
+        self.output = None
+        if not prompt:
+            self.output = open(
+                sys.stdout.fileno(),
+                "w",
+                buffering=OUTPUT_BUFFER_SIZE,
+                encoding=sys.stdout.encoding,
+                errors="replace",
+                closefd=False,
+            )
+
+    def add_lines(self, lines: Iterable[str]):
+        self.pending.extend(lines)
+        if self.prompt:
+            overflow = len(self.pending) - self.scrollback
+            for _ in range(overflow):
+                self.pending.popleft()
+            self.skipped += max(overflow, 0)
 
-    def _message_callback(self, message: str):
-        print(f"\r{message}")
+    def flush(self):
+        if not self.pending and not self.skipped:
+            return
+        lines = list(self.pending)
+        self.pending.clear()
+        if self.skipped:
+            lines.insert(0, f"... {self.skipped} messages skipped ...")
+            self.skipped = 0
+        if self.output is not None:
+            self.output.write("\n".join(lines) + "\n")
+            self.output.flush()
+        else:
+            print("\n".join(lines))
 
     async def send_loop(self):
         session = PromptSession()
         try:
-            with patch_stdout():
-                while True:
-                    message = await session.prompt_async("> ")
-                    if message.lower() in ("exit", "quit"):
-                        self.stop_event.set()
-                        break
+            while True:
+                message = await session.prompt_async("> ")
+                if message.lower() in ("exit", "quit"):
+                    self.stop_event.set()
+                    break
+                if not await self.client.run_command(message):
                     await self.client.send_message(message)
         except (EOFError, KeyboardInterrupt, ConnectionError):
             self.stop_event.set()
@@ -35,28 +90,37 @@ class ClientCLI:
     async def receive_loop(self):
         try:
             while True:
-                message = await self.client.receive_message()
-                if message is None:
-                    break
+                messages = await self.client.receive_batch()
+                self.add_lines(str(message) for message in messages)
         except ConnectionError:
             self.stop_event.set()
         except asyncio.CancelledError:
             raise
 
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            self.flush()
+
     async def start(self):
         try:
             await self.client.connect()
-            print(
-                f"Connected to {self.client.host}:{self.client.port} as {self.client.alias}"
-            )
+            client = self.client
+            self.add_lines([f"Connected to {client.address} as {client.alias}"])
         except ConnectionError as e:
-            print(f"Connection error: {e}")
+            print(f"Connection error: {e}", file=sys.stderr)
             return
         recv_task = asyncio.create_task(self.receive_loop())
-        send_task = asyncio.create_task(self.send_loop())
-        self.pending_tasks = [recv_task, send_task]
-        await self.stop_event.wait()
-        await self.stop()
+        flush_task = asyncio.create_task(self.flush_loop())
+        self.pending_tasks = [recv_task, flush_task]
+        if self.prompt:
+            with patch_stdout():
+                self.pending_tasks.append(asyncio.create_task(self.send_loop()))
+                await self.stop_event.wait()
+                await self.stop()
+        else:
+            await self.stop_event.wait()
+            await self.stop()
 
     async def stop(self):
         self.stop_event.clear()
@@ -64,9 +128,10 @@ class ClientCLI:
             task.cancel()
         self.pending_tasks.clear()
         if self.client.writer:
-            self.client.writer.close()
+            self.client.close()
             await self.client.writer.wait_closed()
-        print("Client disconnected.")
+        self.add_lines(["Client disconnected."])
+        self.flush()
 
 
 def main():
@@ -75,7 +140,8 @@ def main():
         "--host",
         type=str,
         default="127.0.0.1",
-        help="Server host address (default: 127.0.0.1)",
+        help="Server host address, or unix://PATH for its Unix socket "
+        "(default: 127.0.0.1)",
     )
     parser.add_argument(
         "--port",
@@ -90,11 +156,34 @@ def main():
         help="Client alias (default: Anonymous)",
     )
     parser.add_argument("--tls", action="store_true", help="Enable TLS")
+    parser.add_argument(
+        "--refresh-interval",
+        type=float,
+        default=REFRESH_INTERVAL,
+        help=f"Seconds between screen updates (default: {REFRESH_INTERVAL})",
+    )
+    parser.add_argument(
+        "--scrollback",
+        type=int,
+        default=SCROLLBACK,
+        help="Most messages printed per update; older ones are skipped "
+        f"(default: {SCROLLBACK})",
+    )
+    parser.add_argument(
+        "--no-prompt",
+        action="store_true",
+        help="Only write received messages to stdout, without a prompt",
+    )
 
     args = parser.parse_args()
-    client = Client(host=args.host, port=args.port, alias=args.alias, tls=args.tls)
-    cli = ClientCLI(client)
-    asyncio.run(cli.start())
+    client = Client(
+        host=args.host, port=args.port, alias=args.alias, tls=args.tls, reconnect=True
+    )
+    cli = ClientCLI(client, args.refresh_interval, args.scrollback, not args.no_prompt)
+    try:
+        asyncio.run(cli.start())
+    except KeyboardInterrupt:
+        cli.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,308 @@
+"""Non-interactive clients for scripts.
+
+`netcomm-send` posts the lines of its standard input, `netcomm-tail` prints the
+messages received, and `netcomm-proxy` keeps one connection to the server open
+on behalf of many short-lived `netcomm-send --proxy` runs. Unlike `netcomm-cli`,
+none of them import prompt_toolkit, and the client is only imported once it is
+needed: `netcomm-send --proxy` hands its input to the proxy over a Unix socket
+without importing asyncio at all.
+
+The proxy protocol is plain text: the room (empty for the lobby) on the first line,
+then one message per line until the sender shuts down its side of the
+connection. The proxy then answers with a status line, `ok` once every message
+was handed to its connection to the server, or `error` and the reason.
+
+By default the proxy listens in `$XDG_RUNTIME_DIR`, or else in a directory of
+the temporary directory that only the user may access, so that other users can
+neither read what is sent through it nor stand in for it.
+"""
+
+import argparse
+import os
+import stat
+import sys
+
+READ_SIZE = 64 * 1024
+PROXY_SOCKET_NAME = "netcomm-proxy.sock"
+STATUS_OK = b"ok\n"
+
+
+def default_proxy_socket() -> str:
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, PROXY_SOCKET_NAME)
+    temp = os.environ.get("TMPDIR") or "/tmp"
+    directory = os.path.join(temp, f"netcomm-{os.getuid()}")
+    return os.path.join(directory, PROXY_SOCKET_NAME)
+
+
+def check_private_directory(directory: str, create: bool = False):
+    """Make sure only the current user can access `directory`.
+
+    Raises:
+        PermissionError: If it belongs to another user or others may access it.
+    """
+    if create:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{directory} is not a directory of this user")
+    if info.st_mode & 0o077:
+        raise PermissionError(f"{directory} is not private to this user")
+
+
+def add_client_arguments(parser: argparse.ArgumentParser, alias: str):
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Server host address, or unix://PATH for its Unix socket "
+        "(default: 127.0.0.1)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=50000,
+        help="Server port (default: 50000)",
+    )
+    parser.add_argument(
+        "--alias",
+        type=str,
+        default=alias,
+        help=f"Client alias (default: {alias})",
+    )
+    parser.add_argument("--tls", action="store_true", help="Enable TLS")
+
+
+def create_client(args: argparse.Namespace, **kwargs):
+    from networking.client import Client
+
+    return Client(
+        host=args.host, port=args.port, alias=args.alias, tls=args.tls, **kwargs
+    )
+
+
+def split_lines(data: bytes, partial: bytes):
+    """Split a chunk read from a stream into complete lines.
+
+    An empty chunk marks the end of the stream, which completes the last line.
+
+    Returns:
+        Tuple[List[str], bytes]: The decoded lines, and the incomplete line at
+            the end of the chunk, to be prepended to the next one.
+    """
+    lines = (partial + data).split(b"\n")
+    partial = lines.pop() if data else b""
+    return [line.decode(errors="replace") for line in lines if line], partial
+
+
+async def send_stream(client, stream, room: str):
+    """Send every line of a binary stream, each chunk read with a single write."""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    partial = b""
+    while True:
+        # read1 returns whatever is available, so lines are sent as they come
+        # when the input is a slow pipe, and in large batches otherwise.
+        data = await loop.run_in_executor(None, stream.read1, READ_SIZE)
+        lines, partial = split_lines(data, partial)
+        if lines:
+            await client.send_many(lines, room)
+        if not data:
+            return
+
+
+async def send_direct(args: argparse.Namespace):
+    client = create_client(args)
+    await client.connect()
+    try:
+        if args.room:
+            # The server only takes messages to rooms the sender is in.
+            await client.join_room(args.room)
+        await send_stream(client, sys.stdin.buffer, args.room)
+    finally:
+        client.close()
+        await client.writer.wait_closed()
+
+
+def send_through_proxy(path: str, room: str) -> bool:
+    """Hand standard input over to a running proxy.
+
+    Returns:
+        bool: False if no proxy is listening at `path`.
+    Raises:
+        ConnectionError: If the proxy did not confirm that it sent everything.
+    """
+    import socket
+
+    if path == default_proxy_socket():
+        try:
+            check_private_directory(os.path.dirname(path))
+        except FileNotFoundError:
+            return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return False
+    with sock:
+        sock.sendall(room.encode() + b"\n")
+        while True:
+            data = sys.stdin.buffer.read1(READ_SIZE)
+            if not data:
+                break
+            sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        status = b""
+        while True:
+            data = sock.recv(READ_SIZE)
+            if not data:
+                break
+            status += data
+    if status != STATUS_OK:
+        reason = status.decode(errors="replace").strip() or "no status"
+        raise ConnectionError(f"The proxy did not send everything ({reason})")
+    return True
+
+
+def send_main():
+    parser = argparse.ArgumentParser(
+        description="Send each line of standard input as a chat message"
+    )
+    add_client_arguments(parser, "netcomm-send")
+    parser.add_argument(
+        "--room", default="", help="Room to send to (default: the lobby)"
+    )
+    parser.add_argument(
+        "--proxy",
+        nargs="?",
+        const=default_proxy_socket(),
+        metavar="PATH",
+        help="Send through the netcomm-proxy listening at PATH "
+        f"(default: {default_proxy_socket()}), connecting directly if it is not "
+        "running",
+    )
+    args = parser.parse_args()
+    try:
+        if args.proxy and send_through_proxy(args.proxy, args.room):
+            return
+        import asyncio
+
+        asyncio.run(send_direct(args))
+    except (ConnectionError, PermissionError) as e:
+        print(f"Connection error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+async def tail(args: argparse.Namespace):
+    client = create_client(args, reconnect=True)
+    await client.connect()
+    for room in args.room:
+        await client.join_room(room)
+    output = sys.stdout
+    try:
+        async for messages in client.messages(batch=True):
+            output.write("".join(f"{message}\n" for message in messages))
+            output.flush()
+    finally:
+        client.close()
+
+
+def tail_main():
+    parser = argparse.ArgumentParser(
+        description="Write the messages received to standard output"
+    )
+    add_client_arguments(parser, "netcomm-tail")
+    parser.add_argument(
+        "--room", action="append", default=[], help="Room to join (repeatable)"
+    )
+    args = parser.parse_args()
+    import asyncio
+
+    try:
+        asyncio.run(tail(args))
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # The reader went away, as with `netcomm-tail | head`. Point stdout at
+        # /dev/null so flushing it on exit does not fail again.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+    except ConnectionError as e:
+        print(f"Connection error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+async def proxy(args: argparse.Namespace):
+    import asyncio
+
+    from networking.protocol.messages import DEFAULT_ROOM
+
+    client = create_client(args, reconnect=True)
+    await client.connect()
+    # Messages without a room would go to the last room joined, so they are
+    # sent to the lobby by name instead.
+    joined = {DEFAULT_ROOM}
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        status = STATUS_OK
+        try:
+            room = (await reader.readline()).decode(errors="replace").strip()
+            room = room or DEFAULT_ROOM
+            if room not in joined:
+                # The server only takes messages to rooms the sender is in.
+                await client.join_room(room)
+                joined.add(room)
+            partial = b""
+            while True:
+                data = await reader.read(READ_SIZE)
+                lines, partial = split_lines(data, partial)
+                if lines:
+                    await client.send_many(lines, room)
+                if not data:
+                    break
+        except ConnectionError as e:
+            reason = str(e) or type(e).__name__
+            status = f"error {reason}\n".encode()
+            print(f"Connection error: {reason}", file=sys.stderr)
+        try:
+            writer.write(status)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    if args.socket == default_proxy_socket():
+        check_private_directory(os.path.dirname(args.socket), create=True)
+    server = await asyncio.start_unix_server(handle, args.socket)
+    print(f"Proxying {args.socket} to {client.address}", file=sys.stderr)
+    async with server:
+        # Received messages are discarded, but reading them keeps the server
+        # from backing up and notices when the connection needs re-establishing.
+        async for _ in client.messages(batch=True):
+            pass
+
+
+def proxy_main():
+    parser = argparse.ArgumentParser(
+        description="Keep a connection open for netcomm-send --proxy"
+    )
+    add_client_arguments(parser, "netcomm-send")
+    parser.add_argument(
+        "--socket",
+        default=default_proxy_socket(),
+        help=f"Unix socket path to listen on (default: {default_proxy_socket()})",
+    )
+    args = parser.parse_args()
+    import asyncio
+
+    try:
+        asyncio.run(proxy(args))
+    except KeyboardInterrupt:
+        pass
+    except (ConnectionError, PermissionError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -1,4 +1,5 @@
 import sys
+import argparse
 import asyncio
 import logging
 from PyQt5.QtWidgets import QApplication, QMessageBox
@@ -6,6 +7,8 @@ from PyQt5.QtCore import QObject, pyqtSignal, QTimer
 import qasync
 
 from networking.client import Client
+from networking.protocol.messages import MessageType
+from .widgets.chat_view import SCROLLBACK
 from .widgets.chat_window import ChatWindow
 from .widgets.connect_dialog import ConnectDialog
 
@@ -14,13 +17,13 @@ logging.basicConfig(level=logging.INFO)
 
 
 class ChatApplication(QObject):
-    message_received = pyqtSignal(str)
+    messages_received = pyqtSignal(list)
     connection_status = pyqtSignal(bool)
 
-    def __init__(self):
+    def __init__(self, scrollback: int = SCROLLBACK):
         super().__init__()
         self.client = None
-        self.chat_window = ChatWindow()
+        self.chat_window = ChatWindow(scrollback)
 
         self.setup_connections()
         self.chat_window.show()
@@ -30,7 +33,7 @@ class ChatApplication(QObject):
         self.chat_window.message_sent.connect(self.handle_send_message)
         self.chat_window.disconnect_requested.connect(self.disconnect)
         self.chat_window.window_closing.connect(self.handle_window_close)
-        self.message_received.connect(self.chat_window.add_message)
+        self.messages_received.connect(self.chat_window.add_messages)
         self.connection_status.connect(self.chat_window.set_connected)
 
     def handle_send_message(self, message: str):
@@ -50,13 +53,14 @@ class ChatApplication(QObject):
         )
 
     async def connect_to_server(self, host: str, port: int, alias: str, tls: bool):
-        self.client = Client(host, port, alias, tls=tls)
-        self.client.set_message_callback(self.on_message_received)
+        self.client = Client(host, port, alias, tls=tls, reconnect=True)
 
         try:
             await self.client.connect()
             self.connection_status.emit(True)
-            self.chat_window.add_message(f"Connected to {host}:{port} as {alias}")
+            self.chat_window.add_message(
+                f"Connected to {self.client.address} as {alias}", MessageType.SYSTEM
+            )
             asyncio.create_task(self.listen_for_messages())
         except Exception as e:
             logger.error(f"Connection error: {e}")
@@ -64,48 +68,67 @@ class ChatApplication(QObject):
             QMessageBox.critical(self.chat_window, "Connection Error", str(e))
             self.show_connect_dialog()
 
-    def on_message_received(self, message: str):
-        self.message_received.emit(message)
-
     async def send_message(self, message: str):
         if self.client and self.client.writer:
+            if await self.client.run_command(message):
+                return
             self.chat_window.add_message(f"You: {message}")
             await self.client.send_message(message)
 
     def disconnect(self, show_dialog=True):
         if self.client and self.client.writer:
-            self.client.writer.close()
+            self.client.close()
             self.client = None
             self.connection_status.emit(False)
-            self.chat_window.add_message("Disconnected from server")
+            self.chat_window.add_message("Disconnected from server", MessageType.SYSTEM)
             if show_dialog:
                 self.show_connect_dialog()
 
     def handle_window_close(self):
         if self.client and self.client.writer:
-            self.client.writer.close()
+            self.client.close()
         QApplication.quit()
 
     async def listen_for_messages(self):
+        connected = True
         try:
             while self.client and self.client.reader:
-                await self.client.receive_message()
+                # One signal per batch of messages read together, rather than
+                # one per message; the chat view coalesces them further.
+                messages = await self.client.receive_batch()
+                self.messages_received.emit(
+                    [(str(message), message.type) for message in messages]
+                )
+                if self.client and self.client.connected != connected:
+                    # Lost, or back after reconnecting.
+                    connected = self.client.connected
+                    self.connection_status.emit(connected)
         except Exception as e:
             logger.error(f"Error receiving message: {e}")
             self.connection_status.emit(False)
-            self.chat_window.add_message("Connection lost")
+            self.chat_window.add_message("Connection lost", MessageType.SYSTEM)
 
 
 def main():
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="NetComm GUI client")
+    parser.add_argument(
+        "--scrollback",
+        type=int,
+        default=SCROLLBACK,
+        help=f"Messages kept in the chat view (default: {SCROLLBACK})",
+    )
+    # Leave Qt's own arguments to QApplication.
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
     loop = qasync.QEventLoop(app)
     asyncio.set_event_loop(loop)
 
-    chat_app = ChatApplication()
+    chat_app = ChatApplication(args.scrollback)
 
     def cleanup():
         if chat_app.client and chat_app.client.writer:
-            chat_app.client.writer.close()
+            chat_app.client.close()
+        logger.info("Chat view updates: %s", chat_app.chat_window.chat_display.stats())
 
     app.aboutToQuit.connect(cleanup)
 
@@ -0,0 +1,155 @@
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QRect, QSize, Qt, QTimer
+from PyQt5.QtGui import QColor, QFont, QFontMetrics
+from PyQt5.QtWidgets import QAbstractItemView, QListView, QStyledItemDelegate
+
+from networking.protocol.messages import MessageType
+
+SCROLLBACK = 5000
+FRAME_INTERVAL_MS = 16
+KIND_ROLE = Qt.UserRole + 1
+PADDING = 4
+CHAT_COLOR = QColor("#ffffff")
+SYSTEM_COLOR = QColor("#87ceeb")
+
+
+class ChatModel(QAbstractListModel):
+    """Chat lines with their message type, at most `scrollback` of them.
+
+    Lines are added in batches, each a single insertion, and the oldest lines
+    are evicted once the scrollback is full.
+    """
+
+    def __init__(self, scrollback: int = SCROLLBACK, parent=None):
+        super().__init__(parent)
+        self.scrollback = scrollback
+        self.lines: Deque[Tuple[str, int]] = deque()
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.lines)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        text, kind = self.lines[index.row()]
+        if role == Qt.DisplayRole:
+            return text
+        if role == KIND_ROLE:
+            return kind
+        return None
+
+    def append(self, lines: List[Tuple[str, int]]):
+        lines = lines[-self.scrollback :]
+        if not lines:
+            return
+        overflow = len(self.lines) + len(lines) - self.scrollback
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            for _ in range(overflow):
+                self.lines.popleft()
+            self.endRemoveRows()
+        first = len(self.lines)
+        self.beginInsertRows(QModelIndex(), first, first + len(lines) - 1)
+        self.lines.extend(lines)
+        self.endInsertRows()
+
+
+class ChatDelegate(QStyledItemDelegate):
+    """Draws a chat line as wrapped plain text, with notices in bold and color."""
+
+    def _font(self, option, kind: int) -> QFont:
+        font = QFont(option.font)
+        font.setBold(kind != MessageType.CHAT)
+        return font
+
+    def _text_width(self) -> int:
+        return max(1, self.parent().viewport().width() - 2 * PADDING)
+
+    def sizeHint(self, option, index: QModelIndex) -> QSize:
+        metrics = QFontMetrics(self._font(option, index.data(KIND_ROLE)))
+        width = self._text_width()
+        bounds = metrics.boundingRect(
+            QRect(0, 0, width, 0), Qt.TextWordWrap, index.data()
+        )
+        return QSize(width, bounds.height() + 2 * PADDING)
+
+    def paint(self, painter, option, index: QModelIndex):
+        kind = index.data(KIND_ROLE)
+        painter.save()
+        painter.setFont(self._font(option, kind))
+        painter.setPen(CHAT_COLOR if kind == MessageType.CHAT else SYSTEM_COLOR)
+        painter.drawText(
+            option.rect.adjusted(PADDING, PADDING, -PADDING, -PADDING),
+            Qt.TextWordWrap,
+            index.data(),
+        )
+        painter.restore()
+
+
+class ChatView(QListView):
+    """A scrolling chat log that only lays out and paints the rows on screen.
+
+    Messages added during one UI frame are collected and inserted into the
+    model together, so the view updates at most once per frame however fast
+    messages arrive. It follows new messages only if it was scrolled to the
+    bottom. `stats` counts the updates made, the messages coalesced into
+    another message's update, and the messages dropped before being shown
+    because more arrived in one frame than the scrollback holds.
+    """
+
+    def __init__(self, scrollback: int = SCROLLBACK, parent=None):
+        super().__init__(parent)
+        self.chat_model = ChatModel(scrollback, self)
+        self.setModel(self.chat_model)
+        self.setItemDelegate(ChatDelegate(self))
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        # Rows are wrapped to the view's width, so sizes change on resize.
+        self.setResizeMode(QListView.Adjust)
+        self.setLayoutMode(QListView.Batched)
+        self.pending: Deque[Tuple[str, int]] = deque()
+        self.updates = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(FRAME_INTERVAL_MS)
+        self.flush_timer.timeout.connect(self.flush)
+
+    def add_message(self, text: str, kind: int = MessageType.CHAT):
+        self.add_messages([(text, kind)])
+
+    def add_messages(self, lines: List[Tuple[str, int]]):
+        """Queue lines of (text, message type) for the next update."""
+        self.pending.extend((text, int(kind)) for text, kind in lines)
+        overflow = len(self.pending) - self.chat_model.scrollback
+        if overflow > 0:
+            # They would be evicted as soon as they were inserted.
+            for _ in range(overflow):
+                self.pending.popleft()
+            self.dropped += overflow
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "updates": self.updates,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
+
+    def flush(self):
+        if not self.pending:
+            return
+        lines = list(self.pending)
+        self.pending.clear()
+        self.updates += 1
+        self.coalesced += len(lines) - 1
+        scrollbar = self.verticalScrollBar()
+        following = scrollbar.value() >= scrollbar.maximum()
+        self.chat_model.append(lines)
+        if following:
+            self.scrollToBottom()
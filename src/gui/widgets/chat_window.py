@@ -1,23 +1,28 @@
+from typing import List, Tuple
+
 from PyQt5.QtWidgets import (
     QWidget,
     QVBoxLayout,
     QHBoxLayout,
-    QTextEdit,
     QLineEdit,
     QPushButton,
     QLabel,
 )
-from PyQt5.QtCore import pyqtSignal, Qt
+from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtGui import QFont
 
+from networking.protocol.messages import MessageType
+from .chat_view import SCROLLBACK, ChatView
+
 
 class ChatWindow(QWidget):
     message_sent = pyqtSignal(str)
     disconnect_requested = pyqtSignal()
     window_closing = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, scrollback: int = SCROLLBACK):
         super().__init__()
+        self.scrollback = scrollback
         self.setup_ui()
 
     def setup_ui(self):
@@ -31,13 +36,12 @@ class ChatWindow(QWidget):
                 color: #ffffff;
                 font-family: 'Segoe UI', Arial, sans-serif;
             }
-            QTextEdit {
+            QListView {
                 background-color: #1e1e1e;
                 border: 1px solid #555555;
                 border-radius: 5px;
                 padding: 8px;
                 font-size: 12px;
-                line-height: 1.4;
             }
             QLineEdit {
                 background-color: #3c3c3c;
@@ -110,11 +114,8 @@ class ChatWindow(QWidget):
 
         layout.addLayout(status_layout)
 
-        self.chat_display = QTextEdit()
-        self.chat_display.setReadOnly(True)
+        self.chat_display = ChatView(self.scrollback)
         self.chat_display.setFont(QFont("Consolas", 11))
-        # Ensure HTML formatting is enabled for proper text alignment
-        self.chat_display.setHtml("")
         layout.addWidget(self.chat_display)
 
         input_layout = QHBoxLayout()
@@ -142,25 +143,13 @@ class ChatWindow(QWidget):
             self.message_sent.emit(message)
             self.message_input.clear()
 
-    def add_message(self, message: str):
-        if self.is_system_message(message):
-            # System messages with special color and bold, but left-aligned
-            self.chat_display.append(
-                f'<p style="color: #87ceeb; font-weight: bold; padding: 10px; margin: 15px 0;">{message}</p>'
-            )
-        else:
-            # User messages use default styling
-            self.chat_display.append(message)
-
-    def is_system_message(self, message: str):
-        system_keywords = [
-            "Connected to",
-            "Disconnected from server",
-            "joined the chat",
-            "left the chat",
-            "has disconnected",
-        ]
-        return any(keyword in message for keyword in system_keywords)
+    def add_message(self, message: str, kind: int = MessageType.CHAT):
+        """Show a message; anything but CHAT is shown as a notice."""
+        self.chat_display.add_message(message, kind)
+
+    def add_messages(self, messages: List[Tuple[str, int]]):
+        """Show a batch of (text, message type) pairs."""
+        self.chat_display.add_messages(messages)
 
     def set_connected(self, connected: bool):
         if connected:
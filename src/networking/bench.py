@@ -0,0 +1,356 @@
+"""Load generator and latency/throughput benchmark.
+
+Opens many simulated clients against a server, has some of them send messages at
+a fixed rate and measures how long each message takes to reach every other
+client. Results are printed as JSON so runs can be compared across releases.
+
+    netcomm-bench --clients 1000 --senders 10 --rate 20 --duration 10
+    netcomm-bench --connect --host 10.0.0.5 --port 50000 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import time
+from typing import Dict, List, Optional
+
+from .client import Client
+from .loop import use_uvloop
+from .protocol.framing import ENGINES, STREAMS
+from .protocol.messages import MessageType
+
+CONNECT_CONCURRENCY = 100
+SERVER_START_TIMEOUT = 10.0
+SENDER_PREFIX = "bench-sender-"
+
+
+def percentile(samples: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted `samples`."""
+    if not samples:
+        return None
+    rank = max(0, min(len(samples) - 1, round(p / 100 * len(samples)) - 1))
+    return round(samples[rank], 3)
+
+
+class ProcessStats:
+    """CPU time and memory of a local process, read from /proc (Linux only)."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+
+    def cpu_seconds(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                # The command name can contain spaces, so split after it.
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        utime, stime = int(fields[11]), int(fields[12])
+        return (utime + stime) / self.ticks
+
+    def memory(self) -> Dict[str, int]:
+        """Current and peak resident set size, in bytes."""
+        memory = {}
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    key, _, value = line.partition(":")
+                    if key in ("VmRSS", "VmHWM"):
+                        memory[key] = int(value.split()[0]) * 1024
+        except OSError:
+            pass
+        return {
+            "rss_bytes": memory.get("VmRSS"),
+            "peak_rss_bytes": memory.get("VmHWM"),
+        }
+
+
+def _server_main(server_kwargs: dict, uvloop: bool):
+    from .server import Server, serve
+
+    logging.disable(logging.CRITICAL)
+    if uvloop:
+        use_uvloop()
+    serve(Server(**server_kwargs))
+
+
+def start_server(server_kwargs: dict, uvloop: bool = False) -> multiprocessing.Process:
+    """Start a server in a child process and wait until it accepts connections.
+
+    Running it apart from the load generator keeps the two from competing for
+    the same event loop, and lets its CPU and memory be measured on their own.
+    """
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(
+        target=_server_main, args=(server_kwargs, uvloop), name="netcomm-bench-server"
+    )
+    process.start()
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", server_kwargs["port"]), 1).close()
+            return process
+        except OSError:
+            if not process.is_alive() or time.monotonic() > deadline:
+                process.terminate()
+                raise RuntimeError("The benchmark server did not start")
+            time.sleep(0.05)
+
+
+def raise_file_limit(needed: int):
+    """Raise the open file limit towards `needed`, as far as the hard limit allows."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+
+class Benchmark:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        clients: int,
+        senders: int,
+        rate: float,
+        duration: float,
+        size: int,
+        tls: bool = False,
+        engine: str = STREAMS,
+        drain_timeout: float = 5.0,
+    ):
+        self.host = host
+        self.port = port
+        self.clients = clients
+        self.senders = min(senders, clients)
+        self.rate = rate
+        self.duration = duration
+        self.size = size
+        self.tls = tls
+        self.engine = engine
+        self.drain_timeout = drain_timeout
+        self.latencies: List[float] = []
+        self.sent = 0
+        self.received = 0
+        self.connect_errors = 0
+        self._expected = 0
+        self._sending_done = False
+        self._all_received = asyncio.Event()
+
+    async def _connect(self, alias: str, limit: asyncio.Semaphore) -> Optional[Client]:
+        client = Client(self.host, self.port, alias, self.tls, self.engine)
+        async with limit:
+            try:
+                await client.connect()
+            except (ConnectionError, OSError):
+                self.connect_errors += 1
+                return None
+        return client
+
+    async def _receive(self, client: Client):
+        try:
+            while True:
+                message = await client.receive()
+                if message.type != MessageType.CHAT or not message.alias.startswith(
+                    SENDER_PREFIX
+                ):
+                    continue
+                sent_at = int(message.text.split(" ", 2)[1])
+                self.latencies.append((time.monotonic_ns() - sent_at) / 1e6)
+                self.received += 1
+                if self.received >= self._expected and self._sending_done:
+                    self._all_received.set()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+    async def _send(self, client: Client, index: int):
+        interval = 1 / self.rate
+        start = time.monotonic()
+        sent = 0
+        while True:
+            # Open loop: messages are due at fixed times, however long the
+            # previous send took.
+            due = start + sent * interval
+            if due - start >= self.duration:
+                return
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            header = f"{index}:{sent} {time.monotonic_ns()} "
+            await client.send_message(header.ljust(self.size, "x"))
+            sent += 1
+            self.sent += 1
+
+    async def run(self) -> dict:
+        limit = asyncio.Semaphore(CONNECT_CONCURRENCY)
+        aliases = [
+            f"{SENDER_PREFIX}{i}" if i < self.senders else f"bench-{i}"
+            for i in range(self.clients)
+        ]
+        connect_start = time.monotonic()
+        connected = await asyncio.gather(*(self._connect(a, limit) for a in aliases))
+        connect_time = time.monotonic() - connect_start
+        clients = [c for c in connected if c is not None]
+        senders = [c for c in clients if c.alias.startswith(SENDER_PREFIX)]
+
+        receivers = [asyncio.create_task(self._receive(c)) for c in clients]
+        start = time.monotonic()
+        await asyncio.gather(*(self._send(c, i) for i, c in enumerate(senders)))
+        send_time = time.monotonic() - start
+        # Everyone in the lobby gets every message except their own.
+        self._expected = self.sent * (len(clients) - 1)
+        self._sending_done = True
+        if self.received >= self._expected:
+            self._all_received.set()
+        try:
+            await asyncio.wait_for(self._all_received.wait(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.monotonic() - start
+
+        for task in receivers:
+            task.cancel()
+        for client in clients:
+            client.writer.close()
+
+        latencies = sorted(self.latencies)
+        return {
+            "clients": len(clients),
+            "connect_errors": self.connect_errors,
+            "connect_seconds": round(connect_time, 3),
+            "sent": self.sent,
+            "expected": self._expected,
+            "received": self.received,
+            "send_seconds": round(send_time, 3),
+            "elapsed_seconds": round(elapsed, 3),
+            "sent_per_second": round(self.sent / send_time, 1) if send_time else None,
+            "delivered_per_second": round(self.received / elapsed, 1),
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": percentile(latencies, 100),
+                "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NetComm load generator")
+    parser.add_argument("--host", default="127.0.0.1", help="Server host")
+    parser.add_argument("--port", type=int, default=50100, help="Server port")
+    parser.add_argument(
+        "--connect",
+        action="store_true",
+        help="Benchmark a server that is already running instead of starting one",
+    )
+    parser.add_argument(
+        "--server-pid",
+        type=int,
+        help="PID of the running server, to report its CPU and memory use",
+    )
+    parser.add_argument("--clients", type=int, default=1000, help="Connected clients")
+    parser.add_argument("--senders", type=int, default=10, help="Clients that send")
+    parser.add_argument(
+        "--rate", type=float, default=10, help="Messages per second for each sender"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10, help="Seconds to send for"
+    )
+    parser.add_argument("--size", type=int, default=64, help="Message size in bytes")
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=5,
+        help="Seconds to wait for deliveries after sending stops",
+    )
+    parser.add_argument("--tls", action="store_true", help="Enable TLS")
+    parser.add_argument("--engine", choices=ENGINES, default=STREAMS)
+    parser.add_argument("--uvloop", action="store_true", help="Use uvloop")
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=1024,
+        help="Outbound queue size of the started server (default: 1024)",
+    )
+    parser.add_argument("--output", help="Write the JSON results to a file")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    uvloop = args.uvloop and use_uvloop()
+    raise_file_limit(args.clients + 256)
+
+    process = None
+    pid = args.server_pid
+    if not args.connect:
+        server_kwargs = dict(
+            host=args.host,
+            port=args.port,
+            tls=args.tls,
+            queue_size=args.queue_size,
+            engine=args.engine,
+        )
+        process = start_server(server_kwargs, uvloop)
+        pid = process.pid
+    stats = ProcessStats(pid) if pid else None
+
+    benchmark = Benchmark(
+        args.host,
+        args.port,
+        args.clients,
+        args.senders,
+        args.rate,
+        args.duration,
+        args.size,
+        tls=args.tls,
+        engine=args.engine,
+        drain_timeout=args.drain_timeout,
+    )
+    cpu_start = stats.cpu_seconds() if stats else None
+    wall_start = time.monotonic()
+    try:
+        results = asyncio.run(benchmark.run())
+    finally:
+        wall = time.monotonic() - wall_start
+        cpu_end = stats.cpu_seconds() if stats else None
+        memory = stats.memory() if stats else {}
+        if process:
+            process.terminate()
+            process.join()
+
+    server = dict(memory)
+    if cpu_start is not None and cpu_end is not None:
+        server["cpu_seconds"] = round(cpu_end - cpu_start, 3)
+        server["cpu_percent"] = round(100 * (cpu_end - cpu_start) / wall, 1)
+    report = {
+        "config": {
+            "host": args.host,
+            "port": args.port,
+            "started_server": not args.connect,
+            "clients": args.clients,
+            "senders": args.senders,
+            "rate": args.rate,
+            "duration": args.duration,
+            "size": args.size,
+            "tls": args.tls,
+            "engine": args.engine,
+            "uvloop": uvloop,
+        },
+        "results": results,
+        "server": server,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,696 @@
 import asyncio
-from typing import Optional, Callable
-import ssl
+import io
+import json
+import os
+import random
+from collections import deque
+from typing import (
+    AsyncIterator,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
-from .protocol.io import write_message, read_message
+from .protocol.compression import CODECS, COMPRESS_THRESHOLD, Codec, create_codec
+from .protocol.framing import STREAMS, open_connection, open_unix_connection
+from .protocol.io import write_frames
+from .protocol.messages import (
+    ABORTED,
+    CHUNK_HEADER,
+    DEFAULT_ROOM,
+    FEATURES,
+    FILE_TRANSFER,
+    FINAL,
+    JOINED,
+    LEFT,
+    MEMBERS,
+    MORE,
+    RETURNED,
+    SUPPORTED_VERSIONS,
+    TEXT_TRANSFER,
+    TRANSFER_ID,
+    Message,
+    MessageType,
+    chunk_frame,
+    decode_message,
+    direct_frame,
+    encode_json,
+    encode_message,
+    file_frame,
+    history_frame,
+    is_heartbeat,
+    pack_str,
+    parse_message,
+    parse_presence,
+    parse_transfer,
+)
+from .tls import client_context
+from .transfer import CHUNK_SIZE, IncomingTransfer
+
+UNIX_SCHEME = "unix://"
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 30.0
+SEND_BUFFER_SIZE = 1024
+WRITE_HIGH_WATER = 64 * 1024
+# Bytes of frames read ahead while nothing is receiving, to answer pings.
+READ_AHEAD_BYTES = 1024 * 1024
+# Echoed back by the server once the rooms rejoined after a reconnection have
+# replayed their history.
+REPLAY_BARRIER = b"replayed"
 
 
 class Client:
-    def __init__(self, host="127.0.0.1", port=50000, alias="Anonymous", tls=False):
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=50000,
+        alias="Anonymous",
+        tls=False,
+        engine=STREAMS,
+        compression=True,
+        heartbeat_interval: Optional[float] = None,
+        reconnect: bool = False,
+        reconnect_delay: float = RECONNECT_DELAY,
+        max_reconnect_delay: float = MAX_RECONNECT_DELAY,
+        reconnect_attempts: Optional[int] = None,
+        send_buffer_size: int = SEND_BUFFER_SIZE,
+        write_high_water: int = WRITE_HIGH_WATER,
+        write_low_water: Optional[int] = None,
+    ):
+        """
+        Args:
+            host (str): The server's host name or address, or `unix://PATH` to
+                connect to its Unix socket, in which case `port` and `tls` are
+                not used.
+            reconnect (bool): Reconnect when the connection drops, resuming the
+                session so that missed messages are received in one batch. Sends
+                made while reconnecting are buffered, up to `send_buffer_size`
+                messages.
+            reconnect_delay (float): Seconds to wait before the first reconnection
+                attempt. The delay doubles with each failed attempt, up to
+                `max_reconnect_delay`, and is randomized so that clients dropped
+                together do not all reconnect at once.
+            reconnect_attempts (Optional[int]): Attempts before giving up, or None
+                to keep trying.
+            write_high_water (int): Sends are queued and written together once
+                per event loop iteration, or as soon as this many bytes are
+                queued; they only wait for the connection to drain once this
+                many bytes are buffered by the transport.
+            write_low_water (Optional[int]): The transport buffer size at which
+                waiting sends resume (by default a quarter of
+                `write_high_water`).
+        """
         self.host = host
         self.port = port
+        self.unix_socket: Optional[str] = None
+        if host.startswith(UNIX_SCHEME):
+            self.unix_socket = host[len(UNIX_SCHEME) :]
         self.alias = alias
         self.tls = tls
-        self.reader: Optional[asyncio.StreamReader] = None
+        self.engine = engine
+        self.compression = compression
+        self.heartbeat_interval = heartbeat_interval
+        self.reconnect = reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.reconnect_attempts = reconnect_attempts
+        self.reader = None
         self.writer: Optional[asyncio.StreamWriter] = None
         self.message_callback: Optional[Callable[[str], None]] = None
+        self.id: Optional[int] = None
+        self.features: List[str] = []
+        self.codec: Optional[Codec] = None
+        self.session_reused = False
+        self.session: Optional[str] = None
+        self.resumed = False
+        self.epoch: Optional[str] = None
+        self.last_seq = 0
+        self._replayed_seq = 0
+        self.rooms: List[str] = [DEFAULT_ROOM]
+        self.presence: Dict[str, Set[str]] = {}
+        self.connected = False
+        self.closed = False
+        self._outbox: Deque[bytes] = deque()
+        self._send_buffer_size = send_buffer_size
+        self.write_high_water = write_high_water
+        self.write_low_water = write_low_water
+        self._writes: List[bytes] = []
+        self._writes_size = 0
+        self._flush_scheduled = False
+        self._messages: Deque[Message] = deque()
+        self._read: Optional[asyncio.Future] = None
+        self._frames: Deque[bytes] = deque()
+        self._frames_size = 0
+        self._receiving = False
+        self.transfers: Dict[Tuple[int, int], IncomingTransfer] = {}
+        self._sending: Set[int] = set()
 
     def set_message_callback(self, callback: Callable[[str], None]):
         self.message_callback = callback
 
+    @property
+    def address(self) -> str:
+        return self.host if self.unix_socket else f"{self.host}:{self.port}"
+
     async def connect(self):
         ssl_context = None
-        if self.tls:
-            ssl_context = ssl.create_default_context()
-            ssl_context.check_hostname = False  # For local IPs
-            ssl_context.verify_mode = ssl.CERT_NONE  # Skip certificate verification
-        self.reader, self.writer = await asyncio.open_connection(
-            self.host, self.port, ssl=ssl_context
+        if self.unix_socket:
+            self.reader, self.writer = await open_unix_connection(
+                self.unix_socket, engine=self.engine
+            )
+        else:
+            ssl_context = client_context() if self.tls else None
+            self.reader, self.writer = await open_connection(
+                self.host, self.port, engine=self.engine, ssl=ssl_context
+            )
+        hello = {
+            "alias": self.alias,
+            "versions": list(SUPPORTED_VERSIONS),
+            "features": list(FEATURES),
+            "codecs": list(CODECS) if self.compression else [],
+        }
+        if self.session:
+            hello["resume"] = {"session": self.session, "seq": self.last_seq}
+        self.writer.transport.set_write_buffer_limits(
+            self.write_high_water, self.write_low_water
         )
-        await self.send_message(f"__alias__:{self.alias}")
+        await write_frames(self.writer, [encode_json(MessageType.HELLO, hello)])
+        header, payload = decode_message(await self.reader.read_frame())
+        ssl_object = self.writer.get_extra_info("ssl_object")
+        if ssl_object:
+            # TLS 1.3 session tickets arrive after the handshake, so by now the
+            # session can be saved for the next connection.
+            self.session_reused = ssl_object.session_reused
+            ssl_context.save_session(self.host, ssl_object)
+        if header.type != MessageType.WELCOME:
+            raise ConnectionError("Server did not accept the handshake")
+        welcome = json.loads(payload)
+        self.id = welcome["id"]
+        self.alias = welcome.get("alias", self.alias)
+        self.features = welcome["features"]
+        threshold = welcome.get("threshold", COMPRESS_THRESHOLD)
+        self.codec = create_codec(welcome.get("codec"), threshold)
+        if self.heartbeat_interval is None:
+            self.heartbeat_interval = welcome.get("heartbeat")
+        self.session = welcome.get("session")
+        self.epoch = welcome.get("epoch")
+        self.resumed = bool(welcome.get("resumed"))
+        self.connected = True
+        self.closed = False
+        self._start_read()
+
+    def close(self):
+        """Close the connection for good, without reconnecting."""
+        self._flush_writes()
+        self.closed = True
+        self.connected = False
+        if self.writer:
+            self.writer.close()
+
+    async def _reconnect(self):
+        """Reconnect with backoff, then catch up on what was missed.
+
+        If the server resumed the session, it sends the missed messages by
+        itself. Otherwise (it restarted, or the session expired) the rooms are
+        joined again. If the server still numbers messages as before, which it
+        only does across a restart when it keeps a message log, the messages
+        since the last one received are also requested; sequence numbers from
+        another server, or from before a restart, mean nothing here.
+
+        Raises:
+            ConnectionError: If every attempt failed, or the client was closed.
+        """
+        self.writer.transport.abort()
+        for transfer in self.transfers.values():
+            transfer.abort()
+        self.transfers.clear()
+        epoch = self.epoch
+        attempt = 0
+        while True:
+            delay = min(self.max_reconnect_delay, self.reconnect_delay * 2**attempt)
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            if self.closed:
+                raise ConnectionError("The client was closed")
+            attempt += 1
+            try:
+                await self.connect()
+                break
+            except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+                if self.writer:
+                    self.writer.transport.abort()
+                attempts = self.reconnect_attempts
+                if attempts is not None and attempt >= attempts:
+                    raise ConnectionError(f"Could not reconnect: {e}") from e
+        frames = []
+        if not self.resumed:
+            same_epoch = epoch is not None and epoch == self.epoch
+            if not same_epoch:
+                self.last_seq = 0
+            # Rejoining replays recent messages, some of which were received
+            # before the connection dropped. They are skipped until the server
+            # echoes the barrier, which it does after replaying them.
+            self._replayed_seq = self.last_seq
+            for room in self.rooms:
+                if room != DEFAULT_ROOM:
+                    frames.append(encode_message(MessageType.JOIN, room.encode()))
+            if DEFAULT_ROOM not in self.rooms:
+                frames.append(encode_message(MessageType.LEAVE, DEFAULT_ROOM.encode()))
+            if same_epoch:
+                for room in self.rooms:
+                    frames.append(history_frame(room, since=self.last_seq))
+                frames.append(encode_message(MessageType.PING, REPLAY_BARRIER))
+        frames.extend(self._outbox)
+        self._outbox.clear()
+        if self.codec is not None:
+            frames = [self.codec.compress_frame(frame) for frame in frames]
+        await write_frames(self.writer, frames)
+        state = "resumed" if self.resumed else "rejoined"
+        text = f"Reconnected to {self.address} ({state})."
+        self._messages.append(Message(MessageType.SYSTEM, text))
+
+    async def _send(self, frame: bytes):
+        await self._send_frames([frame])
+
+    async def _send_frames(self, frames: List[bytes]):
+        """Queue frames to be written, or buffer them while reconnecting.
+
+        Queued frames are written together at the next event loop iteration, so
+        consecutive sends cost a single write. This only waits if the queue or
+        the transport's buffer reached the high-water mark.
+
+        Raises:
+            ConnectionError: If the connection is down and the client does not
+                reconnect, or the send buffer is full.
+        """
+        if self.connected and not self.writer.is_closing():
+            self._queue_writes(frames)
+            if self._writes_size < self.write_high_water:
+                return
+            self._flush_writes()
+            try:
+                await self.writer.drain()
+                return
+            except ConnectionError:
+                if not self.reconnect or self.closed:
+                    raise
+                # Wake up the receiving side, which reconnects.
+                self.writer.transport.abort()
+                return
+        if not self.reconnect or self.closed:
+            raise ConnectionError("Not connected")
+        if len(self._outbox) + len(frames) > self._send_buffer_size:
+            raise ConnectionError("Send buffer full while reconnecting")
+        self._outbox.extend(frames)
+
+    def _queue_writes(self, frames: List[bytes]):
+        self._writes.extend(frames)
+        self._writes_size += sum(map(len, frames))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush_writes)
+
+    def _flush_writes(self):
+        self._flush_scheduled = False
+        frames, self._writes = self._writes, []
+        self._writes_size = 0
+        if not frames:
+            return
+        if self.connected and not self.writer.is_closing():
+            if self.codec is not None:
+                frames = [self.codec.compress_frame(frame) for frame in frames]
+            self.writer.writelines(frames)
+        elif self.reconnect and not self.closed:
+            # The connection dropped after these were queued.
+            self._outbox.extend(frames)
+
+    async def send_message(self, message: str, room: str = ""):
+        """Send a chat message to `room`, or to the last room joined if empty.
+
+        Messages larger than a chunk are sent as a chunked transfer.
+        """
+        body = message.encode()
+        if len(body) > CHUNK_SIZE:
+            await self.send_stream(io.BytesIO(body), "", len(body), room, TEXT_TRANSFER)
+            return
+        payload = pack_str(room.encode()) + body
+        await self._send(encode_message(MessageType.CHAT, payload))
+
+    async def send_many(self, messages: Iterable[str], room: str = ""):
+        """Send several chat messages to `room` with a single write.
+
+        Messages larger than a chunk are sent as chunked transfers, in order.
+        """
+        prefix = pack_str(room.encode())
+        frames = []
+        for message in messages:
+            body = message.encode()
+            if len(body) > CHUNK_SIZE:
+                await self._send_frames(frames)
+                frames = []
+                await self.send_message(message, room)
+                continue
+            frames.append(encode_message(MessageType.CHAT, prefix + body))
+        if frames:
+            await self._send_frames(frames)
+
+    async def send_file(self, path: str, room: str = ""):
+        with open(path, "rb") as f:
+            await self.send_stream(
+                f, os.path.basename(path), os.path.getsize(path), room
+            )
+
+    async def send_stream(
+        self,
+        stream: BinaryIO,
+        name: str,
+        size: Optional[int] = None,
+        room: str = "",
+        kind: str = FILE_TRANSFER,
+    ):
+        """Send the contents of a binary stream in chunks.
+
+        Only one chunk is read at a time, and each is written after the previous
+        one has drained, so other messages sent meanwhile go out between chunks.
+
+        Args:
+            stream (BinaryIO): The stream to read, up to its end.
+            name (str): The name shown to the receivers.
+            size (Optional[int]): The total size in bytes, if known.
+            room (str): The room to send to, or the last room joined if empty.
+        """
+        # Sender IDs are only unique within one server process, so receivers
+        # behind other workers or federated servers tell transfers apart by
+        # this random ID.
+        transfer_id = random.getrandbits(TRANSFER_ID.size * 8)
+        while transfer_id in self._sending:
+            transfer_id = random.getrandbits(TRANSFER_ID.size * 8)
+        self._sending.add(transfer_id)
+        offset = 0
+        try:
+            await self._send(file_frame(transfer_id, name, size, kind, room))
+            chunk = stream.read(CHUNK_SIZE)
+            while True:
+                following = stream.read(CHUNK_SIZE) if chunk else b""
+                status = MORE if following else FINAL
+                await self._send(chunk_frame(transfer_id, offset, chunk, status))
+                if status == FINAL:
+                    return
+                offset += len(chunk)
+                chunk = following
+        except OSError:
+            if not self.writer.is_closing():
+                await self._send(chunk_frame(transfer_id, offset, b"", ABORTED))
+            raise
+        finally:
+            self._sending.discard(transfer_id)
+
+    async def join_room(self, room: str):
+        """Join a room and make it the one messages are sent to."""
+        await self._send(encode_message(MessageType.JOIN, room.encode()))
+        room = room.strip().lstrip("#")
+        if room in self.rooms:
+            self.rooms.remove(room)
+        self.rooms.append(room)
+
+    async def leave_room(self, room: str):
+        await self._send(encode_message(MessageType.LEAVE, room.encode()))
+        room = room.strip().lstrip("#")
+        if room in self.rooms and len(self.rooms) > 1:
+            self.rooms.remove(room)
+            self.presence.pop(room, None)
+
+    async def list_rooms(self):
+        await self._send(encode_message(MessageType.ROOMS))
+
+    def members(self, room: str = "") -> List[str]:
+        """The aliases in a room (the last room joined if empty), as last heard
+        from the server."""
+        return sorted(self.presence.get(room or self.rooms[-1], ()))
+
+    async def request_members(self, room: str = ""):
+        """Ask the server who is in a room; the answer arrives as a PRESENCE
+        message."""
+        await self._send(encode_message(MessageType.PRESENCE, pack_str(room.encode())))
+
+    async def send_direct(self, alias: str, message: str):
+        """Send a private message to the client called `alias` only."""
+        await self._send(direct_frame(alias, message.encode()))
+
+    async def request_history(
+        self, room: str = "", last: Optional[int] = None, since: Optional[int] = None
+    ):
+        """Ask the server to replay the recent messages of a room.
 
-    async def send_message(self, message: str):
-        await write_message(self.writer, message)
+        The messages arrive through `receive` like any other, with their original
+        sequence numbers. The server only keeps a bounded history, so older
+        messages may be missing.
+
+        Args:
+            room (str): The room, or the last room joined if empty.
+            last (Optional[int]): Replay at most this many of the latest messages.
+            since (Optional[int]): Replay the messages after this sequence number.
+        """
+        self._replayed_seq = 0
+        await self._send(history_frame(room, last, since))
+
+    async def run_command(self, text: str) -> bool:
+        """Run a slash command typed by the user (/join, /leave, /rooms, /who,
+        /msg, /history or /send).
+
+        Returns:
+            bool: True if the text was a command.
+        """
+        command, _, argument = text.partition(" ")
+        argument = argument.strip()
+        if command == "/join" and argument:
+            await self.join_room(argument)
+        elif command == "/leave" and argument:
+            await self.leave_room(argument)
+        elif command == "/rooms":
+            await self.list_rooms()
+        elif command == "/who":
+            await self.request_members(argument)
+        elif command == "/msg" and " " in argument:
+            alias, _, message = argument.partition(" ")
+            await self.send_direct(alias, message.strip())
+        elif command == "/history" and (not argument or argument.isdigit()):
+            await self.request_history(last=int(argument) if argument else None)
+        elif command == "/send" and argument:
+            await self.send_file(argument)
+        else:
+            return False
+        return True
+
+    async def receive(self) -> Message:
+        """Receive the next message from the server.
+
+        Chunks of incoming transfers are consumed here, so transfers only make
+        progress while messages are being received. With `reconnect`, a lost
+        connection is reported as a SYSTEM message and re-established by the
+        following calls.
+
+        Raises:
+            ConnectionError: If the connection is lost and cannot be reconnected.
+        """
+        while not self._messages:
+            if not self.connected and not self.closed and self.reconnect:
+                await self._reconnect()
+                continue
+            try:
+                frame = await self._read_frame()
+            except ConnectionError:
+                if not self.reconnect or self.closed:
+                    raise
+                self.connected = False
+                self._messages.append(
+                    Message(MessageType.SYSTEM, "Connection lost, reconnecting...")
+                )
+                continue
+            await self._handle_frame(frame)
+        return self._messages.popleft()
+
+    async def receive_batch(self) -> List[Message]:
+        """Receive the next message along with every other one already read.
+
+        Frames that arrived together are read together, so during a burst this
+        returns many messages per call instead of waking the caller per message.
+
+        Raises:
+            ConnectionError: If the connection is lost and cannot be reconnected.
+        """
+        messages = [await self.receive()]
+        while self._frames:
+            await self._handle_frame(self._next_frame())
+        messages.extend(self._messages)
+        self._messages.clear()
+        return messages
+
+    async def messages(
+        self, batch: bool = False
+    ) -> AsyncIterator[Union[Message, List[Message]]]:
+        """Iterate over received messages until the client is closed.
+
+        Args:
+            batch (bool): Yield lists of every message already received, as
+                `receive_batch` returns them, instead of one message at a time.
+        Raises:
+            ConnectionError: If the connection is lost and cannot be reconnected.
+        """
+        while not self.closed:
+            if batch:
+                yield await self.receive_batch()
+            else:
+                yield await self.receive()
+
+    async def _handle_frame(self, frame: bytes):
+        for message in parse_message(frame, self.codec):
+            if message.type == MessageType.CHAT and message.seq:
+                if message.seq <= self._replayed_seq:
+                    continue
+            if message.seq > self.last_seq:
+                self.last_seq = message.seq
+            if message.type == MessageType.PING:
+                await self._send(encode_message(MessageType.PONG, message.data))
+                continue
+            if message.type == MessageType.PONG:
+                if message.data == REPLAY_BARRIER:
+                    self._replayed_seq = 0
+                continue
+            if message.type == MessageType.PRESENCE:
+                self._update_presence(message)
+            elif message.type == MessageType.FILE:
+                message = self._start_transfer(message)
+            elif message.type == MessageType.CHUNK:
+                message = self._feed_transfer(message)
+            if message is not None:
+                self._messages.append(message)
+
+    async def _read_frame(self) -> bytes:
+        """Read the next frame, pinging the server if it goes quiet.
+
+        Every frame already buffered is read at once; the frames after the
+        first are kept for the following calls. The pending read is kept across
+        calls, so a cancelled `receive` never loses part of a frame.
+
+        Raises:
+            ConnectionError: If the server does not answer a ping within a
+                heartbeat interval.
+        """
+        if self._frames:
+            return self._next_frame()
+        if self._read is None:
+            self._start_read()
+        pinged = False
+        self._receiving = True
+        try:
+            while True:
+                timeout = self.heartbeat_interval or None
+                done, _ = await asyncio.wait({self._read}, timeout=timeout)
+                if done:
+                    break
+                if pinged:
+                    self._read.cancel()
+                    self._read = None
+                    self.writer.transport.abort()
+                    raise ConnectionError("The server stopped responding")
+                await self._send(encode_message(MessageType.PING))
+                pinged = True
+        finally:
+            self._receiving = False
+        read, self._read = self._read, None
+        frames = read.result()
+        self._buffer_frames(frames[1:])
+        return frames[0]
+
+    def _start_read(self):
+        self._read = asyncio.ensure_future(self.reader.read_frames())
+        self._read.add_done_callback(self._read_ahead)
+
+    def _read_ahead(self, read: asyncio.Future):
+        """Keep reading while nothing is receiving, answering the server's pings.
+
+        Otherwise a client that only sends would stop answering pings and be
+        disconnected. Reading ahead stops once `READ_AHEAD_BYTES` are buffered,
+        and a failed read is left for `receive` to report.
+        """
+        if self._receiving or read is not self._read:
+            return
+        if read.cancelled() or read.exception() is not None:
+            return
+        self._read = None
+        frames = []
+        pongs = []
+        for frame in read.result():
+            if is_heartbeat(frame) and frame[1] == MessageType.PING:
+                _, payload = decode_message(frame)
+                pongs.append(encode_message(MessageType.PONG, payload))
+            else:
+                frames.append(frame)
+        if pongs and self.connected and not self.writer.is_closing():
+            self._queue_writes(pongs)
+        self._buffer_frames(frames)
+        if self._frames_size < READ_AHEAD_BYTES:
+            self._start_read()
+
+    def _buffer_frames(self, frames: List[bytes]):
+        self._frames.extend(frames)
+        self._frames_size += sum(map(len, frames))
+
+    def _next_frame(self) -> bytes:
+        frame = self._frames.popleft()
+        self._frames_size -= len(frame)
+        return frame
+
+    def _update_presence(self, message: Message):
+        info = parse_presence(message.data)
+        if info.event == MEMBERS:
+            self.presence[message.room] = set(info.aliases)
+            return
+        members = self.presence.setdefault(message.room, set())
+        if info.event in (JOINED, RETURNED):
+            members.update(info.aliases)
+        elif info.event == LEFT:
+            members.difference_update(info.aliases)
+
+    def transfer(self, message: Message) -> Optional[IncomingTransfer]:
+        """Get the incoming transfer announced by a FILE message.
+
+        This should be called as soon as the message is received, before the
+        transfer finishes.
+        """
+        return self.transfers.get((message.sender, parse_transfer(message.data).id))
+
+    def _start_transfer(self, message: Message) -> Optional[Message]:
+        info = parse_transfer(message.data)
+        transfer = IncomingTransfer(message.sender, info, message.room, message.alias)
+        self.transfers[(message.sender, info.id)] = transfer
+        return message if info.kind == FILE_TRANSFER else None
+
+    def _feed_transfer(self, message: Message) -> Optional[Message]:
+        transfer_id, _, _ = CHUNK_HEADER.unpack_from(message.data)
+        key = (message.sender, transfer_id)
+        transfer = self.transfers.get(key)
+        if transfer is None or not transfer.feed(message.data):
+            return None
+        del self.transfers[key]
+        if transfer.kind != TEXT_TRANSFER or transfer.aborted:
+            return None
+        transfer.file.seek(0)
+        text = transfer.file.read().decode(errors="replace")
+        transfer.close()
+        return Message(
+            MessageType.CHAT, text, transfer.room, transfer.alias, transfer.sender
+        )
 
     async def receive_message(self):
-        message = await read_message(self.reader)
+        message = str(await self.receive())
         if self.message_callback:
             self.message_callback(message)
         return message
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from .metrics import Metrics
+from .protocol.compression import Codec
+from .protocol.io import write_frames
+from .protocol.messages import DEFAULT_ROOM, LEGACY, Packet
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+BATCH_SIZE = 256 * 1024
+
+
+class Connection:
+    """A connected client with its own bounded outbound queue.
+
+    Frames are queued without awaiting and flushed by a dedicated writer task,
+    so a slow reader only ever delays its own delivery. Everything queued since
+    the last flush goes out in a single vectored write.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        max_queue: int = 1024,
+        overflow: str = DROP_OLDEST,
+        metrics: Optional[Metrics] = None,
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.reader = reader
+        self.writer = writer
+        self.peername = writer.get_extra_info("peername")
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.metrics = metrics
+        self.queue: Deque[bytes] = deque()
+        self.bulk: Deque[bytes] = deque()
+        self.dropped = 0
+        self.id = 0
+        self.alias = ""
+        self.variant = LEGACY
+        self.codec: Optional[Codec] = None
+        self.room = DEFAULT_ROOM
+        self.outbox: List[bytes] = []
+        self.outbox_room = DEFAULT_ROOM
+        self.transfers: Dict[int, str] = {}
+        self.bucket = None  # A RateLimit when rate limits are enabled.
+        self.session = None  # A Session when sessions are enabled.
+        self.resume_seq: Optional[int] = None
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.create_task(self._write_loop())
+
+    def send(self, frame: bytes, bulk: bool = False) -> bool:
+        """Queue a pre-built frame for delivery.
+
+        Args:
+            frame (bytes): A frame built with `encode_frame`.
+            bulk (bool): Queue the frame behind chat, for file transfer chunks.
+        Returns:
+            bool: True if the frame was queued, False if it was dropped.
+        """
+        if self._closed:
+            return False
+        queue = self.bulk if bulk else self.queue
+        if len(queue) >= self.max_queue:
+            self.dropped += 1
+            if self.metrics:
+                self.metrics.dropped.inc()
+            if self.overflow == DROP_NEWEST:
+                return False
+            if self.overflow == DISCONNECT:
+                logger.warning(
+                    "Disconnecting slow consumer %s.",
+                    self.peername,
+                    extra=self.log_fields("slow_consumer"),
+                )
+                self.abort()
+                return False
+            queue.popleft()
+        queue.append(frame)
+        self._ready.set()
+        return True
+
+    def send_packet(self, packet: Packet) -> bool:
+        """Queue a packet, encoded for this connection's protocol variant.
+
+        With a shared codec the compressed encoding is cached on the packet, so a
+        broadcast is compressed once per codec rather than once per recipient.
+        """
+        if self.codec is not None and self.codec.shared:
+            data = packet.encode(self.variant, self.codec)
+        else:
+            data = packet.encode(self.variant)
+        return bool(data) and self.send(data, packet.bulk)
+
+    async def _write_loop(self):
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                while self.queue or self.bulk:
+                    frames = list(self.queue)
+                    self.queue.clear()
+                    if self.bulk:
+                        # One bulk frame per write, so chat queued while it
+                        # drains goes out before the next one.
+                        frames.append(self.bulk.popleft())
+                    if self.codec is not None and not self.codec.shared:
+                        # Streaming contexts must see exactly the frames that are
+                        # sent, so compress after the overflow policy has run.
+                        frames = [self.codec.compress_frames(f) for f in frames]
+                    if self.metrics:
+                        await self._write_measured(frames)
+                    else:
+                        await write_frames(self.writer, frames)
+        except ConnectionError as e:
+            logger.error(
+                "Error writing to %s: %s",
+                self.peername,
+                e,
+                extra=self.log_fields("write_failed"),
+            )
+            if self.metrics:
+                self.metrics.write_errors.inc()
+            self.abort()
+
+    async def _write_measured(self, frames: List[bytes]):
+        metrics = self.metrics
+        metrics.writers.inc()
+        try:
+            await write_frames(self.writer, frames)
+        finally:
+            metrics.writers.dec()
+        metrics.frames_out.inc(len(frames))
+        metrics.bytes_out.inc(sum(map(len, frames)))
+
+    def log_fields(self, event: str) -> dict:
+        """Structured fields for a log record about this connection."""
+        return {
+            "event": event,
+            "conn": self.id,
+            "peer": self.peername,
+            "alias": self.alias,
+        }
+
+    def abort(self):
+        """Drop the connection immediately, discarding anything still queued."""
+        self._closed = True
+        self.queue.clear()
+        self.bulk.clear()
+        self.writer.transport.abort()
+
+    async def close(self):
+        self._closed = True
+        self._task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+class Batcher:
+    """Collects data added during one event loop iteration into a single batch.
+
+    The batch is handed to `flush_batch` at the end of the iteration, or as soon
+    as it grows past `max_size` bytes.
+    """
+
+    def __init__(
+        self, flush_batch: Callable[[List[bytes]], None], max_size: int = BATCH_SIZE
+    ):
+        self.flush_batch = flush_batch
+        self.max_size = max_size
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+
+    def add(self, data: bytes):
+        if not self._pending:
+            asyncio.get_running_loop().call_soon(self.flush)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= self.max_size:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            batch = self._pending
+            self._pending = []
+            self._pending_size = 0
+            self.flush_batch(batch)
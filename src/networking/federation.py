@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import struct
+import uuid
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .connection import Batcher, Connection
+from .protocol.framing import open_framed_connection, start_framed_server
+from .protocol.io import HEADER, encode_frame
+
+logger = logging.getLogger(__name__)
+
+RECORD = struct.Struct("!16sQ")
+COMPRESSED = 0x01
+COMPRESS_THRESHOLD = 1024
+LINK_QUEUE_SIZE = 65536
+LINK_MAX_FRAME_SIZE = 16 * 1024 * 1024
+SEEN_WINDOW = 4096
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+FEDERATION_HOST = "127.0.0.1"
+
+
+class SeenWindow:
+    """The sequence numbers recently seen from one origin.
+
+    Records can arrive out of order when they take different paths through the
+    federation, so a sliding bitmask is kept instead of just the highest number.
+    """
+
+    def __init__(self, size: int = SEEN_WINDOW):
+        self.size = size
+        self.highest = 0
+        self.mask = 0
+
+    def add(self, seq: int) -> bool:
+        """Mark a sequence number as seen.
+
+        Returns:
+            bool: True if it had not been seen before.
+        """
+        if seq > self.highest:
+            shift = seq - self.highest
+            self.mask = (self.mask << shift | 1) & ((1 << self.size) - 1)
+            self.highest = seq
+            return True
+        offset = self.highest - seq
+        if offset >= self.size or self.mask >> offset & 1:
+            return False
+        self.mask |= 1 << offset
+        return True
+
+
+class PeerLink:
+    """A persistent link to another server, carrying records in both directions.
+
+    Records queued during one event loop iteration are sent as a single batch,
+    optionally compressed.
+    """
+
+    def __init__(self, federation: "Federation", reader, writer):
+        self.federation = federation
+        self.reader = reader
+        self.conn = Connection(reader, writer, LINK_QUEUE_SIZE)
+        self.batcher = Batcher(self._send_batch)
+        self.peer_id: Optional[bytes] = None
+
+    def send(self, record: bytes):
+        self.batcher.add(record)
+
+    def _send_batch(self, records: List[bytes]):
+        body = b"".join(records)
+        flags = 0
+        if self.federation.compress and len(body) >= COMPRESS_THRESHOLD:
+            body = zlib.compress(body)
+            flags |= COMPRESSED
+        self.conn.send(encode_frame(bytes((flags,)) + body))
+
+    async def run(self):
+        self.conn.send(encode_frame(self.federation.node_id))
+        try:
+            self.peer_id = await self.reader.read_frame()
+            if self.peer_id == self.federation.node_id:
+                logger.warning(
+                    "Dropping federation link to self (%s).",
+                    self.conn.peername,
+                    extra=self.conn.log_fields("federation_self_link"),
+                )
+                return
+            logger.info(
+                "Federation link up: %s.",
+                self.conn.peername,
+                extra=self.conn.log_fields("federation_link_up"),
+            )
+            self.federation.links.add(self)
+            while True:
+                for batch in await self.reader.read_frames():
+                    self.federation.receive(self, batch)
+        except ConnectionError:
+            pass
+        except Exception:
+            # A malformed or incompatible batch only costs this link, which is
+            # re-established if this side opened it.
+            logger.exception(
+                "Dropping federation link to %s after an error.",
+                self.conn.peername,
+                extra=self.conn.log_fields("federation_link_failed"),
+            )
+        finally:
+            self.federation.links.discard(self)
+            await self.conn.close()
+            logger.info(
+                "Federation link down: %s.",
+                self.conn.peername,
+                extra=self.conn.log_fields("federation_link_down"),
+            )
+
+
+class Federation:
+    """Relays broadcasts between servers so that clients spread over several nodes
+    share one chat.
+
+    Every broadcast is stamped with this node's origin ID and a sequence number and
+    flooded to all peers, which forward it on to their own peers. Records already
+    seen are dropped, so relaying never loops.
+
+    Peers are trusted: links are not authenticated, and a peer can relay chat
+    under any alias. The listener is therefore only reachable from this machine
+    unless `host` says otherwise, and should only be exposed to a private
+    network.
+    """
+
+    def __init__(
+        self,
+        on_frames: Callable[[List[bytes]], None],
+        host: str = FEDERATION_HOST,
+        port: Optional[int] = None,
+        peers: Iterable[str] = (),
+        compress: bool = False,
+    ):
+        self.on_frames = on_frames
+        self.host = host
+        self.port = port
+        self.peers = list(peers)
+        self.compress = compress
+        self.node_id = uuid.uuid4().bytes
+        self.seq = 0
+        self.seen: Dict[bytes, SeenWindow] = {}
+        self.links = set()
+        self.server = None
+        self.tasks = set()
+
+    async def start(self):
+        if self.port:
+            self.server = await start_framed_server(
+                self._accept,
+                self.host,
+                self.port,
+                max_frame_size=LINK_MAX_FRAME_SIZE,
+            )
+            logger.info(
+                "Federation listening on %s:%s.",
+                self.host,
+                self.port,
+                extra={"event": "federation_listening"},
+            )
+        for peer in self.peers:
+            host, port = peer.rsplit(":", 1)
+            task = asyncio.create_task(self._connect(host, int(port)))
+            self.tasks.add(task)
+
+    async def _accept(self, reader, writer):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            await PeerLink(self, reader, writer).run()
+        finally:
+            self.tasks.discard(task)
+
+    async def _connect(self, host: str, port: int):
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                reader, writer = await open_framed_connection(
+                    host, port, max_frame_size=LINK_MAX_FRAME_SIZE
+                )
+            except OSError as e:
+                logger.debug(
+                    "Could not reach peer %s:%s: %s",
+                    host,
+                    port,
+                    e,
+                    extra={"event": "federation_unreachable", "peer": (host, port)},
+                )
+            else:
+                delay = RECONNECT_DELAY
+                await PeerLink(self, reader, writer).run()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def publish(self, frame: bytes):
+        """Relay a locally broadcast frame to every peer."""
+        self.seq += 1
+        record = RECORD.pack(self.node_id, self.seq) + frame
+        for link in self.links:
+            link.send(record)
+
+    def receive(self, source: PeerLink, batch: bytes):
+        """Deliver and forward the records of a batch received from `source`.
+
+        Raises:
+            ValueError: If the batch is corrupt or expands past
+                `LINK_MAX_FRAME_SIZE`.
+        """
+        body = batch[1:]
+        if batch[0] & COMPRESSED:
+            decompressor = zlib.decompressobj()
+            try:
+                body = decompressor.decompress(body, LINK_MAX_FRAME_SIZE)
+            except zlib.error as e:
+                raise ValueError(f"Corrupt compressed batch: {e}")
+            if decompressor.unconsumed_tail:
+                raise ValueError("Compressed batch is too large")
+        view = memoryview(body)
+        frames = []
+        offset = 0
+        while offset < len(body):
+            origin, seq = RECORD.unpack_from(body, offset)
+            start = offset + RECORD.size
+            end = start + HEADER.size + HEADER.unpack_from(body, start)[0]
+            if origin != self.node_id and self._seen(origin).add(seq):
+                record = bytes(view[offset:end])
+                for link in self.links:
+                    if link is not source:
+                        link.send(record)
+                frames.append(bytes(view[start:end]))
+            offset = end
+        if frames:
+            self.on_frames(frames)
+
+    def _seen(self, origin: bytes) -> SeenWindow:
+        window = self.seen.get(origin)
+        if window is None:
+            window = self.seen[origin] = SeenWindow()
+        return window
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
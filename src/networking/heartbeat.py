@@ -0,0 +1,120 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set
+
+from .connection import Connection
+from .protocol.messages import MessageType, encode_message
+
+HEARTBEAT_INTERVAL = 30.0
+SWEEP_INTERVAL = 1.0
+
+READ_TIMEOUT = "read"
+IDLE_TIMEOUT = "idle"
+
+
+class Reaper:
+    """Sends heartbeats and closes unresponsive connections from a single task.
+
+    Connections are kept in the order they were last heard from, and a read
+    moves a connection to the end. Each sweep walks from the front and stops
+    at the first connection heard from recently. The cost of a sweep therefore
+    depends on how many connections went quiet, not on how many are open, and
+    no connection needs a timer of its own.
+
+    Args:
+        on_timeout: Called with a connection and `READ_TIMEOUT` or `IDLE_TIMEOUT`
+            when the connection should be closed.
+        interval (Optional[float]): Seconds of silence before a connection is
+            pinged, or None to send no heartbeats.
+        read_timeout (Optional[float]): Seconds of silence, pongs included,
+            before a connection is closed (default: three intervals).
+        idle_timeout (Optional[float]): Seconds without any message other than
+            heartbeats before a connection is closed, or None to allow idle
+            connections.
+    """
+
+    def __init__(
+        self,
+        on_timeout: Callable[[Connection, str], None],
+        interval: Optional[float] = HEARTBEAT_INTERVAL,
+        read_timeout: Optional[float] = None,
+        idle_timeout: Optional[float] = None,
+    ):
+        self.on_timeout = on_timeout
+        self.interval = interval
+        self.read_timeout = read_timeout or (3 * interval if interval else None)
+        self.idle_timeout = idle_timeout
+        self.reads: Dict[Connection, float] = OrderedDict()
+        self.activity: Dict[Connection, float] = OrderedDict()
+        self.pinged: Set[Connection] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.read_timeout or self.idle_timeout)
+
+    def add(self, conn: Connection, heartbeat: bool = True):
+        """Start tracking a connection.
+
+        Args:
+            heartbeat (bool): Whether the connection answers pings. Connections
+                that do not are only subject to the idle timeout.
+        """
+        now = time.monotonic()
+        if heartbeat and self.read_timeout:
+            self.reads[conn] = now
+        if self.idle_timeout:
+            self.activity[conn] = now
+
+    def seen(self, conn: Connection, active: bool = True):
+        """Record that frames were read from a connection.
+
+        Args:
+            active (bool): False if the frames were only heartbeats.
+        """
+        now = time.monotonic()
+        if conn in self.reads:
+            self.reads[conn] = now
+            self.reads.move_to_end(conn)
+            self.pinged.discard(conn)
+        if active and conn in self.activity:
+            self.activity[conn] = now
+            self.activity.move_to_end(conn)
+
+    def remove(self, conn: Connection):
+        self.reads.pop(conn, None)
+        self.activity.pop(conn, None)
+        self.pinged.discard(conn)
+
+    def sweep(self, now: float):
+        expired = []
+        if self.read_timeout:
+            ping_before = now - self.interval if self.interval else None
+            expire_before = now - self.read_timeout
+            for conn, last in self.reads.items():
+                if last <= expire_before:
+                    expired.append((conn, READ_TIMEOUT))
+                elif ping_before is not None and last <= ping_before:
+                    if conn not in self.pinged:
+                        self.pinged.add(conn)
+                        conn.send(encode_message(MessageType.PING))
+                else:
+                    break
+        if self.idle_timeout:
+            expire_before = now - self.idle_timeout
+            for conn, last in self.activity.items():
+                if last > expire_before:
+                    break
+                expired.append((conn, IDLE_TIMEOUT))
+        for conn, reason in expired:
+            if conn in self.reads or conn in self.activity:
+                self.remove(conn)
+                self.on_timeout(conn, reason)
+
+    async def run(self):
+        tick = SWEEP_INTERVAL
+        if self.interval:
+            tick = min(tick, self.interval / 2)
+        while True:
+            await asyncio.sleep(tick)
+            self.sweep(time.monotonic())
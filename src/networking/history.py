@@ -0,0 +1,132 @@
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from .protocol.io import MAX_FRAME_SIZE
+from .protocol.messages import MESSAGE_HEADER, MessageType, Packet
+
+HISTORY_SIZE = 100
+HISTORY_BYTES = 256 * 1024
+HISTORY_ROOMS = 256
+HISTORY_REPLAY = 20
+
+
+def chat_frames(packet: Packet) -> Iterator[Tuple[int, bytes]]:
+    """Yield the sequence number and frame of each chat message in a packet."""
+    for frame in packet.frames:
+        _, _, type, _, _, seq = MESSAGE_HEADER.unpack_from(frame)
+        if type == MessageType.CHAT:
+            yield seq, frame
+
+
+class RoomHistory:
+    """The most recent chat frames of one room, bounded by count and size.
+
+    Frames are kept exactly as they were broadcast, so replaying them never
+    encodes anything again.
+    """
+
+    def __init__(self, size: int = HISTORY_SIZE, max_bytes: int = HISTORY_BYTES):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.frames: Deque[Tuple[int, bytes]] = deque()
+        self.bytes = 0
+
+    def append(self, seq: int, frame: bytes):
+        self.frames.append((seq, frame))
+        self.bytes += len(frame)
+        while len(self.frames) > self.size or self.bytes > self.max_bytes:
+            _, dropped = self.frames.popleft()
+            self.bytes -= len(dropped)
+
+    def since(self, seq: int) -> List[bytes]:
+        """Return the frames with a sequence number above `seq`.
+
+        Sequence numbers are only ordered among messages from the same server,
+        so this compares them rather than looking up the position of `seq`.
+        """
+        return [frame for frame_seq, frame in self.frames if frame_seq > seq]
+
+
+class History:
+    """Recent chat history of every room, for replay to clients that join.
+
+    Only chat messages are kept; system notices and file transfers are not. At
+    most `rooms` rooms have a history, the least recently active being dropped
+    first, so memory stays under `rooms` × `max_bytes` however busy the server.
+    """
+
+    def __init__(
+        self,
+        size: int = HISTORY_SIZE,
+        max_bytes: int = HISTORY_BYTES,
+        rooms: int = HISTORY_ROOMS,
+    ):
+        self.size = size
+        # A replay is sent as a single batch, which must fit in one frame.
+        self.max_bytes = min(max_bytes, MAX_FRAME_SIZE - MESSAGE_HEADER.size)
+        self.max_rooms = rooms
+        self.rooms: Dict[str, RoomHistory] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0 and self.max_bytes > 0 and self.max_rooms > 0
+
+    def record(self, packet: Packet):
+        """Keep the chat messages of a packet about to be delivered."""
+        if packet.bulk or not self.enabled:
+            return
+        history = None
+        for seq, frame in chat_frames(packet):
+            if history is None:
+                history = self._room(packet.room)
+            history.append(seq, frame)
+
+    def add(self, room: str, frame: bytes):
+        """Keep a chat message read back from storage."""
+        if self.enabled:
+            self._room(room).append(MESSAGE_HEADER.unpack_from(frame)[5], frame)
+
+    def _room(self, room: str) -> RoomHistory:
+        history = self.rooms.get(room)
+        if history is None:
+            history = self.rooms[room] = RoomHistory(self.size, self.max_bytes)
+            while len(self.rooms) > self.max_rooms:
+                self.rooms.popitem(last=False)
+        else:
+            self.rooms.move_to_end(room)
+        return history
+
+    def covers(
+        self, room: str, last: Optional[int] = None, since: Optional[int] = None
+    ) -> bool:
+        """Tell whether the kept messages are enough to answer a replay request,
+        assuming older messages may have been dropped."""
+        history = self.rooms.get(room)
+        if history is None:
+            return False
+        if since is not None:
+            return bool(history.frames) and history.frames[0][0] <= since
+        return last is not None and last <= len(history.frames)
+
+    def replay(
+        self, room: str, last: Optional[int] = None, since: Optional[int] = None
+    ) -> Optional[Packet]:
+        """Build a packet of the room's history, ready to queue on a connection.
+
+        Args:
+            last (Optional[int]): Replay at most this many of the latest messages.
+            since (Optional[int]): Replay the messages with a sequence number
+                above this one. Combined with `last`, both limits apply.
+        Returns:
+            Optional[Packet]: The messages, or None if there are none.
+        """
+        history = self.rooms.get(room)
+        if history is None:
+            return None
+        if since is not None:
+            frames = history.since(since)
+        else:
+            frames = [frame for _, frame in history.frames]
+        if last is not None:
+            frames = frames[-last:] if last > 0 else []
+        return Packet(room, frames) if frames else None
@@ -0,0 +1,89 @@
+from typing import Dict, List, Optional
+
+from .connection import Connection
+from .logs import RateLimit
+
+
+class RateLimiter:
+    """Message rate limits for each connection and for each client IP address.
+
+    Connections from the same IP address share one bucket, which is dropped
+    when the last of them closes. Clients of the Unix socket have no address
+    to share a bucket by, so only the per-connection limit applies to them.
+
+    Raises:
+        ValueError: If a burst is less than one message, which would never
+            let a message through.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        ip_rate: Optional[float] = None,
+        ip_burst: Optional[float] = None,
+    ):
+        for name, value in (("burst", burst), ("IP burst", ip_burst)):
+            if value is not None and value < 1:
+                raise ValueError(f"The {name} must be at least 1, not {value}")
+        self.rate = rate
+        self.burst = burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.ip_buckets: Dict[str, RateLimit] = {}
+        self.ip_connections: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rate or self.ip_rate)
+
+    @staticmethod
+    def _ip(conn: Connection) -> Optional[str]:
+        peer = conn.peername
+        return peer[0] if isinstance(peer, tuple) else None
+
+    @staticmethod
+    def _bucket(rate: float, burst: Optional[float]) -> RateLimit:
+        return RateLimit(rate, burst if burst is not None else max(1.0, 2 * rate))
+
+    def add(self, conn: Connection):
+        if self.rate:
+            conn.bucket = self._bucket(self.rate, self.burst)
+        ip = self._ip(conn)
+        if self.ip_rate and ip is not None:
+            if ip not in self.ip_buckets:
+                self.ip_buckets[ip] = self._bucket(self.ip_rate, self.ip_burst)
+            self.ip_connections[ip] = self.ip_connections.get(ip, 0) + 1
+
+    def remove(self, conn: Connection):
+        ip = self._ip(conn)
+        if self.ip_rate and ip is not None:
+            count = self.ip_connections.get(ip, 0) - 1
+            if count > 0:
+                self.ip_connections[ip] = count
+            else:
+                self.ip_connections.pop(ip, None)
+                self.ip_buckets.pop(ip, None)
+
+    def _buckets(self, conn: Connection) -> List[RateLimit]:
+        buckets = [conn.bucket] if conn.bucket else []
+        ip = self._ip(conn)
+        if self.ip_rate and ip is not None:
+            buckets.append(self.ip_buckets[ip])
+        return buckets
+
+    def limits(self, conn: Connection) -> bool:
+        """Return whether any limit applies to `conn`."""
+        return bool(self._buckets(conn))
+
+    def available(self, conn: Connection) -> int:
+        """Return how many messages `conn` may send right now."""
+        return min(bucket.available() for bucket in self._buckets(conn))
+
+    def delay(self, conn: Connection) -> float:
+        """Return how many seconds until `conn` may send its next message."""
+        return max(bucket.delay() for bucket in self._buckets(conn))
+
+    def take(self, conn: Connection, count: int):
+        for bucket in self._buckets(conn):
+            bucket.take(count)
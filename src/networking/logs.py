@@ -0,0 +1,126 @@
+"""Logging that stays off the event loop.
+
+Records are put on a queue by the calling thread and formatted and written by a
+background thread, so slow log output never delays message delivery. Log calls
+on the hot path pass their arguments separately (`logger.info("%s", value)`)
+so the message is only built on the writer thread.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Optional, Union
+
+JSON_FIELDS = ("conn", "peer", "alias", "event")
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The default handler formats the message before queueing it; the
+        # listener runs in this process, so the record can be queued as is.
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON lines.
+
+    Fields passed in `extra` (such as `event` and `conn`) become keys of the
+    object, so per-connection events can be filtered and aggregated.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in JSON_FIELDS:
+            value = getattr(record, field, None)
+            if isinstance(value, tuple):
+                # Socket addresses, as (host, port, ...).
+                value = ":".join(map(str, value[:2]))
+            if value is not None:
+                entry[field] = value if isinstance(value, (int, str)) else str(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def setup_logging(
+    level: Union[int, str] = logging.INFO, json_lines: bool = False, stream=None
+) -> logging.handlers.QueueListener:
+    """Send the root logger's records through a queue to a writer thread.
+
+    Args:
+        level (Union[int, str]): The root log level, as a number or a name.
+        json_lines (bool): Write JSON lines instead of plain text.
+        stream: Where to write to (default: stderr).
+    Returns:
+        QueueListener: The running writer; stop it to flush pending records.
+    """
+    output = logging.StreamHandler(stream or sys.stderr)
+    if json_lines:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, output)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(records))
+    root.setLevel(level)
+    listener.start()
+    return listener
+
+
+class RateLimit:
+    """Lets through at most `rate` events per second, in bursts of up to `burst`.
+
+    Used to sample high-rate log lines, where the number of events held back is
+    kept so it can be reported with the next one let through, and as the token
+    bucket behind client rate limits.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if burst is not None and burst < 1:
+            raise ValueError(f"The burst must be at least 1, not {burst}")
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> int:
+        """Return how many events are allowed right now."""
+        self._refill()
+        return max(0, int(self.tokens))
+
+    def delay(self) -> float:
+        """Return how many seconds until the next event is allowed."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self, amount: int = 1):
+        self.tokens -= amount
+
+    def allow(self) -> bool:
+        if self.available():
+            self.take()
+            return True
+        self.suppressed += 1
+        return False
+
+    def take_suppressed(self) -> int:
+        """Return the number of events held back since the last call, and reset it."""
+        suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
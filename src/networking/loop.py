@@ -0,0 +1,15 @@
+import asyncio
+
+
+def use_uvloop() -> bool:
+    """Install uvloop's event loop policy if uvloop is available.
+
+    Returns:
+        bool: True if uvloop is now the event loop policy.
+    """
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
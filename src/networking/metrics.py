@@ -0,0 +1,251 @@
+"""In-process server metrics.
+
+Counters, gauges and histograms are plain attributes updated inline on the hot
+path. The server only creates them when metrics are enabled, so a disabled
+server pays for a single `None` check at each instrumentation point.
+"""
+
+import asyncio
+import bisect
+import logging
+from typing import Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "netcomm_"
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = PREFIX + name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.value
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """A value that goes up and down, or is computed by `func` when read."""
+
+    type = "gauge"
+
+    def __init__(
+        self, name: str, help: str, func: Optional[Callable[[], float]] = None
+    ):
+        self.name = PREFIX + name
+        self.help = help
+        self.func = func
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def dec(self, amount: int = 1):
+        self.value -= amount
+
+    def get(self) -> float:
+        return self.func() if self.func else self.value
+
+    def samples(self):
+        yield self.name, self.get()
+
+    def snapshot(self):
+        return self.get()
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = PREFIX + name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # One count per bucket plus one for +Inf, cumulated when read.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _cumulative(self) -> List[int]:
+        total, cumulative = 0, []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def samples(self):
+        cumulative = self._cumulative()
+        for bound, count in zip(self.buckets, cumulative):
+            yield f'{self.name}_bucket{{le="{bound}"}}', count
+        yield f'{self.name}_bucket{{le="+Inf"}}', cumulative[-1]
+        yield f"{self.name}_sum", self.sum
+        yield f"{self.name}_count", self.count
+
+    def snapshot(self):
+        cumulative = self._cumulative()
+        return {
+            "buckets": dict(zip(self.buckets + (float("inf"),), cumulative)),
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+class Metrics:
+    """The metrics of one server process.
+
+    The gauges describing client queues are computed by the given callables when
+    the metrics are read, rather than kept up to date on every send.
+    """
+
+    def __init__(
+        self,
+        connections: Callable[[], int],
+        queued: Callable[[], int],
+        max_queued: Callable[[], int],
+    ):
+        self.connections_total = Counter(
+            "connections_total", "Client connections accepted."
+        )
+        self.handshake_failures = Counter(
+            "handshake_failures_total", "Connections closed during the handshake."
+        )
+        self.tls_full = Counter(
+            "tls_full_handshakes_total", "TLS handshakes that created a new session."
+        )
+        self.tls_resumed = Counter(
+            "tls_resumed_handshakes_total", "TLS handshakes that resumed a session."
+        )
+        self.frames_in = Counter("frames_in_total", "Frames read from clients.")
+        self.bytes_in = Counter("bytes_in_total", "Frame bytes read from clients.")
+        self.frames_out = Counter("frames_out_total", "Frames written to clients.")
+        self.bytes_out = Counter("bytes_out_total", "Bytes written to clients.")
+        self.dropped = Counter(
+            "dropped_frames_total", "Frames dropped because a client queue was full."
+        )
+        self.write_errors = Counter(
+            "write_errors_total", "Writes to clients that failed."
+        )
+        self.refused = Counter(
+            "refused_connections_total", "Connections refused at the connection cap."
+        )
+        self.throttled = Counter(
+            "throttled_reads_total",
+            "Times reading from a client paused for its rate limit.",
+        )
+        self.timeouts = Counter(
+            "timeouts_total", "Connections closed by the read or idle timeout."
+        )
+        self.connections = Gauge(
+            "connections", "Clients currently connected.", connections
+        )
+        self.queued = Gauge("queued_frames", "Frames waiting in client queues.", queued)
+        self.max_queued = Gauge("max_queue_depth", "Longest client queue.", max_queued)
+        self.writers = Gauge("active_writers", "Connections with a write in progress.")
+        self.broadcast_seconds = Histogram(
+            "broadcast_seconds", "Time to fan a packet out to a room."
+        )
+        self.deliver_seconds = Histogram(
+            "read_to_deliver_seconds",
+            "Time from reading frames to queueing their messages for recipients.",
+        )
+        self.metrics = [
+            self.connections_total,
+            self.handshake_failures,
+            self.tls_full,
+            self.tls_resumed,
+            self.refused,
+            self.throttled,
+            self.frames_in,
+            self.bytes_in,
+            self.frames_out,
+            self.bytes_out,
+            self.dropped,
+            self.write_errors,
+            self.timeouts,
+            self.connections,
+            self.queued,
+            self.max_queued,
+            self.writers,
+            self.broadcast_seconds,
+            self.deliver_seconds,
+        ]
+
+    def snapshot(self) -> Dict[str, object]:
+        """Current values, keyed by metric name."""
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name} {value}" for name, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        """Serve the metrics over HTTP for Prometheus to scrape."""
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                request = await reader.readuntil(b"\r\n\r\n")
+                path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+                if path.split(b"?")[0] == b"/metrics":
+                    status, body = "200 OK", self.render().encode()
+                else:
+                    status, body = "404 Not Found", b"Not found\n"
+                writer.write(
+                    f"HTTP/1.0 {status}\r\n"
+                    "Content-Type: text/plain; version=0.0.4\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+            except (
+                asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError,
+                ConnectionError,
+            ):
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        logger.info(
+            "Serving metrics on http://%s:%s/metrics.",
+            host,
+            port,
+            extra={"event": "metrics_serving"},
+        )
+        return server
@@ -0,0 +1,50 @@
+import itertools
+from typing import Dict, Optional
+
+from .connection import Connection
+
+MAX_ALIAS_LENGTH = 32
+
+
+class AliasRegistry:
+    """Which connection uses each alias, so aliases are unique on this server and
+    a client can be found by its alias without scanning every connection.
+
+    Aliases are compared case-insensitively.
+    """
+
+    def __init__(self, max_length: int = MAX_ALIAS_LENGTH):
+        self.max_length = max_length
+        self.connections: Dict[str, Connection] = {}
+
+    def claim(self, conn: Connection, alias: str) -> str:
+        """Register `conn` under `alias`, or under `alias-2`, `alias-3`... if it
+        is taken.
+
+        A connection resuming the session of the alias's holder (which is about
+        to be closed) takes the alias over.
+
+        Returns:
+            str: The alias registered.
+        """
+        self.release(conn)
+        candidate = alias
+        for n in itertools.count(2):
+            holder = self.connections.get(candidate.casefold())
+            if holder is None or holder is conn:
+                break
+            if conn.session is not None and holder.session is conn.session:
+                break
+            suffix = f"-{n}"
+            candidate = alias[: self.max_length - len(suffix)] + suffix
+        self.connections[candidate.casefold()] = conn
+        return candidate
+
+    def release(self, conn: Connection):
+        """Free the alias of `conn`, unless another connection took it over."""
+        key = conn.alias.casefold()
+        if self.connections.get(key) is conn:
+            del self.connections[key]
+
+    def get(self, alias: str) -> Optional[Connection]:
+        return self.connections.get(alias.casefold())
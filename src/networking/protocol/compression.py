@@ -0,0 +1,131 @@
+import zlib
+from typing import Optional, Sequence
+
+from .io import HEADER, MAX_FRAME_SIZE, split_frames
+from .messages import COMPRESSED, MESSAGE_HEADER, MessageType
+
+ZLIB = "zlib"
+ZLIB_STREAM = "zlib-stream"
+CODECS = (ZLIB_STREAM, ZLIB)
+
+COMPRESS_THRESHOLD = 256
+COMPRESSION_LEVEL = 6
+
+# Primes the compressor with text that shows up in most chat traffic, so even
+# short messages compress well.
+ZDICT = (
+    b"[+] has joined the chat![-] has left the chat.Now chatting in #lobby"
+    b"https://www.http://.com/ the and that this with have you for not are"
+    b" what your just like from they about would there can will know"
+    b" yes no ok thanks lol :) :( haha "
+)
+
+
+class Codec:
+    """Stateless zlib compression of message payloads with a preset dictionary.
+
+    Every frame is compressed on its own, so compressed frames can be shared by
+    every recipient that negotiated this codec.
+    """
+
+    name = ZLIB
+    shared = True
+
+    def __init__(self, threshold: int = COMPRESS_THRESHOLD):
+        self.threshold = threshold
+
+    def _compress(self, payload: bytes) -> bytes:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=ZDICT)
+        return compressor.compress(payload) + compressor.flush()
+
+    def _decompressor(self):
+        return zlib.decompressobj(zdict=ZDICT)
+
+    def compress_frame(self, frame: bytes) -> bytes:
+        """Compress the payload of a typed frame if it is over the threshold.
+
+        The handshake is never compressed, since the peer only learns the codec
+        from it.
+
+        Returns:
+            bytes: The frame, with the COMPRESSED flag set if it was compressed.
+        """
+        payload = frame[MESSAGE_HEADER.size :]
+        if len(payload) < self.threshold:
+            return frame
+        _, version, type, flags, sender, seq = MESSAGE_HEADER.unpack_from(frame)
+        if flags & COMPRESSED or type in (MessageType.HELLO, MessageType.WELCOME):
+            return frame
+        compressed = self._compress(payload)
+        if self.shared and len(compressed) >= len(payload):
+            return frame
+        length = MESSAGE_HEADER.size - HEADER.size + len(compressed)
+        header = MESSAGE_HEADER.pack(
+            length, version, type, flags | COMPRESSED, sender, seq
+        )
+        return header + compressed
+
+    def compress_frames(self, data: bytes) -> bytes:
+        """Compress each of the back-to-back typed frames in `data`."""
+        frames = split_frames(data)
+        if len(frames) == 1:
+            return self.compress_frame(data)
+        return b"".join(self.compress_frame(frame) for frame in frames)
+
+    def decompress(self, payload: bytes) -> bytes:
+        """Decompress a payload sent with the COMPRESSED flag.
+
+        Raises:
+            ValueError: If the payload is corrupt or expands past `MAX_FRAME_SIZE`.
+        """
+        decompressor = self._decompressor()
+        try:
+            data = decompressor.decompress(payload, MAX_FRAME_SIZE)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt compressed payload: {e}")
+        if decompressor.unconsumed_tail:
+            raise ValueError("Compressed payload is too large")
+        return data
+
+
+class StreamCodec(Codec):
+    """zlib compression with one streaming context per connection and direction.
+
+    Repeated aliases and phrases compress against everything sent earlier on the
+    connection, but compressed frames are only valid for that one connection and
+    must be decompressed in the order they were compressed.
+    """
+
+    name = ZLIB_STREAM
+    shared = False
+
+    def __init__(self, threshold: int = COMPRESS_THRESHOLD):
+        super().__init__(threshold)
+        self._compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=ZDICT)
+        self._stream_decompressor = zlib.decompressobj(zdict=ZDICT)
+
+    def _compress(self, payload: bytes) -> bytes:
+        return self._compressor.compress(payload) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def _decompressor(self):
+        return self._stream_decompressor
+
+
+def create_codec(
+    name: Optional[str], threshold: int = COMPRESS_THRESHOLD
+) -> Optional[Codec]:
+    if name == ZLIB:
+        return Codec(threshold)
+    if name == ZLIB_STREAM:
+        return StreamCodec(threshold)
+    return None
+
+
+def choose_codec(offered: Sequence[str]) -> Optional[str]:
+    """Pick the first codec in the client's order of preference that we support."""
+    for name in offered:
+        if name in CODECS:
+            return name
+    return None
@@ -0,0 +1,366 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Iterable, List, Optional, Tuple
+
+from .io import HEADER, MAX_FRAME_SIZE, StreamFrameReader
+
+BUFFER_SIZE = 64 * 1024
+READ_HIGH_WATER = 4 * BUFFER_SIZE
+
+STREAMS = "streams"
+PROTOCOL = "protocol"
+ENGINES = (STREAMS, PROTOCOL)
+
+
+class FramedProtocol(asyncio.BufferedProtocol):
+    """Length-prefixed framing on top of `asyncio.BufferedProtocol`.
+
+    The transport receives straight into a reusable buffer. Complete frames are
+    sliced out of it with memoryviews as soon as they arrive and handed to the
+    reader in batches, without going through a `StreamReader`. Like a
+    `StreamReader`, it stops reading from the socket while more than
+    `READ_HIGH_WATER` bytes of frames are waiting to be read.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = BUFFER_SIZE,
+        max_frame_size: int = MAX_FRAME_SIZE,
+    ):
+        self.max_frame_size = max_frame_size
+        self.transport: Optional[asyncio.Transport] = None
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._frames: Deque[bytes] = deque()
+        self._frames_size = 0
+        self._reading_paused = False
+        self._exception: Optional[Exception] = None
+        self._eof = False
+        self._waiter: Optional[asyncio.Future] = None
+        self._paused = False
+        self._drain_waiters: Deque[asyncio.Future] = deque()
+        self._closed = asyncio.get_running_loop().create_future()
+
+    # asyncio.BufferedProtocol callbacks
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._end == len(self._buffer):
+            self._make_room()
+        return self._view[self._end :]
+
+    def buffer_updated(self, nbytes: int):
+        self._end += nbytes
+        buffer, view, start, end = self._buffer, self._view, self._start, self._end
+        header_size = HEADER.size
+        while end - start >= header_size:
+            (length,) = HEADER.unpack_from(buffer, start)
+            if length > self.max_frame_size:
+                self._fail(ConnectionError(f"Frame of {length} bytes is too large"))
+                return
+            frame_end = start + header_size + length
+            if frame_end > end:
+                break
+            self._frames.append(bytes(view[start + header_size : frame_end]))
+            self._frames_size += length
+            start = frame_end
+        if start == end:
+            start = end = 0
+        self._start, self._end = start, end
+        if self._frames:
+            if self._frames_size > READ_HIGH_WATER and not self._reading_paused:
+                self._reading_paused = True
+                self.transport.pause_reading()
+            self._wakeup()
+
+    def eof_received(self):
+        self._eof = True
+        self._wakeup()
+
+    def connection_lost(self, exc):
+        if exc is not None and self._exception is None:
+            self._exception = ConnectionError(exc)
+        self._eof = True
+        self._wakeup()
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                waiter.set_exception(self._exception or ConnectionResetError())
+        self._drain_waiters.clear()
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._drain_waiters.clear()
+
+    # Buffer management
+
+    def _make_room(self):
+        pending = self._end - self._start
+        needed = HEADER.size
+        if pending >= HEADER.size:
+            needed += HEADER.unpack_from(self._buffer, self._start)[0]
+        data = self._view[self._start : self._end].tobytes()
+        if pending == len(self._buffer) or needed > len(self._buffer):
+            self._buffer = bytearray(max(needed, 2 * len(self._buffer)))
+            self._view = memoryview(self._buffer)
+        self._buffer[:pending] = data
+        self._start, self._end = 0, pending
+
+    def _fail(self, exc: Exception):
+        self._exception = exc
+        self._wakeup()
+        if self.transport is not None:
+            self.transport.abort()
+
+    def _wakeup(self):
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def _wait_for_frames(self):
+        while not self._frames:
+            if self._exception is not None:
+                raise self._exception
+            if self._eof:
+                raise ConnectionError
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+
+    # Reader API
+
+    async def read_frame(self) -> bytes:
+        """Read the payload of the next frame.
+
+        Raises:
+            ConnectionError: If the connection is closed before a frame arrives.
+        """
+        await self._wait_for_frames()
+        frame = self._frames.popleft()
+        self._frames_size -= len(frame)
+        self._maybe_resume_reading()
+        return frame
+
+    async def read_frames(self) -> List[bytes]:
+        """Read the payloads of every frame received so far, waiting for at least one.
+
+        Raises:
+            ConnectionError: If the connection is closed before a frame arrives.
+        """
+        await self._wait_for_frames()
+        frames = list(self._frames)
+        self._frames.clear()
+        self._frames_size = 0
+        self._maybe_resume_reading()
+        return frames
+
+    def _maybe_resume_reading(self):
+        if self._reading_paused and self._frames_size <= READ_HIGH_WATER // 2:
+            self._reading_paused = False
+            if not self.transport.is_closing():
+                self.transport.resume_reading()
+
+    async def _drain_helper(self):
+        if self.transport is None or self.transport.is_closing():
+            raise ConnectionResetError("Connection lost")
+        if not self._paused:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+
+class FramedWriter:
+    """The writing half of a `FramedProtocol` connection.
+
+    Mirrors the parts of `asyncio.StreamWriter` the rest of the package uses, so
+    both engines can be driven by the same code.
+    """
+
+    def __init__(self, transport: asyncio.Transport, protocol: FramedProtocol):
+        self.transport = transport
+        self._protocol = protocol
+
+    def write(self, data: bytes):
+        self.transport.write(data)
+
+    def writelines(self, data: Iterable[bytes]):
+        self.transport.writelines(data)
+
+    def is_closing(self) -> bool:
+        return self.transport.is_closing()
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await self._protocol._closed
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return self.transport.get_extra_info(name, default)
+
+    async def drain(self):
+        await self._protocol._drain_helper()
+
+
+async def open_framed_connection(
+    host: str, port: int, max_frame_size: int = MAX_FRAME_SIZE, **kwargs
+) -> Tuple[FramedProtocol, FramedWriter]:
+    """Open a connection using the protocol engine.
+
+    Returns:
+        Tuple[FramedProtocol, FramedWriter]: The reader and writer for the connection.
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_connection(
+        lambda: FramedProtocol(max_frame_size=max_frame_size), host, port, **kwargs
+    )
+    return protocol, FramedWriter(transport, protocol)
+
+
+async def open_framed_unix_connection(
+    path: str, max_frame_size: int = MAX_FRAME_SIZE, **kwargs
+) -> Tuple[FramedProtocol, FramedWriter]:
+    """Open a Unix socket connection using the protocol engine.
+
+    Returns:
+        Tuple[FramedProtocol, FramedWriter]: The reader and writer for the connection.
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_unix_connection(
+        lambda: FramedProtocol(max_frame_size=max_frame_size), path, **kwargs
+    )
+    return protocol, FramedWriter(transport, protocol)
+
+
+class _ServerProtocol(FramedProtocol):
+    def __init__(
+        self,
+        client_connected_cb: Callable[..., Awaitable[None]],
+        max_frame_size: int = MAX_FRAME_SIZE,
+    ):
+        super().__init__(max_frame_size=max_frame_size)
+        self._client_connected_cb = client_connected_cb
+        self._task: Optional[asyncio.Task] = None
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        writer = FramedWriter(transport, self)
+        self._task = asyncio.ensure_future(self._client_connected_cb(self, writer))
+
+
+async def start_framed_server(
+    client_connected_cb: Callable[[FramedProtocol, FramedWriter], Awaitable[None]],
+    host: str,
+    port: int,
+    max_frame_size: int = MAX_FRAME_SIZE,
+    **kwargs,
+) -> asyncio.AbstractServer:
+    """Start a server using the protocol engine.
+
+    Like `asyncio.start_server`, `client_connected_cb` is called with a reader and
+    a writer for every new connection.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(
+        lambda: _ServerProtocol(client_connected_cb, max_frame_size),
+        host,
+        port,
+        **kwargs,
+    )
+
+
+async def start_framed_unix_server(
+    client_connected_cb: Callable[[FramedProtocol, FramedWriter], Awaitable[None]],
+    path: str,
+    max_frame_size: int = MAX_FRAME_SIZE,
+    **kwargs,
+) -> asyncio.AbstractServer:
+    """Start a Unix socket server using the protocol engine."""
+    loop = asyncio.get_running_loop()
+    return await loop.create_unix_server(
+        lambda: _ServerProtocol(client_connected_cb, max_frame_size), path, **kwargs
+    )
+
+
+async def open_connection(host: str, port: int, engine: str = STREAMS, **kwargs):
+    """Open a framed connection with the given engine.
+
+    Returns:
+        A frame reader (with `read_frame`/`read_frames`) and a writer.
+    """
+    if engine == PROTOCOL:
+        return await open_framed_connection(host, port, **kwargs)
+    reader, writer = await asyncio.open_connection(host, port, **kwargs)
+    return StreamFrameReader(reader), writer
+
+
+async def open_unix_connection(path: str, engine: str = STREAMS, **kwargs):
+    """Open a framed Unix socket connection with the given engine.
+
+    Returns:
+        A frame reader (with `read_frame`/`read_frames`) and a writer.
+    """
+    if engine == PROTOCOL:
+        return await open_framed_unix_connection(path, **kwargs)
+    reader, writer = await asyncio.open_unix_connection(path, **kwargs)
+    return StreamFrameReader(reader), writer
+
+
+def _stream_callback(
+    client_connected_cb: Callable[..., Awaitable[None]],
+) -> Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]]:
+    """Wrap a callback so that it gets a frame reader instead of a StreamReader."""
+
+    async def handle_stream(reader, writer):
+        await client_connected_cb(StreamFrameReader(reader), writer)
+
+    return handle_stream
+
+
+async def start_server(
+    client_connected_cb: Callable[..., Awaitable[None]],
+    host: str,
+    port: int,
+    engine: str = STREAMS,
+    **kwargs,
+) -> asyncio.AbstractServer:
+    """Start a framed server with the given engine.
+
+    `client_connected_cb` is called with a frame reader and a writer regardless of
+    the engine.
+    """
+    if engine == PROTOCOL:
+        return await start_framed_server(client_connected_cb, host, port, **kwargs)
+    callback = _stream_callback(client_connected_cb)
+    return await asyncio.start_server(callback, host, port, **kwargs)
+
+
+async def start_unix_server(
+    client_connected_cb: Callable[..., Awaitable[None]],
+    path: str,
+    engine: str = STREAMS,
+    **kwargs,
+) -> asyncio.AbstractServer:
+    """Start a framed Unix socket server with the given engine.
+
+    `client_connected_cb` is called with a frame reader and a writer regardless of
+    the engine.
+    """
+    if engine == PROTOCOL:
+        return await start_framed_unix_server(client_connected_cb, path, **kwargs)
+    callback = _stream_callback(client_connected_cb)
+    return await asyncio.start_unix_server(callback, path, **kwargs)
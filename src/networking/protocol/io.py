@@ -1,8 +1,57 @@
 import asyncio
 import struct
-from typing import Union
+from typing import Iterable, List, Union
 
-MAX_MESSAGE_LENGTH = 1024
+MAX_FRAME_SIZE = 1024 * 1024
+HEADER = struct.Struct("!I")
+
+
+def encode_frame(message: Union[str, bytes]) -> bytes:
+    """Build a complete length-prefixed frame, ready to be written as is.
+
+    Frames are immutable, so a frame built once can be shared by every recipient.
+
+    Args:
+        message (Union[str, bytes]): The message to frame. If a string is provided, it will be encoded to bytes.
+    Returns:
+        bytes: The length header followed by the payload.
+    """
+    if isinstance(message, str):
+        message = message.encode()
+    return HEADER.pack(len(message)) + message
+
+
+def split_frames(data: bytes) -> List[bytes]:
+    """Split a buffer of back-to-back frames into individual frames.
+
+    Args:
+        data (bytes): Concatenated frames built with `encode_frame`.
+    Returns:
+        List[bytes]: The frames, each still including its length header.
+    """
+    frames = []
+    view = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        end = offset + HEADER.size + HEADER.unpack_from(data, offset)[0]
+        frames.append(bytes(view[offset:end]))
+        offset = end
+    return frames
+
+
+async def write_frames(writer: asyncio.StreamWriter, frames: Iterable[bytes]) -> None:
+    """Write several pre-built frames with a single vectored write and one drain.
+
+    Args:
+        writer (asyncio.StreamWriter): The stream writer to write to.
+        frames (Iterable[bytes]): Frames built with `encode_frame`.
+    Raises:
+        ConnectionError: If the writer is closing.
+    """
+    if writer.is_closing():
+        raise ConnectionError
+    writer.writelines(frames)
+    await writer.drain()
 
 
 async def write_message(
@@ -18,10 +67,7 @@ async def write_message(
     """
     if writer.is_closing():
         raise ConnectionError
-    if isinstance(message, str):
-        message = message.encode()
-    writer.write(struct.pack("!I", len(message)))
-    writer.write(message)
+    writer.write(encode_frame(message))
     await writer.drain()
 
 
@@ -35,12 +81,48 @@ async def read_message(reader: asyncio.StreamReader) -> str:
     Raises:
         ConnectionError: If the connection is closed before reading the message.
     """
-    try:
-        header = await reader.readexactly(4)
-        length_data = struct.unpack("!I", header)[0]
-        if length_data > MAX_MESSAGE_LENGTH:
-            length_data = MAX_MESSAGE_LENGTH
-        data = await reader.readexactly(length_data)
-    except asyncio.IncompleteReadError:
-        raise ConnectionError
+    data = await StreamFrameReader(reader).read_frame()
     return data.decode()
+
+
+class StreamFrameReader:
+    """Frame-level reader on top of an `asyncio.StreamReader`.
+
+    Exposes the same `read_frame`/`read_frames` interface as the protocol engine's
+    reader, so the server and client can be driven by either engine.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader):
+        self.reader = reader
+
+    async def read_frame(self) -> bytes:
+        """Read the payload of the next frame.
+
+        Raises:
+            ConnectionError: If the connection is closed before reading the frame, or
+                the frame is larger than `MAX_FRAME_SIZE`.
+        """
+        try:
+            header = await self.reader.readexactly(HEADER.size)
+            length_data = HEADER.unpack(header)[0]
+            if length_data > MAX_FRAME_SIZE:
+                raise ConnectionError(f"Frame of {length_data} bytes is too large")
+            return await self.reader.readexactly(length_data)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError
+
+    async def read_frames(self) -> List[bytes]:
+        """Read the payloads of every complete frame already buffered, waiting for at least one.
+
+        Raises:
+            ConnectionError: If the connection is closed before reading a frame.
+        """
+        frames = [await self.read_frame()]
+        # StreamReader has no public way to peek, so look at its internal buffer to
+        # pick up frames that can be read without suspending.
+        buffered = self.reader._buffer
+        while len(buffered) >= HEADER.size:
+            if len(buffered) < HEADER.size + HEADER.unpack_from(buffered)[0]:
+                break
+            frames.append(await self.read_frame())
+        return frames
@@ -0,0 +1,428 @@
+"""Typed binary messages.
+
+Every message is a regular length-prefixed frame whose payload starts with a
+fixed header, so both transport engines carry it unchanged:
+
+    length (I) | version (B) | type (B) | flags (B) | reserved | sender (I) | seq (Q) | payload
+
+Clients from before the typed protocol send a text handshake (`__alias__:<name>`)
+instead of a HELLO message and keep receiving plain text frames.
+"""
+
+import json
+import struct
+from enum import IntEnum
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .io import HEADER, encode_frame, split_frames
+
+VERSION = 2
+SUPPORTED_VERSIONS = (VERSION,)
+DEFAULT_ROOM = "lobby"
+
+MESSAGE_HEADER = struct.Struct("!IBBBxIQ")
+_BODY_HEADER = struct.Struct("!BBBxIQ")
+
+LEGACY = "legacy"
+TYPED = "typed"
+BATCHED = "batched"
+
+FEATURES = ("batching", "compression")
+
+COMPRESSED = 0x01
+
+TRANSFER_ID = struct.Struct("!I")
+CHUNK_HEADER = struct.Struct("!IQB")
+MORE = 0
+FINAL = 1
+ABORTED = 2
+FILE_TRANSFER = "file"
+TEXT_TRANSFER = "text"
+
+MEMBERS = "members"
+JOINED = "joined"
+LEFT = "left"
+RETURNED = "returned"
+
+
+class MessageType(IntEnum):
+    HELLO = 1
+    WELCOME = 2
+    CHAT = 3
+    SYSTEM = 4
+    JOIN = 5
+    LEAVE = 6
+    ROOMS = 7
+    BATCH = 8
+    FILE = 9
+    CHUNK = 10
+    PING = 11
+    PONG = 12
+    HISTORY = 13
+    PRESENCE = 14
+    DIRECT = 15
+
+
+def encode_message(
+    type: MessageType, payload: bytes = b"", sender: int = 0, seq: int = 0, flags: int = 0
+) -> bytes:
+    """Build a complete typed frame.
+
+    Returns:
+        bytes: The header followed by the payload.
+    """
+    length = _BODY_HEADER.size + len(payload)
+    return MESSAGE_HEADER.pack(length, VERSION, type, flags, sender, seq) + payload
+
+
+class Header(NamedTuple):
+    version: int
+    type: int
+    flags: int
+    sender: int
+    seq: int
+
+
+def decode_message(frame: bytes) -> Tuple[Header, bytes]:
+    """Split a frame read from a connection into its header and payload.
+
+    Args:
+        frame (bytes): The frame, without its length prefix.
+    Raises:
+        ValueError: If the frame is too short to hold a header.
+    """
+    if len(frame) < _BODY_HEADER.size:
+        raise ValueError("Truncated message header")
+    return Header(*_BODY_HEADER.unpack_from(frame)), frame[_BODY_HEADER.size :]
+
+
+def frame_seq(frame: bytes) -> int:
+    """Read the sequence number of a complete typed frame."""
+    return MESSAGE_HEADER.unpack_from(frame)[5]
+
+
+def is_typed(frame: bytes) -> bool:
+    """Tell a typed HELLO apart from a legacy text handshake."""
+    return frame[:1] == bytes((VERSION,))
+
+
+def is_heartbeat(frame: bytes) -> bool:
+    """Tell whether a typed frame (without its length prefix) is a PING or PONG."""
+    return len(frame) > 1 and frame[1] in (MessageType.PING, MessageType.PONG)
+
+
+def pack_str(data: bytes) -> bytes:
+    """Prefix a short byte string (at most 255 bytes) with its length."""
+    return bytes((len(data),)) + data
+
+
+def unpack_str(data: bytes, offset: int = 0) -> Tuple[bytes, int]:
+    """Read a string written with `pack_str`.
+
+    Returns:
+        Tuple[bytes, int]: The string and the offset just after it.
+    """
+    end = offset + 1 + data[offset]
+    return data[offset + 1 : end], end
+
+
+def encode_json(type: MessageType, data: dict, **kwargs) -> bytes:
+    return encode_message(type, json.dumps(data).encode(), **kwargs)
+
+
+def chat_frame(
+    seq: int,
+    sender: int,
+    room: bytes,
+    alias: bytes,
+    body: bytes,
+    type: MessageType = MessageType.CHAT,
+) -> bytes:
+    """Build the CHAT (or FILE) message relayed to clients.
+
+    `room` and `alias` are expected to be packed with `pack_str` already, so the
+    body is relayed without being decoded.
+    """
+    return encode_message(type, room + alias + body, sender, seq)
+
+
+def file_frame(
+    transfer_id: int,
+    name: str,
+    size: Optional[int],
+    kind: str = FILE_TRANSFER,
+    room: str = "",
+) -> bytes:
+    """Build the FILE message a client sends to start a chunked transfer.
+
+    Args:
+        transfer_id (int): An ID for the transfer, unique among the sender's
+            ongoing transfers.
+        size (Optional[int]): The total size in bytes, if known up front.
+        kind (str): `FILE_TRANSFER`, or `TEXT_TRANSFER` for a message too large
+            for a single frame.
+    """
+    info = json.dumps({"name": name, "size": size, "kind": kind}).encode()
+    payload = pack_str(room.encode()) + TRANSFER_ID.pack(transfer_id) + info
+    return encode_message(MessageType.FILE, payload)
+
+
+def chunk_frame(
+    transfer_id: int,
+    offset: int,
+    data: bytes,
+    status: int = MORE,
+    sender: int = 0,
+    room: str = "",
+) -> bytes:
+    """Build a CHUNK carrying `data` at `offset` in the transfer.
+
+    The last chunk has the status FINAL, or ABORTED if the transfer was cut short.
+    Clients leave the room empty; the server fills in the room of the transfer.
+    """
+    payload = pack_str(room.encode()) + CHUNK_HEADER.pack(transfer_id, offset, status)
+    return encode_message(MessageType.CHUNK, payload + data, sender)
+
+
+class TransferInfo(NamedTuple):
+    id: int
+    name: str
+    size: Optional[int]
+    kind: str
+
+
+def parse_transfer(data: bytes) -> TransferInfo:
+    """Decode the body of a FILE message (after its room and alias)."""
+    (transfer_id,) = TRANSFER_ID.unpack_from(data)
+    info = json.loads(data[TRANSFER_ID.size :])
+    size = info.get("size")
+    return TransferInfo(
+        transfer_id,
+        str(info.get("name", "")),
+        int(size) if size is not None else None,
+        info.get("kind", FILE_TRANSFER),
+    )
+
+
+def history_frame(
+    room: str = "", last: Optional[int] = None, since: Optional[int] = None
+) -> bytes:
+    """Build the HISTORY request for the recent messages of a room.
+
+    Args:
+        room (str): The room, or the last room joined if empty.
+        last (Optional[int]): Request at most this many of the latest messages.
+        since (Optional[int]): Request the messages after this sequence number.
+    """
+    query = {}
+    if last is not None:
+        query["last"] = last
+    if since is not None:
+        query["since"] = since
+    payload = pack_str(room.encode()) + json.dumps(query).encode()
+    return encode_message(MessageType.HISTORY, payload)
+
+
+def presence_frame(room: str, event: str, aliases: List[str], seq: int = 0) -> bytes:
+    """Build a PRESENCE message about the members of a room.
+
+    Args:
+        event (str): `MEMBERS` for a snapshot of every member, or `JOINED`,
+            `LEFT` or `RETURNED` (reconnected) for a change to the members.
+        aliases (List[str]): The aliases of the members concerned.
+    """
+    info = json.dumps({"event": event, "aliases": aliases}).encode()
+    return encode_message(MessageType.PRESENCE, pack_str(room.encode()) + info, seq=seq)
+
+
+def direct_frame(alias: str, body: bytes, sender: int = 0, seq: int = 0) -> bytes:
+    """Build a DIRECT message: from a client, `alias` is the recipient; from the
+    server, it is the sender."""
+    return encode_message(
+        MessageType.DIRECT, pack_str(alias.encode()) + body, sender, seq
+    )
+
+
+class PresenceInfo(NamedTuple):
+    event: str
+    aliases: List[str]
+
+
+def parse_presence(data: bytes) -> PresenceInfo:
+    """Decode the body of a PRESENCE message (after its room)."""
+    info = json.loads(data)
+    return PresenceInfo(str(info.get("event", "")), list(info.get("aliases", ())))
+
+
+def presence_text(room: str, info: PresenceInfo) -> str:
+    aliases = ", ".join(info.aliases)
+    if info.event == MEMBERS:
+        return f"Online: {aliases}."
+    if info.event == JOINED:
+        return f"[+] {aliases} has joined the chat!"
+    if info.event == RETURNED:
+        return f"[+] {aliases} is back."
+    return f"[-] {aliases} has left the chat."
+
+
+def system_frame(text: str, room: str = DEFAULT_ROOM, seq: int = 0) -> bytes:
+    return encode_message(
+        MessageType.SYSTEM, pack_str(room.encode()) + text.encode(), seq=seq
+    )
+
+
+class Message(NamedTuple):
+    """A message received by a client."""
+
+    type: MessageType
+    text: str
+    room: str = DEFAULT_ROOM
+    alias: str = ""
+    sender: int = 0
+    seq: int = 0
+    data: bytes = b""
+
+    def __str__(self) -> str:
+        if self.type == MessageType.DIRECT:
+            return f"[from {self.alias}] {self.text}"
+        text = f"{self.alias}: {self.text}" if self.type == MessageType.CHAT else self.text
+        if self.room and self.room != DEFAULT_ROOM:
+            return f"[{self.room}] {text}"
+        return text
+
+
+def parse_message(frame: bytes, codec=None) -> List[Message]:
+    """Decode a frame sent by the server into the messages it carries.
+
+    Args:
+        frame (bytes): The frame, without its length prefix.
+        codec (Optional[Codec]): The codec negotiated for the connection, used to
+            decompress payloads sent with the COMPRESSED flag.
+    """
+    header, payload = decode_message(frame)
+    if header.flags & COMPRESSED:
+        payload = codec.decompress(payload)
+    if header.type == MessageType.BATCH:
+        return [
+            message
+            for inner in split_frames(payload)
+            for message in parse_message(inner[HEADER.size :], codec)
+        ]
+    if header.type == MessageType.CHAT:
+        room, offset = unpack_str(payload)
+        alias, offset = unpack_str(payload, offset)
+        text = payload[offset:]
+    elif header.type == MessageType.SYSTEM:
+        room, offset = unpack_str(payload)
+        alias, text = b"", payload[offset:]
+    elif header.type == MessageType.FILE:
+        room, offset = unpack_str(payload)
+        alias, offset = unpack_str(payload, offset)
+        data = payload[offset:]
+        info = parse_transfer(data)
+        size = "unknown size" if info.size is None else f"{info.size:,} bytes"
+        if info.kind == TEXT_TRANSFER:
+            text = f"{alias.decode()} is sending a long message ({size})."
+        else:
+            text = f"{alias.decode()} is sending {info.name} ({size})."
+        return [
+            Message(
+                MessageType.FILE,
+                text,
+                room.decode(),
+                alias.decode(),
+                header.sender,
+                header.seq,
+                data,
+            )
+        ]
+    elif header.type == MessageType.CHUNK:
+        room, offset = unpack_str(payload)
+        return [
+            Message(
+                MessageType.CHUNK, "", room.decode(), "", header.sender, 0, payload[offset:]
+            )
+        ]
+    elif header.type in (MessageType.PING, MessageType.PONG):
+        return [Message(MessageType(header.type), "", "", data=payload)]
+    elif header.type == MessageType.PRESENCE:
+        room, offset = unpack_str(payload)
+        data = payload[offset:]
+        text = presence_text(room.decode(), parse_presence(data))
+        return [
+            Message(MessageType.PRESENCE, text, room.decode(), "", 0, header.seq, data)
+        ]
+    elif header.type == MessageType.DIRECT:
+        alias, offset = unpack_str(payload)
+        room, text = b"", payload[offset:]
+    elif header.type == MessageType.ROOMS:
+        rooms: Dict[str, int] = json.loads(payload)
+        listing = ", ".join(f"#{room} ({size})" for room, size in sorted(rooms.items()))
+        return [Message(MessageType.ROOMS, f"Rooms: {listing}", "")]
+    else:
+        return []
+    # The server only relays valid UTF-8, but a bad frame from an older server
+    # or a federated peer must not stop the receiver.
+    return [
+        Message(
+            MessageType(header.type),
+            text.decode(errors="replace"),
+            room.decode(errors="replace"),
+            alias.decode(errors="replace"),
+            header.sender,
+            header.seq,
+        )
+    ]
+
+
+class Packet:
+    """Messages broadcast together to one room.
+
+    Each entry is a complete typed frame. The bytes sent to each kind of recipient
+    (protocol variant and, if it can be shared, compression codec) are built on
+    first use and then shared by every recipient of that kind. Bulk packets (file
+    transfers) are queued separately so they do not hold up chat.
+    """
+
+    __slots__ = ("room", "frames", "bulk", "_encoded")
+
+    def __init__(self, room: str, frames: List[bytes], bulk: bool = False):
+        self.room = room
+        self.frames = frames
+        self.bulk = bulk
+        self._encoded: Dict[str, bytes] = {}
+
+    @classmethod
+    def from_frame(cls, frame: bytes) -> "Packet":
+        """Rebuild a packet from its typed encoding (as relayed between servers)."""
+        header, payload = decode_message(frame[HEADER.size :])
+        frames = split_frames(payload) if header.type == MessageType.BATCH else [frame]
+        first_header, first = decode_message(frames[0][HEADER.size :])
+        room, _ = unpack_str(first)
+        bulk = first_header.type in (MessageType.FILE, MessageType.CHUNK)
+        return cls(room.decode(), frames, bulk)
+
+    def encode(self, variant: str, codec=None) -> bytes:
+        key = variant if codec is None else f"{variant}+{codec.name}"
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            if codec is None:
+                encoded = self._encode(variant)
+            else:
+                encoded = codec.compress_frames(self.encode(variant))
+            self._encoded[key] = encoded
+        return encoded
+
+    def _encode(self, variant: str) -> bytes:
+        if variant == LEGACY:
+            return b"".join(
+                encode_frame(str(message))
+                for frame in self.frames
+                for message in parse_message(frame[HEADER.size :])
+                if message.type != MessageType.CHUNK
+            )
+        if len(self.frames) == 1:
+            return self.frames[0]
+        if variant == BATCHED:
+            return encode_message(MessageType.BATCH, b"".join(self.frames))
+        return b"".join(self.frames)
@@ -0,0 +1,85 @@
+from typing import Dict, Set
+
+from .connection import Connection
+
+MAX_ROOM_NAME_LENGTH = 32
+
+_EMPTY: Set[Connection] = frozenset()
+
+
+class RoomIndex:
+    """Two-way index between rooms and the connections subscribed to them.
+
+    Rooms are created on first join and dropped when their last member leaves, so
+    fanning out to a room only ever touches that room's members.
+    """
+
+    def __init__(self):
+        self.members: Dict[str, Set[Connection]] = {}
+        self.memberships: Dict[Connection, Set[str]] = {}
+
+    def join(self, conn: Connection, room: str) -> bool:
+        """Subscribe a connection to a room.
+
+        Returns:
+            bool: True if the connection was not already a member.
+        """
+        members = self.members.setdefault(room, set())
+        if conn in members:
+            return False
+        members.add(conn)
+        self.memberships.setdefault(conn, set()).add(room)
+        return True
+
+    def leave(self, conn: Connection, room: str) -> bool:
+        """Unsubscribe a connection from a room.
+
+        Returns:
+            bool: True if the connection was a member.
+        """
+        members = self.members.get(room)
+        if not members or conn not in members:
+            return False
+        members.discard(conn)
+        if not members:
+            del self.members[room]
+        rooms = self.memberships[conn]
+        rooms.discard(room)
+        if not rooms:
+            del self.memberships[conn]
+        return True
+
+    def leave_all(self, conn: Connection) -> Set[str]:
+        """Unsubscribe a connection from every room.
+
+        Returns:
+            Set[str]: The rooms the connection was a member of.
+        """
+        rooms = self.memberships.pop(conn, set())
+        for room in rooms:
+            members = self.members[room]
+            members.discard(conn)
+            if not members:
+                del self.members[room]
+        return rooms
+
+    def get(self, room: str) -> Set[Connection]:
+        return self.members.get(room, _EMPTY)
+
+    def rooms_of(self, conn: Connection) -> Set[str]:
+        return self.memberships.get(conn, _EMPTY)
+
+    def sizes(self) -> Dict[str, int]:
+        return {room: len(members) for room, members in self.members.items()}
+
+
+def normalize_room_name(name: str) -> str:
+    """Clean up a room name sent by a client.
+
+    Raises:
+        ValueError: If the name is empty or too long.
+    """
+    name = name.strip().lstrip("#")
+    if not name or len(name) > MAX_ROOM_NAME_LENGTH:
+        raise ValueError(f"Invalid room name: {name!r}")
+    return name
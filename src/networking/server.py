@@ -1,83 +1,860 @@
 import asyncio
+import functools
+import itertools
+import json
 import logging
+import os
+import secrets
 import signal
-import ssl
+import time
 
-from typing import List
-from .protocol.io import write_message, read_message
+from typing import Callable, List, Optional, Set
+from .connection import Connection, DROP_OLDEST, OVERFLOW_POLICIES
+from .federation import FEDERATION_HOST, Federation
+from .heartbeat import HEARTBEAT_INTERVAL, Reaper
+from .history import (
+    HISTORY_BYTES,
+    HISTORY_REPLAY,
+    HISTORY_ROOMS,
+    HISTORY_SIZE,
+    History,
+)
+from .limits import RateLimiter
+from .logs import RateLimit, setup_logging
+from .loop import use_uvloop
+from .metrics import Metrics
+from .presence import MAX_ALIAS_LENGTH, AliasRegistry
+from .protocol.compression import COMPRESS_THRESHOLD, choose_codec, create_codec
+from .protocol.framing import ENGINES, STREAMS, start_server, start_unix_server
+from .protocol.messages import (
+    ABORTED,
+    BATCHED,
+    CHUNK_HEADER,
+    COMPRESSED,
+    DEFAULT_ROOM,
+    FEATURES,
+    JOINED,
+    LEFT,
+    LEGACY,
+    MEMBERS,
+    RETURNED,
+    SUPPORTED_VERSIONS,
+    TYPED,
+    MessageType,
+    Packet,
+    chat_frame,
+    chunk_frame,
+    decode_message,
+    direct_frame,
+    encode_json,
+    encode_message,
+    frame_seq,
+    is_heartbeat,
+    is_typed,
+    MORE,
+    pack_str,
+    parse_transfer,
+    presence_frame,
+    system_frame,
+    unpack_str,
+)
+from .rooms import RoomIndex, normalize_room_name
+from .sessions import SESSION_TTL, SessionStore
+from .storage import FSYNC_INTERVAL, SEGMENT_BYTES, MessageLog
+from .tls import CERT_FILE, KEY_FILE, TLS_TICKETS, server_context
+from .workers import Bus, run_workers
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
+
+MAX_TRANSFERS = 8
+MAX_HANDSHAKES = 256
+HANDSHAKE_TIMEOUT = 10.0
+FRAME_LOG_RATE = 10
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+METRICS_HOST = "127.0.0.1"
 
 
 class Server:
-    def __init__(self, host="0.0.0.0", port=50000, tls=False):
+    def __init__(
+        self,
+        host="0.0.0.0",
+        port=50000,
+        tls=False,
+        queue_size=1024,
+        overflow=DROP_OLDEST,
+        engine=STREAMS,
+        reuse_port=False,
+        bus_path=None,
+        peers=(),
+        federation_port=None,
+        federation_host=FEDERATION_HOST,
+        federation_compress=False,
+        compression=True,
+        compress_threshold=COMPRESS_THRESHOLD,
+        metrics=False,
+        metrics_port=None,
+        metrics_host=METRICS_HOST,
+        heartbeat_interval=HEARTBEAT_INTERVAL,
+        read_timeout=None,
+        idle_timeout=None,
+        rate_limit=None,
+        rate_burst=None,
+        ip_rate_limit=None,
+        ip_rate_burst=None,
+        max_connections=None,
+        max_handshakes=MAX_HANDSHAKES,
+        handshake_timeout=HANDSHAKE_TIMEOUT,
+        certfile=CERT_FILE,
+        keyfile=KEY_FILE,
+        tls_tickets=TLS_TICKETS,
+        history_size=HISTORY_SIZE,
+        history_bytes=HISTORY_BYTES,
+        history_rooms=HISTORY_ROOMS,
+        history_replay=HISTORY_REPLAY,
+        storage=None,
+        storage_segment_bytes=SEGMENT_BYTES,
+        storage_max_bytes=None,
+        storage_max_age=None,
+        storage_fsync_interval=FSYNC_INTERVAL,
+        session_ttl=SESSION_TTL,
+        unix_socket=None,
+    ):
         self.host = host
         self.port = port
+        self.unix_socket = unix_socket
+        self.unix_server = None
         self.tls = tls
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.tls_tickets = tls_tickets
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.engine = engine
+        self.reuse_port = reuse_port
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.bus_path = bus_path
+        self.bus = None
+        self.federation = None
+        if peers or federation_port:
+            self.federation = Federation(
+                self.deliver_remote,
+                host=federation_host,
+                port=federation_port,
+                peers=peers,
+                compress=federation_compress,
+            )
         self.server = None
-        self.writers = set()
+        self.connections = set()
+        self.metrics = None
+        if metrics or metrics_port:
+            self.metrics = Metrics(
+                lambda: len(self.connections),
+                lambda: sum(len(c.queue) + len(c.bulk) for c in self.connections),
+                lambda: max((len(c.queue) for c in self.connections), default=0),
+            )
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.metrics_server = None
+        self.rooms = RoomIndex()
+        self.aliases = AliasRegistry()
+        self.sessions = SessionStore(session_ttl)
+        self.history = History(history_size, history_bytes, history_rooms)
+        self.history_replay = history_replay
+        self.log = None
+        self.replays: Set[asyncio.Task] = set()
+        if storage:
+            self.log = MessageLog(
+                storage,
+                storage_segment_bytes,
+                storage_max_bytes,
+                storage_max_age,
+                storage_fsync_interval,
+            )
+        self.reaper = Reaper(
+            self.on_timeout, heartbeat_interval, read_timeout, idle_timeout
+        )
+        self.reaper_task = None
+        self.limiter = RateLimiter(rate_limit, rate_burst, ip_rate_limit, ip_rate_burst)
+        self.max_connections = max_connections
+        self.max_handshakes = max_handshakes
+        self.handshake_timeout = handshake_timeout
+        self.handshakes: Optional[asyncio.Semaphore] = None
+        self.handshaking = 0
+        self.ids = itertools.count(1)
+        self.frame_log = RateLimit(FRAME_LOG_RATE)
+        self.seq = 0
+        # Names the sequence numbers given out, which only continue across a
+        # restart when they are kept in the message log.
+        self.epoch = secrets.token_hex(8)
 
-    async def close_writer(self, writer: asyncio.StreamWriter):
-        self.writers.discard(writer)
-        writer.close()
-        await writer.wait_closed()
+    async def close_connection(self, conn: Connection):
+        self.connections.discard(conn)
+        await conn.close()
 
-    async def broadcast(self, message: str, exclude: List[asyncio.StreamWriter] = []):
-        message = message.encode()
-        writers = self.writers.difference(exclude)
-        for writer in writers:
-            try:
-                await write_message(writer, message)
-            except ConnectionError as e:
-                logger.error(
-                    f"Error broadcasting to {writer.get_extra_info('peername')}: {e}"
-                )
-                await self.close_writer(writer)
-
-    async def handle_client(
-        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    def on_timeout(self, conn: Connection, reason: str):
+        logger.info(
+            "Closing %s as %r after a %s timeout.",
+            conn.peername,
+            conn.alias,
+            reason,
+            extra=conn.log_fields(f"{reason}_timeout"),
+        )
+        if self.metrics:
+            self.metrics.timeouts.inc()
+        conn.abort()
+
+    def next_seq(self) -> int:
+        self.seq += 1
+        return self.seq
+
+    def deliver(self, packet: Packet, exclude: Optional[Connection] = None):
+        if self.metrics:
+            started = time.perf_counter()
+        self.history.record(packet)
+        if self.log:
+            self.log.record(packet)
+        for conn in self.rooms.get(packet.room):
+            if conn is not exclude:
+                conn.send_packet(packet)
+        if self.metrics:
+            self.metrics.broadcast_seconds.observe(time.perf_counter() - started)
+
+    def deliver_remote(self, frames: List[bytes]):
+        for frame in frames:
+            self.deliver(Packet.from_frame(frame))
+
+    def publish(self, packet: Packet, exclude: Optional[Connection] = None):
+        self.deliver(packet, exclude)
+        if self.bus or self.federation:
+            frame = packet.encode(BATCHED)
+            if self.bus:
+                self.bus.publish(frame)
+            if self.federation:
+                self.federation.publish(frame)
+
+    def broadcast(
+        self,
+        message: str,
+        room: str = DEFAULT_ROOM,
+        exclude: Optional[Connection] = None,
+    ):
+        self.publish(Packet(room, [system_frame(message, room, self.next_seq())]), exclude)
+
+    def announce(self, conn: Connection, room: str, event: str):
+        """Tell the members of a room that `conn` joined, left or came back."""
+        frame = presence_frame(room, event, [conn.alias], self.next_seq())
+        self.publish(Packet(room, [frame]), exclude=conn)
+
+    def send_members(self, conn: Connection, room: str):
+        """Send `conn` the aliases of everyone in a room."""
+        aliases = sorted(member.alias for member in self.rooms.get(room))
+        conn.send_packet(Packet(room, [presence_frame(room, MEMBERS, aliases)]))
+
+    def direct_message(self, conn: Connection, payload: bytes):
+        """Route a DIRECT message to the one client it is addressed to."""
+        alias, offset = unpack_str(payload)
+        alias = alias.decode()
+        recipient = self.aliases.get(alias)
+        if recipient is None:
+            self.notify(conn, f"{alias} is not online.")
+            return
+        if not self.check_text(conn, payload[offset:]):
+            return
+        frame = direct_frame(conn.alias, payload[offset:], conn.id, self.next_seq())
+        recipient.send_packet(Packet(DEFAULT_ROOM, [frame]))
+
+    def notify(self, conn: Connection, message: str):
+        conn.send_packet(Packet(DEFAULT_ROOM, [system_frame(message)]))
+
+    def check_text(self, conn: Connection, body: bytes) -> bool:
+        """Refuse message text that is not valid UTF-8.
+
+        Bodies are relayed, kept in the history and logged as they were sent,
+        and every reader decodes them, so a bad one must not get past here.
+        """
+        try:
+            body.decode()
+        except UnicodeDecodeError:
+            self.notify(conn, "Messages must be valid UTF-8 text.")
+            return False
+        return True
+
+    def post(self, conn: Connection, room: str, body: bytes):
+        """Queue a chat message from `conn`; consecutive messages to the same room
+        are published together by `flush`."""
+        if room not in self.rooms.rooms_of(conn):
+            self.notify(conn, f"You are not in #{room}.")
+            return
+        if not self.check_text(conn, body):
+            return
+        if room != conn.outbox_room:
+            self.flush(conn)
+            conn.outbox_room = room
+        conn.outbox.append(
+            chat_frame(
+                self.next_seq(),
+                conn.id,
+                pack_str(room.encode()),
+                pack_str(conn.alias.encode()),
+                body,
+            )
+        )
+
+    def flush(self, conn: Connection):
+        if conn.outbox:
+            self.publish(Packet(conn.outbox_room, conn.outbox), exclude=conn)
+            conn.outbox = []
+
+    def start_transfer(self, conn: Connection, payload: bytes):
+        """Announce a file transfer from `conn` and remember which room its chunks
+        go to."""
+        room, offset = unpack_str(payload)
+        room = room.decode() or conn.room
+        if room not in self.rooms.rooms_of(conn):
+            self.notify(conn, f"You are not in #{room}.")
+            return
+        body = payload[offset:]
+        info = parse_transfer(body)
+        if len(conn.transfers) >= MAX_TRANSFERS and info.id not in conn.transfers:
+            self.notify(conn, f"Too many transfers at once, {info.name!r} not sent.")
+            return
+        conn.transfers[info.id] = room
+        self.flush(conn)
+        frame = chat_frame(
+            self.next_seq(),
+            conn.id,
+            pack_str(room.encode()),
+            pack_str(conn.alias.encode()),
+            body,
+            MessageType.FILE,
+        )
+        self.publish(Packet(room, [frame], bulk=True), exclude=conn)
+
+    def relay_chunk(self, conn: Connection, payload: bytes):
+        _, offset = unpack_str(payload)
+        transfer_id, _, status = CHUNK_HEADER.unpack_from(payload, offset)
+        room = conn.transfers.get(transfer_id)
+        if room is None:
+            # The transfer was refused when it started.
+            return
+        if status != MORE:
+            del conn.transfers[transfer_id]
+        frame = encode_message(
+            MessageType.CHUNK, pack_str(room.encode()) + payload[offset:], conn.id
+        )
+        self.publish(Packet(room, [frame], bulk=True), exclude=conn)
+
+    def abort_transfers(self, conn: Connection):
+        for transfer_id, room in conn.transfers.items():
+            frame = chunk_frame(transfer_id, 0, b"", ABORTED, conn.id, room)
+            self.publish(Packet(room, [frame], bulk=True), exclude=conn)
+        conn.transfers.clear()
+
+    def replay_history(
+        self,
+        conn: Connection,
+        room: str,
+        last: Optional[int] = None,
+        since: Optional[int] = None,
     ):
+        """Queue the recent messages of a room on `conn`, as one packet."""
+        packet = self.history.replay(room, last, since)
+        if packet:
+            conn.send_packet(packet)
+
+    def history_command(self, conn: Connection, payload: bytes):
+        room, offset = unpack_str(payload)
+        room = room.decode() or conn.room
+        if room not in self.rooms.rooms_of(conn):
+            self.notify(conn, f"You are not in #{room}.")
+            return
+        query = json.loads(payload[offset:] or b"{}")
+        last, since = query.get("last"), query.get("since")
+        last = int(last) if last is not None else None
+        since = int(since) if since is not None else None
+        if self.log and not self.history.covers(room, last, since):
+            if last is None and since is None:
+                last = self.history.size
+            task = asyncio.create_task(self.replay_stored(conn, room, last, since))
+            self.replays.add(task)
+            task.add_done_callback(self.replays.discard)
+        else:
+            self.replay_history(conn, room, last, since)
+
+    async def replay_stored(
+        self,
+        conn: Connection,
+        room: str,
+        last: Optional[int] = None,
+        since: Optional[int] = None,
+    ):
+        frames = await self.recent_frames(room, last, since)
+        if frames:
+            conn.send_packet(Packet(room, frames))
+
+    async def recent_frames(
+        self, room: str, last: Optional[int] = None, since: Optional[int] = None
+    ) -> List[bytes]:
+        """Get the recent chat frames of a room, oldest first.
+
+        Messages older than the in-memory history are read from storage, in an
+        executor. The latest ones may not have been written yet, so they are
+        still taken from memory.
+        """
+        packet = self.history.replay(room, last, since)
+        frames = packet.frames if packet else []
+        if self.log and not self.history.covers(room, last, since):
+            loop = asyncio.get_running_loop()
+            stored = await loop.run_in_executor(
+                None,
+                functools.partial(
+                    self.log.read,
+                    room,
+                    since,
+                    limit=last,
+                    max_bytes=self.history.max_bytes,
+                ),
+            )
+            kept = set(map(frame_seq, frames))
+            older = [frame for _, frame in stored if frame_seq(frame) not in kept]
+            frames = older + frames
+            if last is not None:
+                frames = frames[-last:]
+        return frames
+
+    async def catch_up(self, conn: Connection, since: int):
+        """Send a resumed client the messages of its rooms it missed, in one batch."""
+        until = self.seq
+        frames = []
+        for room in sorted(self.rooms.rooms_of(conn)):
+            frames.extend(await self.recent_frames(room, since=since))
+        # Messages delivered while reading from storage were sent live.
+        frames = sorted(
+            (frame for frame in frames if frame_seq(frame) <= until), key=frame_seq
+        )
+        size = sum(map(len, frames))
+        start = 0
+        while size > self.history.max_bytes:
+            size -= len(frames[start])
+            start += 1
+        if frames[start:]:
+            conn.send_packet(Packet(conn.room, frames[start:]))
+
+    def remember_rooms(self, conn: Connection):
+        if conn.session:
+            conn.session.rooms = set(self.rooms.rooms_of(conn))
+            conn.session.room = conn.room
+
+    def join_room(self, conn: Connection, room: str):
+        if self.rooms.join(conn, room):
+            self.announce(conn, room, JOINED)
+            self.send_members(conn, room)
+            self.replay_history(conn, room, self.history_replay)
+        conn.room = room
+        self.remember_rooms(conn)
+        self.notify(conn, f"Now chatting in #{room}.")
+
+    def leave_room(self, conn: Connection, room: str):
+        rooms = self.rooms.rooms_of(conn)
+        if room in rooms and len(rooms) == 1:
+            self.notify(conn, "You cannot leave your last room.")
+            return
+        if self.rooms.leave(conn, room):
+            self.announce(conn, room, LEFT)
+        self.notify(conn, f"Left #{room}.")
+        if room == conn.room:
+            conn.room = DEFAULT_ROOM if DEFAULT_ROOM in rooms else min(rooms)
+            self.notify(conn, f"Now chatting in #{conn.room}.")
+        self.remember_rooms(conn)
+
+    def list_rooms(self, conn: Connection):
+        rooms = encode_json(MessageType.ROOMS, self.rooms.sizes())
+        conn.send_packet(Packet(DEFAULT_ROOM, [rooms]))
+
+    def room_command(self, conn: Connection, command: MessageType, name: str):
+        self.flush(conn)
+        try:
+            name = normalize_room_name(name)
+        except ValueError as e:
+            self.notify(conn, str(e))
+            return
+        if command == MessageType.JOIN:
+            self.join_room(conn, name)
+        else:
+            self.leave_room(conn, name)
+
+    def handle_legacy(self, conn: Connection, frame: bytes):
+        if frame == b"__rooms__":
+            self.flush(conn)
+            self.list_rooms(conn)
+        elif frame.startswith((b"__join__:", b"__leave__:")):
+            if not self.check_text(conn, frame):
+                return
+            command, name = frame.decode().split(":", 1)
+            join = command == "__join__"
+            self.room_command(conn, MessageType.JOIN if join else MessageType.LEAVE, name)
+        else:
+            self.post(conn, conn.room, frame)
+
+    def handle_typed(self, conn: Connection, frame: bytes):
+        header, payload = decode_message(frame)
+        if header.flags & COMPRESSED:
+            if conn.codec is None:
+                raise ValueError("Compressed message without a negotiated codec")
+            payload = conn.codec.decompress(payload)
+        if header.type == MessageType.CHAT:
+            room, offset = unpack_str(payload)
+            self.post(conn, room.decode() or conn.room, payload[offset:])
+        elif header.type == MessageType.CHUNK:
+            self.relay_chunk(conn, payload)
+        elif header.type == MessageType.PONG:
+            pass
+        elif header.type == MessageType.PING:
+            conn.send(encode_message(MessageType.PONG, payload))
+        elif header.type == MessageType.FILE:
+            self.start_transfer(conn, payload)
+        elif header.type in (MessageType.JOIN, MessageType.LEAVE):
+            self.room_command(conn, header.type, payload.decode())
+        elif header.type == MessageType.ROOMS:
+            self.flush(conn)
+            self.list_rooms(conn)
+        elif header.type == MessageType.HISTORY:
+            self.flush(conn)
+            self.history_command(conn, payload)
+        elif header.type == MessageType.DIRECT:
+            self.flush(conn)
+            self.direct_message(conn, payload)
+        elif header.type == MessageType.PRESENCE:
+            room, _ = unpack_str(payload)
+            room = room.decode() or conn.room
+            if room in self.rooms.rooms_of(conn):
+                self.send_members(conn, room)
+            else:
+                self.notify(conn, f"You are not in #{room}.")
+        else:
+            logger.warning(
+                "Unexpected message type %s from %s.",
+                header.type,
+                conn.peername,
+                extra={"event": "unexpected_message", "conn": conn.id},
+            )
+
+    def handshake(self, conn: Connection, frame: bytes):
+        """Set up a connection from its first frame: a typed HELLO or, from older
+        clients, a `__alias__:<name>` text frame."""
+        if not is_typed(frame):
+            alias = frame.decode().split(":", 1)[-1]
+            conn.alias = alias.strip()[:MAX_ALIAS_LENGTH] or "Anonymous"
+            requested = conn.alias
+            self.claim_alias(conn)
+        else:
+            _, payload = decode_message(frame)
+            hello = json.loads(payload)
+            versions = set(hello.get("versions", ())).intersection(SUPPORTED_VERSIONS)
+            if not versions:
+                raise ValueError(f"No common protocol version in {hello.get('versions')}")
+            features = [f for f in hello.get("features", ()) if f in FEATURES]
+            conn.variant = BATCHED if "batching" in features else TYPED
+            codec = None
+            if self.compression and "compression" in features:
+                codec = choose_codec(hello.get("codecs", ()))
+            conn.alias = str(hello.get("alias", "")).strip()[:MAX_ALIAS_LENGTH]
+            conn.alias = conn.alias or "Anonymous"
+            if self.sessions.enabled:
+                self.start_session(conn, hello.get("resume"))
+            requested = conn.alias
+            self.claim_alias(conn)
+            welcome = {
+                "version": max(versions),
+                "id": conn.id,
+                "alias": conn.alias,
+                "features": features,
+                "codec": codec,
+                "threshold": self.compress_threshold,
+                "heartbeat": self.reaper.interval,
+                "epoch": self.epoch,
+            }
+            if conn.session:
+                welcome["session"] = conn.session.token
+                welcome["resumed"] = conn.resume_seq is not None
+            conn.send(encode_json(MessageType.WELCOME, welcome))
+            conn.codec = create_codec(codec, self.compress_threshold)
+        if conn.alias != requested:
+            self.notify(conn, f"{requested} is taken, so you are {conn.alias}.")
+
+    def claim_alias(self, conn: Connection):
+        """Register the alias of `conn`, renaming it if another client has it."""
+        conn.alias = self.aliases.claim(conn, conn.alias)
+        if conn.session:
+            conn.session.alias = conn.alias
+
+    def start_session(self, conn: Connection, resume: Optional[dict]):
+        """Resume the session a client asks for, or start a new one.
+
+        Args:
+            resume (Optional[dict]): The `session` token and the `seq` of the last
+                message the client received, from its HELLO.
+        """
+        if isinstance(resume, dict):
+            session = self.sessions.resume(str(resume.get("session", "")), conn)
+            if session:
+                conn.session = session
+                conn.alias = session.alias
+                conn.resume_seq = int(resume.get("seq", 0))
+                return
+        conn.session = self.sessions.create(conn)
+
+    def admit(self, client_addr) -> bool:
+        """Check the global connection cap before accepting a client."""
+        if self.max_connections is None:
+            return True
+        if len(self.connections) + self.handshaking < self.max_connections:
+            return True
+        logger.warning(
+            "Refusing %s: %d connections open.",
+            client_addr,
+            self.max_connections,
+            extra={"event": "refused", "peer": client_addr},
+        )
+        if self.metrics:
+            self.metrics.refused.inc()
+        return False
+
+    async def read_handshake(self, conn: Connection):
+        """Read and process the first frame, waiting for a free handshake slot.
+
+        The TLS handshake, if any, is already done by then: asyncio completes it
+        before calling `handle_client`, so neither this slot nor `admit` covers
+        it. Only `ssl_handshake_timeout` bounds it.
+        """
+        if self.handshakes is None:
+            self.handshakes = asyncio.Semaphore(self.max_handshakes)
+        async with self.handshakes:
+            self.handshake(conn, await conn.reader.read_frame())
+
+    async def handle_limited(
+        self, conn: Connection, frames: List[bytes], handle: Callable
+    ):
+        """Handle frames no faster than the client's rate limits allow.
+
+        While the client is over its limit, nothing more is read from its socket,
+        so its socket buffers fill up and push back on it.
+        """
+        while frames:
+            allowed = self.limiter.available(conn)
+            if not allowed:
+                if self.metrics:
+                    self.metrics.throttled.inc()
+                await asyncio.sleep(self.limiter.delay(conn))
+                continue
+            batch, frames = frames[:allowed], frames[allowed:]
+            self.limiter.take(conn, len(batch))
+            for frame in batch:
+                handle(conn, frame)
+            self.flush(conn)
+
+    async def handle_client(self, reader, writer: asyncio.StreamWriter):
         client_addr = writer.get_extra_info("peername")
-        handshake = await read_message(reader)
-        alias = handshake.split(":", 1)[-1].strip()
-        self.writers.add(writer)
-        logger.info(f"[+] New connection: {client_addr} as '{alias}'.")
-        await self.broadcast(f"[+] {alias} has joined the chat!", exclude=[writer])
+        if not self.admit(client_addr):
+            writer.transport.abort()
+            return
+        conn = Connection(reader, writer, self.queue_size, self.overflow, self.metrics)
+        conn.id = next(self.ids)
+        metrics = self.metrics
+        if metrics:
+            metrics.connections_total.inc()
+            ssl_object = writer.get_extra_info("ssl_object")
+            if ssl_object:
+                if ssl_object.session_reused:
+                    metrics.tls_resumed.inc()
+                else:
+                    metrics.tls_full.inc()
+        self.handshaking += 1
+        try:
+            await asyncio.wait_for(self.read_handshake(conn), self.handshake_timeout)
+        except (ConnectionError, ValueError, asyncio.TimeoutError) as e:
+            logger.warning(
+                "Handshake with %s failed: %s",
+                client_addr,
+                "timed out" if isinstance(e, asyncio.TimeoutError) else e,
+                extra=conn.log_fields("handshake_failed"),
+            )
+            if metrics:
+                metrics.handshake_failures.inc()
+            self.aliases.release(conn)
+            await conn.close()
+            return
+        finally:
+            self.handshaking -= 1
+        self.connections.add(conn)
+        self.reaper.add(conn, heartbeat=conn.variant != LEGACY)
+        self.limiter.add(conn)
+        if conn.resume_seq is not None:
+            session = conn.session
+            for room in session.rooms:
+                self.rooms.join(conn, room)
+                self.announce(conn, room, RETURNED)
+                self.send_members(conn, room)
+            conn.room = session.room
+            logger.info(
+                "[+] Resumed connection: %s as %r.",
+                client_addr,
+                conn.alias,
+                extra=conn.log_fields("resumed"),
+            )
+        else:
+            self.rooms.join(conn, conn.room)
+            self.send_members(conn, conn.room)
+            self.replay_history(conn, conn.room, self.history_replay)
+            logger.info(
+                "[+] New connection: %s as %r.",
+                client_addr,
+                conn.alias,
+                extra=conn.log_fields("connected"),
+            )
+            self.announce(conn, conn.room, JOINED)
+        handle = self.handle_legacy if conn.variant == LEGACY else self.handle_typed
         try:
+            if conn.resume_seq is not None:
+                await self.catch_up(conn, conn.resume_seq)
             while True:
-                message = await read_message(reader)
-                logger.debug(
-                    f"Received message from {alias}, {client_addr}: {message}."
-                )
-                await self.broadcast(f"{alias}: {message}", exclude=[writer])
+                frames = await reader.read_frames()
+                active = conn.variant == LEGACY or not all(map(is_heartbeat, frames))
+                self.reaper.seen(conn, active)
+                if metrics:
+                    started = time.perf_counter()
+                    metrics.frames_in.inc(len(frames))
+                    metrics.bytes_in.inc(sum(map(len, frames)))
+                if logger.isEnabledFor(logging.DEBUG) and self.frame_log.allow():
+                    # Sampled, since logging every frame would cost more than
+                    # handling it.
+                    logger.debug(
+                        "Received %d frames from %s, %s (%d log lines suppressed).",
+                        len(frames),
+                        conn.alias,
+                        client_addr,
+                        self.frame_log.take_suppressed(),
+                        extra=conn.log_fields("received"),
+                    )
+                if self.limiter.enabled and self.limiter.limits(conn):
+                    await self.handle_limited(conn, frames, handle)
+                else:
+                    for frame in frames:
+                        handle(conn, frame)
+                    self.flush(conn)
+                if metrics:
+                    metrics.deliver_seconds.observe(time.perf_counter() - started)
         # TODO: Error handling for client disconnection
         finally:
-            await self.close_writer(writer)
-            logger.info(f"[-] Closed connection: {client_addr} as {alias}.")
-            await self.broadcast(f"[-] {alias} has left the chat.")
+            self.reaper.remove(conn)
+            self.limiter.remove(conn)
+            await self.close_connection(conn)
+            logger.info(
+                "[-] Closed connection: %s as %r.",
+                client_addr,
+                conn.alias,
+                extra=conn.log_fields("disconnected"),
+            )
+            self.abort_transfers(conn)
+            # A client that reconnected before this connection was closed has
+            # already been announced as back.
+            session = conn.session
+            resumed = session is not None and session.conn not in (conn, None)
+            if conn.session:
+                self.sessions.detach(conn.session, conn)
+            self.aliases.release(conn)
+            for room in self.rooms.leave_all(conn):
+                if not resumed:
+                    self.announce(conn, room, LEFT)
+
+    def open_storage(self):
+        """Open the message log, and load its latest messages into the history."""
+        self.log.open()
+        self.seq = max(self.seq, self.log.last_seq)
+        self.epoch = self.log.epoch
+        if self.history.enabled:
+            # Sequence numbers also count system notices, so this reads somewhat
+            # fewer chat messages than the history can hold, without scanning
+            # the whole log.
+            recent = self.history.size * self.history.max_rooms
+            since = max(0, self.seq - recent)
+            for room, frame in self.log.read(since=since, limit=recent):
+                self.history.add(room, frame)
+        logger.info(
+            "Opened the message log in %s, at sequence number %d.",
+            self.log.directory,
+            self.seq,
+        )
 
     async def start(self):
         ssl_context = None
         if self.tls:
-            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-            ssl_context.load_cert_chain("ssl/server.crt", "ssl/server.key")
-        self.server = await asyncio.start_server(
+            ssl_context = server_context(self.certfile, self.keyfile, self.tls_tickets)
+        if self.log:
+            self.open_storage()
+        if self.bus_path:
+            self.bus = Bus(self.bus_path, self.deliver_remote)
+            await self.bus.connect()
+        if self.federation:
+            await self.federation.start()
+        if self.metrics_port:
+            self.metrics_server = await self.metrics.serve(
+                self.metrics_host, self.metrics_port
+            )
+        if self.reaper.enabled:
+            self.reaper_task = asyncio.create_task(self.reaper.run())
+        options = {"reuse_port": True} if self.reuse_port else {}
+        if ssl_context:
+            options["ssl_handshake_timeout"] = self.handshake_timeout
+        self.server = await start_server(
             self.handle_client,
             self.host,
             self.port,
+            engine=self.engine,
             ssl=ssl_context,
+            **options,
         )
-        logger.info(f"Server started on {self.host}:{self.port}.")
+        logger.info("Server started on %s:%s (%s).", self.host, self.port, self.engine)
+        if self.unix_socket:
+            # Same-host clients skip TCP, and TLS: the socket's file permissions
+            # control who can connect.
+            self.unix_server = await start_unix_server(
+                self.handle_client, self.unix_socket, engine=self.engine
+            )
+            logger.info("Listening on Unix socket %s.", self.unix_socket)
         async with self.server:
             await self.server.serve_forever()
 
     async def stop(self):
         logger.info("Stopping server...")
+        if self.unix_server:
+            self.unix_server.close()
+            try:
+                os.unlink(self.unix_socket)
+            except FileNotFoundError:
+                pass
+            self.unix_server.close_clients()
+            await self.unix_server.wait_closed()
         if self.server:
             self.server.close()
             self.server.close_clients()
             await self.server.wait_closed()
+        if self.bus:
+            await self.bus.close()
+        if self.federation:
+            await self.federation.stop()
+        if self.reaper_task:
+            self.reaper_task.cancel()
+        if self.metrics_server:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+        for task in self.replays:
+            task.cancel()
+        await asyncio.gather(*self.replays, return_exceptions=True)
+        if self.log:
+            # Waits for history reads still running in the executor.
+            await asyncio.get_running_loop().run_in_executor(None, self.log.close)
         logger.info("Server stopped gracefully.")
 
     async def run(self):
@@ -87,6 +864,19 @@ class Server:
             await self.stop()
 
 
+def serve(server: Server):
+    # https://stackoverflow.com/questions/48562893/how-to-gracefully-terminate-an-asyncio-script-with-ctrl-c
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    main_task = asyncio.ensure_future(server.run())
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, main_task.cancel)
+    try:
+        loop.run_until_complete(main_task)
+    finally:
+        loop.close()
+
+
 def main():
     import argparse
 
@@ -104,19 +894,294 @@ def main():
         help="Port to bind the server (default: 50000)",
     )
     parser.add_argument("--tls", action="store_true", help="Enable TLS")
+    parser.add_argument(
+        "--unix-socket",
+        metavar="PATH",
+        help="Also accept clients on this Unix socket path, without TLS",
+    )
+    parser.add_argument(
+        "--certfile",
+        default=CERT_FILE,
+        help=f"TLS certificate (default: {CERT_FILE})",
+    )
+    parser.add_argument(
+        "--keyfile", default=KEY_FILE, help=f"TLS private key (default: {KEY_FILE})"
+    )
+    parser.add_argument(
+        "--tls-tickets",
+        type=int,
+        default=TLS_TICKETS,
+        help="Session tickets issued per full TLS handshake, 0 to disable session "
+        f"resumption (default: {TLS_TICKETS})",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=1024,
+        help="Maximum queued outbound messages per client (default: 1024)",
+    )
+    parser.add_argument(
+        "--overflow",
+        choices=OVERFLOW_POLICIES,
+        default=DROP_OLDEST,
+        help=f"What to do when a client's queue is full (default: {DROP_OLDEST})",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default=STREAMS,
+        help=f"Transport engine for client connections (default: {STREAMS})",
+    )
+    parser.add_argument(
+        "--uvloop", action="store_true", help="Use uvloop if it is installed"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of server processes sharing the port (default: 1)",
+    )
+    parser.add_argument(
+        "--peer",
+        action="append",
+        default=[],
+        metavar="HOST:PORT",
+        help="Federation port of a peer server to relay messages with (repeatable)",
+    )
+    parser.add_argument(
+        "--federation-port",
+        type=int,
+        help="Port to accept federation links from peer servers on",
+    )
+    parser.add_argument(
+        "--federation-host",
+        default=FEDERATION_HOST,
+        help="Address to accept federation links on; peers are not authenticated, "
+        f"so only use a private network (default: {FEDERATION_HOST})",
+    )
+    parser.add_argument(
+        "--federation-compress",
+        action="store_true",
+        help="Compress relay batches sent to peer servers",
+    )
+    parser.add_argument(
+        "--no-compression",
+        action="store_true",
+        help="Do not negotiate message compression with clients",
+    )
+    parser.add_argument(
+        "--compress-threshold",
+        type=int,
+        default=COMPRESS_THRESHOLD,
+        help=f"Smallest message payload to compress, in bytes (default: {COMPRESS_THRESHOLD})",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve Prometheus metrics over HTTP on this port",
+    )
+    parser.add_argument(
+        "--metrics-host",
+        default=METRICS_HOST,
+        help=f"Address to serve metrics on (default: {METRICS_HOST}, so only "
+        "local scrapers can read them)",
+    )
+    parser.add_argument(
+        "--heartbeat-interval",
+        type=float,
+        default=HEARTBEAT_INTERVAL,
+        help="Seconds of silence before a client is pinged, 0 to disable "
+        f"(default: {HEARTBEAT_INTERVAL:g})",
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        help="Seconds of silence before a client is disconnected "
+        "(default: three heartbeat intervals)",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        help="Seconds without messages (heartbeats aside) before a client is "
+        "disconnected (default: never)",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        help="Messages per second each client may send (default: unlimited)",
+    )
+    parser.add_argument(
+        "--rate-burst",
+        type=float,
+        help="Messages a client may send at once "
+        "(default: twice the rate limit, at least 1)",
+    )
+    parser.add_argument(
+        "--ip-rate-limit",
+        type=float,
+        help="Messages per second shared by the clients of one IP address "
+        "(default: unlimited)",
+    )
+    parser.add_argument(
+        "--ip-rate-burst",
+        type=float,
+        help="Messages the clients of one IP address may send at once "
+        "(default: twice the IP rate limit, at least 1)",
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        help="Maximum number of connected clients (default: unlimited)",
+    )
+    parser.add_argument(
+        "--max-handshakes",
+        type=int,
+        default=MAX_HANDSHAKES,
+        help="Maximum protocol handshakes processed at once, not counting TLS "
+        f"handshakes, which come before them (default: {MAX_HANDSHAKES})",
+    )
+    parser.add_argument(
+        "--handshake-timeout",
+        type=float,
+        default=HANDSHAKE_TIMEOUT,
+        help=f"Seconds a client has to complete its handshake "
+        f"(default: {HANDSHAKE_TIMEOUT:g})",
+    )
+    parser.add_argument(
+        "--history-size",
+        type=int,
+        default=HISTORY_SIZE,
+        help="Chat messages kept per room for replay, 0 to keep none "
+        f"(default: {HISTORY_SIZE})",
+    )
+    parser.add_argument(
+        "--history-bytes",
+        type=int,
+        default=HISTORY_BYTES,
+        help=f"Bytes of chat messages kept per room (default: {HISTORY_BYTES})",
+    )
+    parser.add_argument(
+        "--history-rooms",
+        type=int,
+        default=HISTORY_ROOMS,
+        help=f"Rooms to keep history for (default: {HISTORY_ROOMS})",
+    )
+    parser.add_argument(
+        "--history-replay",
+        type=int,
+        default=HISTORY_REPLAY,
+        help="Messages replayed to a client when it joins a room "
+        f"(default: {HISTORY_REPLAY})",
+    )
+    parser.add_argument(
+        "--storage",
+        metavar="DIR",
+        help="Keep chat messages in a message log in this directory, across restarts",
+    )
+    parser.add_argument(
+        "--storage-segment-bytes",
+        type=int,
+        default=SEGMENT_BYTES,
+        help=f"Size of each message log segment file (default: {SEGMENT_BYTES})",
+    )
+    parser.add_argument(
+        "--storage-max-bytes",
+        type=int,
+        help="Drop the oldest segments once the message log is larger than this "
+        "(default: unlimited)",
+    )
+    parser.add_argument(
+        "--storage-max-age",
+        type=float,
+        help="Seconds to keep messages in the message log (default: forever)",
+    )
+    parser.add_argument(
+        "--storage-fsync-interval",
+        type=float,
+        default=FSYNC_INTERVAL,
+        help="Longest time logged messages wait to be synced to disk, in seconds "
+        f"(default: {FSYNC_INTERVAL:g})",
+    )
+    parser.add_argument(
+        "--session-ttl",
+        type=float,
+        default=SESSION_TTL,
+        help="Seconds a disconnected client can resume its session for, 0 to "
+        f"disable sessions (default: {SESSION_TTL:g})",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=LOG_LEVELS,
+        default="INFO",
+        help="Log level (default: INFO)",
+    )
+    parser.add_argument(
+        "--log-json", action="store_true", help="Write logs as JSON lines"
+    )
     args = parser.parse_args()
-    server = Server(host=args.host, port=args.port, tls=args.tls)
-
-    # https://stackoverflow.com/questions/48562893/how-to-gracefully-terminate-an-asyncio-script-with-ctrl-c
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    main_task = asyncio.ensure_future(server.run())
-    for sig in (signal.SIGINT, signal.SIGTERM):
-        loop.add_signal_handler(sig, main_task.cancel)
+    log_options = dict(level=args.log_level, json_lines=args.log_json)
+    listener = setup_logging(**log_options)
+    if args.workers > 1 and (args.peer or args.federation_port):
+        parser.error("federation cannot be combined with --workers")
+    if args.workers > 1 and args.metrics_port:
+        parser.error("--metrics-port cannot be combined with --workers")
+    if args.workers > 1 and args.storage:
+        parser.error("--storage cannot be combined with --workers")
+    if args.workers > 1 and args.unix_socket:
+        parser.error("--unix-socket cannot be combined with --workers")
+    bursts = {"--rate-burst": args.rate_burst, "--ip-rate-burst": args.ip_rate_burst}
+    for option, burst in bursts.items():
+        if burst is not None and burst < 1:
+            parser.error(f"{option} must be at least 1")
+    if args.uvloop and not use_uvloop():
+        logger.warning("uvloop is not installed, using the default event loop.")
+    server_kwargs = dict(
+        host=args.host,
+        port=args.port,
+        tls=args.tls,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+        tls_tickets=args.tls_tickets,
+        queue_size=args.queue_size,
+        overflow=args.overflow,
+        engine=args.engine,
+        peers=args.peer,
+        federation_port=args.federation_port,
+        federation_host=args.federation_host,
+        federation_compress=args.federation_compress,
+        compression=not args.no_compression,
+        compress_threshold=args.compress_threshold,
+        metrics_port=args.metrics_port,
+        metrics_host=args.metrics_host,
+        heartbeat_interval=args.heartbeat_interval or None,
+        read_timeout=args.read_timeout,
+        idle_timeout=args.idle_timeout,
+        rate_limit=args.rate_limit,
+        rate_burst=args.rate_burst,
+        ip_rate_limit=args.ip_rate_limit,
+        ip_rate_burst=args.ip_rate_burst,
+        max_connections=args.max_connections,
+        max_handshakes=args.max_handshakes,
+        handshake_timeout=args.handshake_timeout,
+        history_size=args.history_size,
+        history_bytes=args.history_bytes,
+        history_rooms=args.history_rooms,
+        history_replay=args.history_replay,
+        storage=args.storage,
+        storage_segment_bytes=args.storage_segment_bytes,
+        storage_max_bytes=args.storage_max_bytes,
+        storage_max_age=args.storage_max_age,
+        storage_fsync_interval=args.storage_fsync_interval,
+        session_ttl=args.session_ttl,
+        unix_socket=args.unix_socket,
+    )
     try:
-        loop.run_until_complete(main_task)
+        if args.workers > 1:
+            run_workers(args.workers, server_kwargs, args.uvloop, log_options)
+        else:
+            serve(Server(**server_kwargs))
     finally:
-        loop.close()
+        listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+import secrets
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from .connection import Connection
+from .protocol.messages import DEFAULT_ROOM
+
+SESSION_TTL = 120.0
+MAX_SESSIONS = 65536
+
+
+class Session:
+    """What a client needs restored when it reconnects: its alias and rooms."""
+
+    __slots__ = ("token", "alias", "rooms", "room", "conn", "expires")
+
+    def __init__(self, token: str, alias: str):
+        self.token = token
+        self.alias = alias
+        self.rooms: Set[str] = {DEFAULT_ROOM}
+        self.room = DEFAULT_ROOM
+        self.conn: Optional[Connection] = None
+        self.expires = 0.0
+
+
+class SessionStore:
+    """Sessions of connected clients, and of disconnected ones for `ttl` seconds.
+
+    Detached sessions are kept in the order they expire, so expired ones are
+    dropped from the front, and at most `max_sessions` are kept.
+    """
+
+    def __init__(
+        self, ttl: Optional[float] = SESSION_TTL, max_sessions: int = MAX_SESSIONS
+    ):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions: Dict[str, Session] = {}
+        self.detached: Dict[str, Session] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.ttl)
+
+    def create(self, conn: Connection) -> Session:
+        token = secrets.token_urlsafe(16)
+        session = Session(token, conn.alias)
+        session.conn = conn
+        self.sessions[token] = session
+        return session
+
+    def resume(self, token: str, conn: Connection) -> Optional[Session]:
+        """Hand a session over to a new connection.
+
+        If the session's previous connection is still open (the client noticed
+        the drop before the server did), it is aborted.
+
+        Returns:
+            Optional[Session]: The session, or None if it is unknown or expired.
+        """
+        self._expire(time.monotonic())
+        session = self.sessions.get(token)
+        if session is None:
+            return None
+        self.detached.pop(token, None)
+        if session.conn is not None:
+            session.conn.abort()
+        session.conn = conn
+        return session
+
+    def detach(self, session: Session, conn: Connection):
+        """Keep a session for `ttl` seconds after its connection closed."""
+        if session.conn is not conn:
+            # Already resumed by a newer connection.
+            return
+        session.conn = None
+        session.expires = time.monotonic() + self.ttl
+        self.detached[session.token] = session
+        self._expire(time.monotonic())
+        while len(self.detached) > self.max_sessions:
+            token, _ = self.detached.popitem(last=False)
+            del self.sessions[token]
+
+    def _expire(self, now: float):
+        expired = []
+        for token, session in self.detached.items():
+            if session.expires > now:
+                break
+            expired.append(token)
+        for token in expired:
+            del self.detached[token]
+            del self.sessions[token]
@@ -0,0 +1,616 @@
+"""Durable message log: append-only segment files with a sparse offset index.
+
+Chat frames are put on a queue by the event loop and appended to disk by a
+background thread, so live delivery never waits for the disk. The thread writes
+whatever has queued up in one go, and syncs to disk at most every
+`fsync_interval` seconds. Records are laid out as:
+
+    length (I) | time (d) | room (pack_str) | frame
+
+Each segment has a sparse index, kept in a `.idx` file next to it, that maps
+sequence numbers and timestamps to file offsets. Reads look up where to start
+in the index and map the segment into memory, so they only touch the pages
+holding the records they return.
+"""
+
+import bisect
+import contextlib
+import json
+import logging
+import mmap
+import os
+import queue
+import secrets
+import struct
+import threading
+import time
+from collections import deque
+from typing import Deque, Iterator, List, Optional, Tuple
+
+from .history import chat_frames
+from .protocol.messages import MESSAGE_HEADER, Packet, pack_str
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+FSYNC_INTERVAL = 1.0
+INDEX_INTERVAL = 4096
+EPOCH_FILE = "epoch"
+# Written before a compaction replaces any segment, listing what it replaces.
+COMPACTION_FILE = "compaction.json"
+
+RECORD = struct.Struct("!Id")
+# The highest sequence number and timestamp of the records before an offset.
+INDEX_ENTRY = struct.Struct("!QdQ")
+
+_STOP = object()
+
+
+class Segment:
+    """One log file and its sparse index.
+
+    An index entry is added every `INDEX_INTERVAL` bytes. Each holds the highest
+    sequence number and timestamp seen before its offset, so the entries stay
+    sorted even when messages relayed from other servers arrive out of order.
+    """
+
+    def __init__(self, base: str):
+        self.base = base
+        self.size = 0
+        self.seqs: List[int] = [0]
+        self.times: List[float] = [0.0]
+        self.offsets: List[int] = [0]
+        self.max_seq = 0
+        self.max_time = 0.0
+        self.first_time: Optional[float] = None
+        # Kept open for reading, so that the data stays readable after the file
+        # is removed or replaced, until the last reader is done with it.
+        self.file = None
+        self.log_file = None
+        self.index_file = None
+        # Reads in progress, and whether the segment was dropped from the log.
+        # Both are only changed with the log's lock.
+        self.readers = 0
+        self.retired = False
+
+    @property
+    def log_path(self) -> str:
+        return self.base + ".log"
+
+    @property
+    def index_path(self) -> str:
+        return self.base + ".idx"
+
+    def load(self):
+        """Read the index and recover whatever it is missing from the log.
+
+        A record cut short by a crash is truncated away.
+        """
+        size = os.path.getsize(self.log_path)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            for i in range(len(data) // INDEX_ENTRY.size):
+                seq, timestamp, offset = INDEX_ENTRY.unpack_from(
+                    data, i * INDEX_ENTRY.size
+                )
+                if offset > size:
+                    break
+                self.seqs.append(seq)
+                self.times.append(timestamp)
+                self.offsets.append(offset)
+        self.max_seq, self.max_time = self.seqs[-1], self.times[-1]
+        self.file = open(self.log_path, "rb")
+        end = self.offsets[-1]
+        with contextlib.closing(self.records(end, size)) as records:
+            for offset, end, seq, timestamp, _, _ in records:
+                self._track(offset, seq, timestamp)
+        if end < size:
+            logger.warning(
+                "Truncating %s from %d to %d bytes.",
+                self.log_path,
+                size,
+                end,
+                extra={"event": "log_truncated"},
+            )
+            os.truncate(self.log_path, end)
+        self.size = end
+        if end:
+            header = os.pread(self.file.fileno(), RECORD.size, 0)
+            self.first_time = RECORD.unpack(header)[1]
+        with open(self.index_path, "wb") as f:
+            f.writelines(
+                INDEX_ENTRY.pack(*entry)
+                for entry in zip(self.seqs[1:], self.times[1:], self.offsets[1:])
+            )
+
+    def _track(self, offset: int, seq: int, timestamp: float) -> bool:
+        """Account for a record at `offset` in the index.
+
+        Returns:
+            bool: True if an index entry was added for it.
+        """
+        added = offset - self.offsets[-1] >= INDEX_INTERVAL
+        if added:
+            self.seqs.append(self.max_seq)
+            self.times.append(self.max_time)
+            self.offsets.append(offset)
+        if self.first_time is None:
+            self.first_time = timestamp
+        self.max_seq = max(self.max_seq, seq)
+        self.max_time = max(self.max_time, timestamp)
+        return added
+
+    def open_for_append(self):
+        if self.file is None:
+            open(self.log_path, "ab").close()
+            self.file = open(self.log_path, "rb")
+        self.log_file = open(self.log_path, "ab")
+        self.index_file = open(self.index_path, "ab")
+
+    def write(
+        self, records: List[Tuple[float, bytes, bytes]]
+    ) -> Tuple[List[Tuple[int, int, float]], int]:
+        """Append records of (time, packed room, frame), without publishing them.
+
+        Returns:
+            Tuple[List[Tuple[int, int, float]], int]: The offset, sequence number
+                and time of each record, and the new size of the segment.
+        """
+        written = []
+        offset = self.size
+        for timestamp, room, frame in records:
+            self.log_file.write(RECORD.pack(len(room) + len(frame), timestamp))
+            self.log_file.write(room)
+            self.log_file.write(frame)
+            written.append((offset, MESSAGE_HEADER.unpack_from(frame)[5], timestamp))
+            offset += RECORD.size + len(room) + len(frame)
+        self.log_file.flush()
+        return written, offset
+
+    def publish(self, written: List[Tuple[int, int, float]], size: int):
+        """Make written records visible to readers. Called with the log's lock."""
+        for offset, seq, timestamp in written:
+            if self._track(offset, seq, timestamp):
+                self.index_file.write(
+                    INDEX_ENTRY.pack(self.seqs[-1], self.times[-1], offset)
+                )
+        self.index_file.flush()
+        self.size = size
+
+    def sync(self):
+        os.fsync(self.log_file.fileno())
+        os.fsync(self.index_file.fileno())
+
+    def seal(self):
+        """Sync the segment and stop appending to it."""
+        self.sync()
+        self.log_file.close()
+        self.index_file.close()
+        self.log_file = self.index_file = None
+
+    def start(self, since: Optional[int], after: Optional[float]) -> int:
+        """Find where the records above `since` and from `after` on begin, or
+        some point before that."""
+        i = 0
+        if since is not None:
+            i = bisect.bisect_right(self.seqs, since) - 1
+        if after is not None:
+            i = max(i, bisect.bisect_left(self.times, after) - 1)
+        return self.offsets[max(i, 0)]
+
+    def records(
+        self, start: int, size: int
+    ) -> Iterator[Tuple[int, int, int, float, bytes, bytes]]:
+        """Yield (offset, end, seq, time, packed room, frame) for each complete
+        record between `start` and `size`.
+
+        The segment stays mapped into memory until the iterator is exhausted or
+        closed, so callers that may stop early close it explicitly.
+        """
+        if start >= size:
+            return
+        with mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ) as view:
+            offset = start
+            while offset + RECORD.size <= size:
+                length, timestamp = RECORD.unpack_from(view, offset)
+                body = offset + RECORD.size
+                end = body + length
+                if end > size:
+                    return
+                room_end = body + 1 + view[body]
+                frame = view[room_end:end]
+                seq = MESSAGE_HEADER.unpack_from(frame)[5]
+                yield offset, end, seq, timestamp, view[body:room_end], frame
+                offset = end
+
+    def close(self):
+        for f in (self.file, self.log_file, self.index_file):
+            if f is not None:
+                f.close()
+        self.file = self.log_file = self.index_file = None
+
+    def retire(self):
+        """Close the segment once no read is using it. Called with the log's
+        lock."""
+        self.retired = True
+        if not self.readers:
+            self.close()
+
+    def delete(self):
+        for path in (self.log_path, self.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class MessageLog:
+    """The chat messages delivered by a server, kept on disk across restarts.
+
+    Messages go to the newest segment until it reaches `segment_bytes`, then a
+    new one is started. Whole segments are dropped, oldest first, once the log
+    is over `max_bytes` or their newest message is older than `max_age`
+    seconds. Sealed segments are also compacted: the oldest is rewritten without
+    its expired messages, merged with the next ones if they fit in one segment.
+
+    Args:
+        directory (str): Where to keep the segments, created if needed.
+        fsync_interval (float): Longest time written messages may wait before
+            being synced to disk.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = SEGMENT_BYTES,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+        fsync_interval: float = FSYNC_INTERVAL,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync_interval = fsync_interval
+        self.segments: List[Segment] = []
+        self.epoch: Optional[str] = None
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.reads = 0
+        self.pending: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def last_seq(self) -> int:
+        with self.lock:
+            return max((segment.max_seq for segment in self.segments), default=0)
+
+    def _base(self, segment_id: int) -> str:
+        return os.path.join(self.directory, f"{segment_id:010d}")
+
+    def open(self):
+        """Load the existing segments and start the writer thread."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.epoch = self._load_epoch()
+        self._recover_compaction()
+        ids = sorted(
+            int(name[:-4])
+            for name in os.listdir(self.directory)
+            if name.endswith(".log") and name[:-4].isdigit()
+        )
+        for segment_id in ids:
+            segment = Segment(self._base(segment_id))
+            segment.load()
+            self.segments.append(segment)
+        if not self.segments:
+            self.segments.append(Segment(self._base(0)))
+        self.segments[-1].open_for_append()
+        self._thread = threading.Thread(
+            target=self._write_loop, name="message-log", daemon=True
+        )
+        self._thread.start()
+
+    def _recover_compaction(self):
+        """Finish or undo a compaction interrupted by a crash.
+
+        Once the compacted log has replaced the first segment of the group, the
+        compaction is finished: its index is moved in place and the segments it
+        merged are deleted. Before that, the original segments are untouched
+        and the partial output is removed.
+        """
+        path = os.path.join(self.directory, COMPACTION_FILE)
+        try:
+            with open(path) as f:
+                group = json.load(f)["segments"]
+        except FileNotFoundError:
+            group = None
+        except ValueError:
+            # Cut short before it was complete, so nothing was replaced yet.
+            group = None
+        if group and not os.path.exists(self._base(group[0]) + ".compact.log"):
+            base = self._base(group[0])
+            if os.path.exists(base + ".compact.idx"):
+                os.replace(base + ".compact.idx", base + ".idx")
+            for segment_id in group[1:]:
+                Segment(self._base(segment_id)).delete()
+            logger.warning(
+                "Finished an interrupted compaction of segments %s.",
+                group,
+                extra={"event": "log_compaction_recovered"},
+            )
+        for name in os.listdir(self.directory):
+            if ".compact." in name or name.startswith(COMPACTION_FILE):
+                # Left over by a compaction that did not finish.
+                os.remove(os.path.join(self.directory, name))
+        self._sync_directory()
+
+    def _sync_directory(self):
+        """Make the latest renames and removals in the directory durable."""
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _load_epoch(self) -> str:
+        """Read the log's epoch, which names the sequence numbers it holds, or
+        start a new one."""
+        path = os.path.join(self.directory, EPOCH_FILE)
+        try:
+            with open(path) as f:
+                epoch = f.read().strip()
+            if epoch:
+                return epoch
+        except FileNotFoundError:
+            pass
+        epoch = secrets.token_hex(8)
+        with open(path + ".tmp", "w") as f:
+            f.write(epoch)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return epoch
+
+    def close(self):
+        """Write and sync everything queued, stop the writer thread, then close
+        the segments once the reads in progress are done with them.
+
+        Reads started after this find the log empty.
+        """
+        if self._thread:
+            self.pending.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        with self.idle:
+            self.idle.wait_for(lambda: not self.reads)
+            for segment in self.segments:
+                segment.retire()
+            self.segments = []
+
+    def record(self, packet: Packet):
+        """Queue the chat messages of a packet to be written."""
+        if packet.bulk:
+            return
+        now = time.time()
+        room = None
+        for _, frame in chat_frames(packet):
+            if room is None:
+                room = pack_str(packet.room.encode())
+            self.pending.put((now, room, frame))
+
+    def _write_loop(self):
+        synced = True
+        last_sync = time.monotonic()
+        while True:
+            timeout = None
+            if not synced:
+                timeout = max(0.0, last_sync + self.fsync_interval - time.monotonic())
+            try:
+                items = [self.pending.get(timeout=timeout)]
+            except queue.Empty:
+                items = []
+            while True:
+                try:
+                    items.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in items
+            records = [item for item in items if item is not _STOP]
+            try:
+                if records:
+                    self._write(records)
+                    synced = False
+                if not synced and (
+                    stop or time.monotonic() - last_sync >= self.fsync_interval
+                ):
+                    self.segments[-1].sync()
+                    self._apply_retention()
+                    synced = True
+                    last_sync = time.monotonic()
+            except OSError as e:
+                logger.error(
+                    "Error writing the message log: %s", e, extra={"event": "log_failed"}
+                )
+            if stop:
+                self.segments[-1].seal()
+                return
+
+    def _write(self, records: List[Tuple[float, bytes, bytes]]):
+        segment = self.segments[-1]
+        batch = []
+        batch_size = segment.size
+        for record in records:
+            length = RECORD.size + len(record[1]) + len(record[2])
+            if batch_size and batch_size + length > self.segment_bytes:
+                self._append(segment, batch)
+                segment = self._roll()
+                batch, batch_size = [], 0
+            batch.append(record)
+            batch_size += length
+        self._append(segment, batch)
+
+    def _append(self, segment: Segment, records: List[Tuple[float, bytes, bytes]]):
+        written, size = segment.write(records)
+        with self.lock:
+            segment.publish(written, size)
+
+    def _roll(self) -> Segment:
+        segment_id = int(os.path.basename(self.segments[-1].base)) + 1
+        segment = Segment(self._base(segment_id))
+        segment.open_for_append()
+        self.segments[-1].seal()
+        with self.lock:
+            self.segments.append(segment)
+        self._apply_retention()
+        self.compact()
+        return segment
+
+    def _apply_retention(self):
+        expired = []
+        with self.lock:
+            total = sum(segment.size for segment in self.segments)
+            cutoff = time.time() - self.max_age if self.max_age else None
+            for segment in self.segments[:-1]:
+                too_big = self.max_bytes is not None and total > self.max_bytes
+                too_old = cutoff is not None and segment.max_time < cutoff
+                if not (too_big or too_old):
+                    break
+                expired.append(segment)
+                total -= segment.size
+            del self.segments[: len(expired)]
+            for segment in expired:
+                segment.retire()
+        for segment in expired:
+            segment.delete()
+
+    def compact(self):
+        """Rewrite the oldest sealed segment without its expired messages, merged
+        with the segments after it that still fit.
+
+        Runs on the writer thread each time a segment is sealed. The result is
+        written next to the group, then `COMPACTION_FILE` records the group
+        before anything is replaced, so that `open` can finish or undo a
+        compaction interrupted by a crash and never loads a message twice.
+        """
+        cutoff = time.time() - self.max_age if self.max_age else None
+        with self.lock:
+            sealed = self.segments[:-1]
+        if not sealed:
+            return
+        group = [sealed[0]]
+        total = sealed[0].size
+        for segment in sealed[1:]:
+            if total + segment.size > self.segment_bytes:
+                break
+            group.append(segment)
+            total += segment.size
+        first_time = group[0].first_time
+        expired = cutoff is not None and first_time is not None and first_time < cutoff
+        if len(group) < 2 and not expired:
+            return
+        compacted = Segment(group[0].base + ".compact")
+        compacted.open_for_append()
+        for segment in group:
+            with contextlib.closing(segment.records(0, segment.size)) as records:
+                kept = [
+                    (timestamp, bytes(room), bytes(frame))
+                    for _, _, _, timestamp, room, frame in records
+                    if cutoff is None or timestamp >= cutoff
+                ]
+            if kept:
+                written, size = compacted.write(kept)
+                compacted.publish(written, size)
+        compacted.seal()
+        manifest = os.path.join(self.directory, COMPACTION_FILE)
+        segment_ids = [int(os.path.basename(segment.base)) for segment in group]
+        with open(manifest + ".tmp", "w") as f:
+            json.dump({"segments": segment_ids}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(manifest + ".tmp", manifest)
+        self._sync_directory()
+        # Replacing the log commits the compaction; see _recover_compaction.
+        os.replace(compacted.log_path, group[0].log_path)
+        os.replace(compacted.index_path, group[0].index_path)
+        self._sync_directory()
+        compacted.base = group[0].base
+        with self.lock:
+            self.segments[: len(group)] = [compacted]
+            for segment in group:
+                segment.retire()
+        for segment in group[1:]:
+            segment.delete()
+        os.remove(manifest)
+        logger.info(
+            "Compacted %d log segments into %s (%d bytes).",
+            len(group),
+            compacted.log_path,
+            compacted.size,
+            extra={"event": "log_compacted"},
+        )
+
+    def read(
+        self,
+        room: Optional[str] = None,
+        since: Optional[int] = None,
+        after: Optional[float] = None,
+        limit: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ) -> List[Tuple[str, bytes]]:
+        """Read messages back from the log, oldest first.
+
+        Blocks on disk reads, so call it from a thread from the event loop.
+
+        Args:
+            room (Optional[str]): Only read the messages of this room.
+            since (Optional[int]): Only read messages with a higher sequence number.
+            after (Optional[float]): Only read messages from this time on.
+            limit (Optional[int]): Keep at most this many of the latest messages.
+            max_bytes (Optional[int]): Keep at most this many bytes of the latest
+                messages.
+        Returns:
+            List[Tuple[str, bytes]]: The room and frame of each message.
+        """
+        if limit is not None and limit <= 0:
+            return []
+        packed = pack_str(room.encode()) if room is not None else None
+        with self.lock:
+            ranges = [
+                (segment, segment.start(since, after), segment.size)
+                for segment in self.segments
+                if (since is None or segment.max_seq > since)
+                and (after is None or segment.max_time >= after)
+            ]
+            # Segments compacted or dropped meanwhile stay open until this
+            # read is done with them.
+            for segment, _, _ in ranges:
+                segment.readers += 1
+            self.reads += 1
+        found: Deque[Tuple[bytes, bytes]] = deque(maxlen=limit)
+        found_bytes = 0
+        try:
+            for segment, start, size in ranges:
+                with contextlib.closing(segment.records(start, size)) as records:
+                    for _, _, seq, timestamp, record_room, frame in records:
+                        if packed is not None and record_room != packed:
+                            continue
+                        if (since is not None and seq <= since) or (
+                            after is not None and timestamp < after
+                        ):
+                            continue
+                        if len(found) == limit:
+                            found_bytes -= len(found[0][1])
+                        found.append((bytes(record_room), bytes(frame)))
+                        found_bytes += len(frame)
+                        while max_bytes is not None and found_bytes > max_bytes:
+                            found_bytes -= len(found.popleft()[1])
+        finally:
+            with self.lock:
+                for segment, _, _ in ranges:
+                    segment.readers -= 1
+                    if segment.retired and not segment.readers:
+                        segment.close()
+                self.reads -= 1
+                self.idle.notify_all()
+        return [(record_room[1:].decode(), frame) for record_room, frame in found]
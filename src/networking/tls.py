@@ -0,0 +1,114 @@
+"""TLS contexts shared across connections, with client-side session resumption.
+
+Building an `SSLContext` loads certificates and cipher lists, so contexts are
+built once per configuration and reused. Client contexts remember the session
+of each server they connected to and offer it on the next connection, so a
+reconnecting client does an abbreviated handshake instead of a full one.
+"""
+
+import functools
+import ssl
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+CERT_FILE = "ssl/server.crt"
+KEY_FILE = "ssl/server.key"
+
+# Session tickets the server issues after each full handshake (TLS 1.3); each
+# ticket can resume one later connection.
+TLS_TICKETS = 2
+SESSION_CACHE_SIZE = 256
+SESSION_LIFETIME = 3600.0
+
+
+class SessionCache:
+    """The most recent TLS session of each server, up to `size` servers.
+
+    Sessions are dropped once older than `lifetime` seconds, or than the lifetime
+    the server gave them, whichever is shorter.
+    """
+
+    def __init__(self, size: int = SESSION_CACHE_SIZE, lifetime: float = SESSION_LIFETIME):
+        self.size = size
+        self.lifetime = lifetime
+        self.sessions: Dict[str, ssl.SSLSession] = OrderedDict()
+
+    def get(self, server: str) -> Optional[ssl.SSLSession]:
+        session = self.sessions.get(server)
+        if session is None:
+            return None
+        if time.time() - session.time >= min(session.timeout, self.lifetime):
+            del self.sessions[server]
+            return None
+        return session
+
+    def put(self, server: str, session: Optional[ssl.SSLSession]):
+        if session is None or not (session.has_ticket or session.id):
+            return
+        self.sessions[server] = session
+        self.sessions.move_to_end(server)
+        while len(self.sessions) > self.size:
+            self.sessions.popitem(last=False)
+
+
+class ClientContext(ssl.SSLContext):
+    """A client context that offers the cached session of the server it connects to.
+
+    `asyncio` does not pass a session when it wraps a connection, so the lookup
+    happens here, by the server name of the connection.
+    """
+
+    sessions: SessionCache
+
+    def wrap_bio(
+        self,
+        incoming,
+        outgoing,
+        server_side=False,
+        server_hostname=None,
+        session=None,
+    ):
+        if session is None and server_hostname:
+            session = self.sessions.get(server_hostname)
+        return super().wrap_bio(
+            incoming, outgoing, server_side, server_hostname, session
+        )
+
+    def save_session(self, server_hostname: str, ssl_object: ssl.SSLObject):
+        """Remember the session of a connection, to resume it next time."""
+        self.sessions.put(server_hostname, ssl_object.session)
+
+
+@functools.lru_cache(maxsize=None)
+def server_context(
+    certfile: str = CERT_FILE, keyfile: str = KEY_FILE, tickets: int = TLS_TICKETS
+) -> ssl.SSLContext:
+    """Return the server context for a certificate, built on first use.
+
+    Args:
+        tickets (int): Session tickets issued after each full handshake, or 0
+            to disable session resumption.
+    """
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(certfile, keyfile)
+    context.num_tickets = tickets
+    if not tickets:
+        context.options |= ssl.OP_NO_TICKET
+    return context
+
+
+@functools.lru_cache(maxsize=None)
+def client_context(
+    cache_size: int = SESSION_CACHE_SIZE, lifetime: float = SESSION_LIFETIME
+) -> ClientContext:
+    """Return the shared client context, built on first use.
+
+    The server's certificate is not verified, since servers commonly run with
+    a self-signed certificate on a local address.
+    """
+    context = ClientContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.check_hostname = False  # For local IPs
+    context.verify_mode = ssl.CERT_NONE  # Skip certificate verification
+    context.sessions = SessionCache(cache_size, lifetime)
+    return context
@@ -0,0 +1,99 @@
+import asyncio
+import tempfile
+from typing import AsyncIterator
+
+from .protocol.messages import ABORTED, CHUNK_HEADER, FINAL, TransferInfo
+
+CHUNK_SIZE = 64 * 1024
+SPILL_SIZE = 1024 * 1024
+
+
+class IncomingTransfer:
+    """A file (or long message) being received in chunks.
+
+    Chunks are appended to a spooled temporary file, which is kept in memory up
+    to `SPILL_SIZE` bytes and moved to disk past that, so receiving a large file
+    never holds all of it in memory. Chunks only arrive while the client is
+    receiving messages.
+    """
+
+    def __init__(
+        self,
+        sender: int,
+        info: TransferInfo,
+        room: str = "",
+        alias: str = "",
+        spill_size: int = SPILL_SIZE,
+    ):
+        self.sender = sender
+        self.id = info.id
+        self.name = info.name
+        self.size = info.size
+        self.kind = info.kind
+        self.room = room
+        self.alias = alias
+        self.received = 0
+        self.aborted = False
+        self.done = False
+        self.file = tempfile.SpooledTemporaryFile(max_size=spill_size)
+        self._updated = asyncio.Event()
+
+    def feed(self, data: bytes) -> bool:
+        """Add the payload of a CHUNK message.
+
+        Returns:
+            bool: True once the transfer is over, whether it completed or not.
+        """
+        transfer_id, offset, status = CHUNK_HEADER.unpack_from(data)
+        if offset != self.received or status == ABORTED:
+            # A chunk was dropped on the way (or the sender gave up), so what
+            # we have cannot be completed.
+            self.aborted = True
+        else:
+            chunk = memoryview(data)[CHUNK_HEADER.size :]
+            self.file.seek(0, 2)
+            self.file.write(chunk)
+            self.received += len(chunk)
+        self.done = self.aborted or status == FINAL
+        self._updated.set()
+        return self.done
+
+    def abort(self):
+        """Give up on the transfer, as when the connection is lost."""
+        self.aborted = self.done = True
+        self._updated.set()
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yield the data received so far and then the rest as it arrives.
+
+        Raises:
+            ConnectionError: If the transfer is aborted.
+        """
+        position = 0
+        while True:
+            if self.aborted:
+                raise ConnectionError(f"Transfer of {self.name!r} was aborted")
+            if position < self.received:
+                self.file.seek(position)
+                data = self.file.read(min(CHUNK_SIZE, self.received - position))
+                position += len(data)
+                yield data
+            elif self.done:
+                return
+            else:
+                self._updated.clear()
+                await self._updated.wait()
+
+    async def read(self) -> bytes:
+        """Wait for the whole transfer and return it in memory."""
+        return b"".join([chunk async for chunk in self.chunks()])
+
+    async def save(self, path: str):
+        """Write the transfer to `path` as it arrives."""
+        with open(path, "wb") as f:
+            async for chunk in self.chunks():
+                f.write(chunk)
+
+    def close(self):
+        self.file.close()
+
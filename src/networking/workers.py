@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+from typing import Callable, List, Optional
+
+from .connection import Batcher, Connection
+from .logs import setup_logging
+from .loop import use_uvloop
+from .protocol.framing import open_framed_unix_connection, start_framed_unix_server
+from .protocol.io import encode_frame, split_frames
+
+logger = logging.getLogger(__name__)
+
+BUS_QUEUE_SIZE = 65536
+BUS_MAX_FRAME_SIZE = 16 * 1024 * 1024
+BUS_CONNECT_ATTEMPTS = 50
+
+
+class Bus:
+    """A worker's link to the broadcast bus shared by all worker processes.
+
+    Frames published during one event loop iteration are batched into a single bus
+    message, so the IPC hop costs one write per iteration instead of one per frame.
+    """
+
+    def __init__(self, path: str, on_frames: Callable[[List[bytes]], None]):
+        self.path = path
+        self.on_frames = on_frames
+        self.link: Optional[Connection] = None
+        self.batcher = Batcher(self._send_batch)
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        for _ in range(BUS_CONNECT_ATTEMPTS):
+            try:
+                reader, writer = await open_framed_unix_connection(
+                    self.path, max_frame_size=BUS_MAX_FRAME_SIZE
+                )
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.1)
+        else:
+            raise ConnectionError(f"Could not reach the broadcast bus at {self.path}")
+        self.link = Connection(reader, writer, BUS_QUEUE_SIZE)
+        self._task = asyncio.create_task(self._read_loop(reader))
+
+    def publish(self, frame: bytes):
+        """Queue a frame for delivery to every other worker."""
+        self.batcher.add(frame)
+
+    def _send_batch(self, frames: List[bytes]):
+        self.link.send(encode_frame(b"".join(frames)))
+
+    async def _read_loop(self, reader):
+        try:
+            while True:
+                for batch in await reader.read_frames():
+                    self.on_frames(split_frames(batch))
+        except ConnectionError:
+            logger.error(
+                "Lost connection to the broadcast bus.", extra={"event": "bus_lost"}
+            )
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self.link:
+            await self.link.close()
+
+
+class BusHub:
+    """Relays the batches published by each worker to every other worker."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.server = None
+        self.links = set()
+        self.tasks = set()
+
+    async def handle_worker(self, reader, writer):
+        link = Connection(reader, writer, BUS_QUEUE_SIZE)
+        self.links.add(link)
+        self.tasks.add(asyncio.current_task())
+        try:
+            while True:
+                for batch in await reader.read_frames():
+                    frame = encode_frame(batch)
+                    for other in self.links:
+                        if other is not link:
+                            other.send(frame)
+        except ConnectionError:
+            pass
+        finally:
+            self.links.discard(link)
+            self.tasks.discard(asyncio.current_task())
+            await link.close()
+
+    async def start(self):
+        self.server = await start_framed_unix_server(
+            self.handle_worker, self.path, max_frame_size=BUS_MAX_FRAME_SIZE
+        )
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+def _worker_main(
+    server_kwargs: dict, bus_path: str, uvloop: bool, log_options: Optional[dict]
+):
+    from .server import Server, serve
+
+    listener = setup_logging(**log_options) if log_options is not None else None
+    if uvloop:
+        use_uvloop()
+    try:
+        serve(Server(**server_kwargs, reuse_port=True, bus_path=bus_path))
+    finally:
+        if listener:
+            listener.stop()
+
+
+def run_workers(
+    workers: int,
+    server_kwargs: dict,
+    uvloop: bool = False,
+    log_options: Optional[dict] = None,
+):
+    """Run `workers` server processes sharing one port through SO_REUSEPORT.
+
+    The calling process hosts the broadcast bus and supervises the workers until
+    it receives SIGINT or SIGTERM.
+    """
+    bus_dir = tempfile.mkdtemp(prefix="netcomm-")
+    bus_path = os.path.join(bus_dir, "bus.sock")
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_worker_main,
+            args=(server_kwargs, bus_path, uvloop, log_options),
+            name=f"netcomm-worker-{i}",
+        )
+        for i in range(workers)
+    ]
+    hub = BusHub(bus_path)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(hub.start())
+        for process in processes:
+            process.start()
+        logger.info("Started %d workers.", workers, extra={"event": "workers_started"})
+        stopped = loop.create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopped.cancel)
+        try:
+            loop.run_until_complete(stopped)
+        except asyncio.CancelledError:
+            pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+        loop.run_until_complete(hub.stop())
+        loop.close()
+        shutil.rmtree(bus_dir, ignore_errors=True)
+        logger.info("All workers stopped.", extra={"event": "workers_stopped"})